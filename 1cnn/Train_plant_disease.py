@@ -1,37 +1,69 @@
 import os
+import sys
 import tensorflow as tf
 from tensorflow.keras import layers
 from tensorflow.keras.layers import Input, Conv2D, MaxPool2D, Flatten, Dropout, Dense
 from tensorflow.keras.models import Sequential
 from tensorflow.keras.callbacks import EarlyStopping, ModelCheckpoint
-from tensorflow.keras.optimizers import Adam
 
-# حساب عدد الفئات تلقائيًا
+# وحدات المشروع الرئيسي (dataset_shards و training_telemetry) في المجلد الأعلى
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dataset_shards import INDEX_FILE, DatasetShards
+from training_precision import build_optimizer, float32_copy, select_policy
+from training_telemetry import TrainingTelemetry
+
+# أجزاء الصور المفكوكة مسبقاً من build_dataset_shards.py (تُستخدم بدلاً من ملفات JPEG إذا وُجدت)
+TRAIN_SHARDS = os.environ.get('TRAIN_SHARDS', 'shards/train_128')
+VALID_SHARDS = os.environ.get('VALID_SHARDS', 'shards/valid_128')
+
+# وضع التدريب المسرع: float32 | mixed (bfloat16 على المعالج الداعم أو float16 على GPU) | bfloat16 | float16
+TRAIN_PRECISION = os.environ.get('TRAIN_PRECISION', 'float32').lower()
+TRAIN_XLA = os.environ.get('TRAIN_XLA', '0') == '1'  # ترجمة خطوة التدريب بـ XLA (jit_compile)
+TRAIN_EPOCHS = int(os.environ.get('TRAIN_EPOCHS', 50))
+TRAIN_MAX_BATCHES = int(os.environ.get('TRAIN_MAX_BATCHES', 0))  # حد لعدد الدفعات في كل حقبة للمقارنات السريعة (0 للكل)
+TRAIN_OUTPUT_DIR = os.environ.get('TRAIN_OUTPUT_DIR', '.')
+os.makedirs(TRAIN_OUTPUT_DIR, exist_ok=True)
+
 train_dir = 'New Plant Diseases Dataset(Augmented)/New Plant Diseases Dataset(Augmented)/train'
-num_classes = len([name for name in os.listdir(train_dir) if os.path.isdir(os.path.join(train_dir, name))])
-print(f"عدد الفئات المكتشفة: {num_classes}")
+if os.path.exists(os.path.join(TRAIN_SHARDS, INDEX_FILE)) and os.path.exists(os.path.join(VALID_SHARDS, INDEX_FILE)):
+    # 1. تحميل البيانات من الأجزاء (memory-mapped) دون فك ترميز JPEG في كل حقبة
+    train_shards = DatasetShards(TRAIN_SHARDS)
+    valid_shards = DatasetShards(VALID_SHARDS)
+    num_classes = len(train_shards.class_names)
+    print(f"عدد الفئات المكتشفة: {num_classes} (من الأجزاء {TRAIN_SHARDS})")
+    # بكسلات 0-255 بنوع float32 وتسميات categorical مثل image_dataset_from_directory
+    training_set = train_shards.dataset(batch_size=32, shuffle=True).map(
+        lambda images, labels: (tf.cast(images, tf.float32), labels),
+        num_parallel_calls=tf.data.AUTOTUNE).prefetch(tf.data.AUTOTUNE)
+    validation_set = valid_shards.dataset(batch_size=32).map(
+        lambda images, labels: (tf.cast(images, tf.float32), labels),
+        num_parallel_calls=tf.data.AUTOTUNE).prefetch(tf.data.AUTOTUNE)
+else:
+    # حساب عدد الفئات تلقائيًا
+    num_classes = len([name for name in os.listdir(train_dir) if os.path.isdir(os.path.join(train_dir, name))])
+    print(f"عدد الفئات المكتشفة: {num_classes}")
 
-# 1. تحميل البيانات
-training_set = tf.keras.utils.image_dataset_from_directory(
-    train_dir,
-    labels="inferred",
-    label_mode="categorical",
-    class_names=None,
-    color_mode="rgb",
-    batch_size=32,
-    image_size=(128, 128),
-    shuffle=True
-)
-validation_set = tf.keras.utils.image_dataset_from_directory(
-    'New Plant Diseases Dataset(Augmented)/New Plant Diseases Dataset(Augmented)/valid',
-    labels="inferred",
-    label_mode="categorical",
-    class_names=None,
-    color_mode="rgb",
-    batch_size=32,
-    image_size=(128, 128),
-    shuffle=True
-)
+    # 1. تحميل البيانات
+    training_set = tf.keras.utils.image_dataset_from_directory(
+        train_dir,
+        labels="inferred",
+        label_mode="categorical",
+        class_names=None,
+        color_mode="rgb",
+        batch_size=32,
+        image_size=(128, 128),
+        shuffle=True
+    )
+    validation_set = tf.keras.utils.image_dataset_from_directory(
+        'New Plant Diseases Dataset(Augmented)/New Plant Diseases Dataset(Augmented)/valid',
+        labels="inferred",
+        label_mode="categorical",
+        class_names=None,
+        color_mode="rgb",
+        batch_size=32,
+        image_size=(128, 128),
+        shuffle=True
+    )
 
 # 2. Augmentation متقدم باستخدام Keras
 data_augmentation = tf.keras.Sequential([
@@ -43,10 +75,21 @@ data_augmentation = tf.keras.Sequential([
     layers.RandomTranslation(0.1, 0.1),
 ])
 
-# 3. بناء النموذج مع طبقة Augmentation
+policy = select_policy(TRAIN_PRECISION)
+if TRAIN_MAX_BATCHES:
+    training_set = training_set.take(TRAIN_MAX_BATCHES)
+    validation_set = validation_set.take(TRAIN_MAX_BATCHES)
+# Augmentation في خط الإدخال بـ float32 وبالتوازي مع التدريب لكل الأوضاع: طبقاتها لا تُترجم بـ XLA ولا تدعم
+# bfloat16، وإبقاؤها هنا حتى في float32 يجعل مقارنة compare_training_precision.py تقيس أثر الدقة و XLA وحدهما
+training_set = training_set.map(lambda images, labels: (data_augmentation(images, training=True), labels),
+                                num_parallel_calls=tf.data.AUTOTUNE).prefetch(tf.data.AUTOTUNE)
+# الطبقات التالية تحسب بـ bfloat16/float16 مع أوزان float32
+tf.keras.mixed_precision.set_global_policy(policy)
+print(f"الدقة العددية: {policy} - XLA: {TRAIN_XLA}")
+
+# 3. بناء النموذج (Augmentation في خط الإدخال أعلاه)
 model = Sequential()
 model.add(Input(shape=(128,128,3)))
-model.add(data_augmentation)
 model.add(Conv2D(filters=32,kernel_size=3,padding='same',activation='relu'))
 model.add(Conv2D(filters=32,kernel_size=3,activation='relu'))
 model.add(MaxPool2D(pool_size=2,strides=2))
@@ -66,23 +109,34 @@ model.add(Dropout(0.25))
 model.add(Flatten())
 model.add(Dense(units=1500,activation='relu'))
 model.add(Dropout(0.4))
-model.add(Dense(units=num_classes,activation='softmax'))
+model.add(Dense(units=num_classes,activation='softmax',dtype='float32'))  # مخرج float32 لثبات softmax والخسارة
 
 # 4. ضبط المعاملات و EarlyStopping و ModelCheckpoint
 early_stop = EarlyStopping(monitor='val_loss', patience=7, restore_best_weights=True)
-model_checkpoint = ModelCheckpoint('best_model.h5', monitor='val_loss', save_best_only=True)
-model.compile(optimizer=Adam(learning_rate=0.0005), loss='categorical_crossentropy', metrics=['accuracy'])
+model_checkpoint = ModelCheckpoint(os.path.join(TRAIN_OUTPUT_DIR, 'best_model.h5'), monitor='val_loss', save_best_only=True)
+# زمن الخطوة وانتظار خط الإدخال والصور/ثانية والذاكرة والمعالج لكل حقبة في training_hist.json
+# (plot_training_results.py)، وملخصها في training_throughput.json (compare_training_precision.py)
+telemetry = TrainingTelemetry(batch_size=32, path=os.path.join(TRAIN_OUTPUT_DIR, 'training_throughput.json'),
+                              details={'precision': policy, 'xla': TRAIN_XLA})
+model.compile(optimizer=build_optimizer(0.0005, policy), loss='categorical_crossentropy', metrics=['accuracy'],
+              jit_compile=TRAIN_XLA)
 
 # 5. تدريب النموذج مع الكولباكس الجديدة
 history = model.fit(
-    training_set,
+    telemetry.attach(training_set),
     validation_data=validation_set,
-    epochs=50,
-    callbacks=[early_stop, model_checkpoint]
+    epochs=TRAIN_EPOCHS,
+    callbacks=[early_stop, model_checkpoint, telemetry]
 )
 
-# 6. حفظ النموذج والتاريخ
-model.save("trained_model.keras")
+# 6. حفظ النموذج والتاريخ (نسخة float32 للخدمة إذا كان التدريب بدقة مختلطة)
+tf.keras.mixed_precision.set_global_policy('float32')
+if policy != 'float32':
+    model = float32_copy(model)
+    best_path = os.path.join(TRAIN_OUTPUT_DIR, 'best_model.h5')
+    if os.path.exists(best_path):
+        float32_copy(tf.keras.models.load_model(best_path)).save(best_path)
+model.save(os.path.join(TRAIN_OUTPUT_DIR, "trained_model.keras"))
 import json
-with open("training_hist.json","w") as f:
+with open(os.path.join(TRAIN_OUTPUT_DIR, "training_hist.json"),"w") as f:
     json.dump(history.history,f) 
\ No newline at end of file
@@ -2,8 +2,16 @@ from flask import Flask, request, jsonify
 from flask_cors import CORS
 import tensorflow as tf
 import numpy as np
-from PIL import Image
-import io
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# وحدات المشروع الرئيسي (image_preprocess) في المجلد الأعلى
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from image_preprocess import BatchPreprocessor
+from image_input import decode_image_buffer
+from keras_compiled_predictor import CompiledPredictor, parse_buckets
 
 app = Flask(__name__)
 CORS(app)
@@ -48,24 +56,94 @@ CLASS_NAMES = ['Apple___Apple_scab',
     'Tomato___Tomato_mosaic_virus',
     'Tomato___healthy']
 
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_PATH = os.environ.get('CNN38_MODEL_PATH', os.path.join(BASE_DIR, 'trained_model.h5'))
+IMG_SIZE = 128
+TOP_K = int(os.environ.get('CNN38_TOP_K', 3))  # عدد الفئات المرجعة لكل صورة (قابل للتغيير بـ ?top_k=)
+MAX_FILES = int(os.environ.get('CNN38_MAX_FILES', 16))  # أقصى عدد ملفات في طلب /predict واحد
+BATCH_BUCKETS = parse_buckets(os.environ.get('CNN38_BATCH_BUCKETS', '1,2,4,8,16'))
+DECODE_WORKERS = int(os.environ.get('CNN38_DECODE_WORKERS', min(8, os.cpu_count() or 1)))
+
+# النموذج مدرب على بكسلات 0-255 دون تطبيع، لذلك تُمرر دفعة uint8 كما هي ويحولها Keras إلى float داخل الرسم
+# (تصغير bilinear مثل image_dataset_from_directory في Train_plant_disease.py)
+preprocessor = BatchPreprocessor(IMG_SIZE, capacity=max(BATCH_BUCKETS))
+
+# خيوط فك ترميز الصور بالتوازي (cv2.imdecode يحرر GIL)
+decode_pool = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix='decode')
+
+# يُحمل النموذج مرة واحدة ويبقى في الذاكرة بدلاً من تحميله من القرص في كل طلب
+model = None
+predictor = None  # CompiledPredictor حول model: دوال متتبعة مسبقاً آمنة للاستدعاء من عدة خيوط
+model_lock = threading.Lock()
+
+def load_model():
+    """تحميل النموذج عند أول طلب"""
+    global model, predictor
+    if predictor is not None:
+        return predictor
+    # قفل لمنع تحميل النموذج مرتين عند تزامن أول طلبين
+    with model_lock:
+        if predictor is None:
+            print(f"تحميل النموذج من {MODEL_PATH} ...")
+            loaded_model = tf.keras.models.load_model(MODEL_PATH)
+            # rescale=1.0: إدخال uint8 يُحول إلى float داخل الرسم دون تطبيع (مثل التدريب)
+            loaded_predictor = CompiledPredictor(loaded_model, input_shape=(IMG_SIZE, IMG_SIZE, 3),
+                                                 buckets=BATCH_BUCKETS, rescale=1.0)
+            loaded_predictor.warmup()
+            model = loaded_model
+            predictor = loaded_predictor
+            print(f"تم تحميل النموذج (أحجام الدفعات {BATCH_BUCKETS})")
+    return predictor
+
+def decode_image(image_bytes):
+    # فك ترميز JPEG بأكبر تصغير يبقي الضلع الأقصر >= 128
+    return decode_image_buffer(np.frombuffer(image_bytes, dtype=np.uint8), IMG_SIZE, fit='short')
+
+def top_k_predictions(probabilities, k=TOP_K):
+    """احتمالات صورة واحدة -> أعلى k فئة مع درجاتها"""
+    k = max(1, min(k, len(CLASS_NAMES)))
+    indices = np.argsort(probabilities)[::-1][:k]
+    return [{'class': CLASS_NAMES[i], 'score': round(float(probabilities[i]), 4)} for i in indices]
+
+def predict_images(images, k=TOP_K):
+    """صور BGR -> قائمة top-k لكل صورة بتمريرة أمامية واحدة"""
+    with preprocessor.batch(images) as batch:
+        probabilities = load_model().predict(batch)
+    return [top_k_predictions(p, k) for p in probabilities]
+
 def model_prediction(image_bytes):
-    model  = tf.keras.models.load_model('trained_model.h5')
-    image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
-    image = image.resize((128, 128))
-    input_arr = np.array(image)
-    input_arr = np.expand_dims(input_arr, axis=0)
-    prediction = model.predict(input_arr)
-    result_index = np.argmax(prediction)
-    return CLASS_NAMES[result_index]
+    image = decode_image(image_bytes)
+    if image is None:
+        return None
+    return predict_images([image], k=1)[0][0]['class']
 
 @app.route('/predict', methods=['POST'])
 def predict():
-    if 'file' not in request.files:
+    files = request.files.getlist('file')
+    if not files:
         return jsonify({'error': 'No file uploaded'}), 400
-    file = request.files['file']
-    image_bytes = file.read()
-    result = model_prediction(image_bytes)
-    return jsonify({'result': result})
+    if len(files) > MAX_FILES:
+        return jsonify({'error': f'Too many files (max {MAX_FILES})'}), 400
+    k = request.args.get('top_k', default=TOP_K, type=int)
+
+    # فك ترميز كل الملفات بالتوازي ثم تصنيف الصالحة منها في دفعة واحدة
+    images = list(decode_pool.map(decode_image, [f.read() for f in files]))
+    valid = [i for i, image in enumerate(images) if image is not None]
+    if not valid:
+        return jsonify({'error': 'Invalid image'}), 400
+    try:
+        predictions = predict_images([images[i] for i in valid], k)
+    except Exception as e:
+        print(f"خطأ في التنبؤ: {str(e)}")
+        return jsonify({'error': 'Prediction failed'}), 500
+
+    results = [{'filename': f.filename, 'error': 'Invalid image'} for f in files]
+    for i, top_k in zip(valid, predictions):
+        results[i] = {'filename': files[i].filename, 'result': top_k[0]['class'], 'top_k': top_k}
+    if len(files) == 1:
+        # نفس شكل الاستجابة السابق لملف واحد مع إضافة top_k
+        return jsonify({'result': results[0]['result'], 'top_k': results[0]['top_k']})
+    return jsonify({'results': results, 'count': len(results)})
 
 if __name__ == '__main__':
-    app.run(debug=True) 
\ No newline at end of file
+    app.run(debug=True)
\ No newline at end of file
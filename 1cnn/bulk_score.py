@@ -0,0 +1,143 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+import tensorflow as tf
+
+# list_images من وحدات المشروع الرئيسي في المجلد الأعلى
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import top_k_predictions
+from export_yolo_onnx import list_images
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_PATH = os.path.join(BASE_DIR, 'trained_model.keras')
+IMG_SIZE = 128
+CSV_FIELDS = ['path', 'result', 'score', 'top_k']
+
+
+def load_image(path):
+    """نفس معالجة image_dataset_from_directory في Train_plant_disease.py: RGB بحجم 128x128 (bilinear) وقيم 0-255"""
+    image = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+    image = tf.image.resize(image, (IMG_SIZE, IMG_SIZE), method='bilinear')
+    return path, image
+
+
+def build_dataset(paths, batch_size):
+    """فك ترميز الصور بالتوازي ودفعات كبيرة مع تحضير الدفعة التالية أثناء تشغيل النموذج"""
+    dataset = tf.data.Dataset.from_tensor_slices(paths)
+    dataset = dataset.map(load_image, num_parallel_calls=tf.data.AUTOTUNE)
+    # الصور التالفة تُسقط مع مسارها فلا يختل ترتيب النتائج (وتُعاد محاولتها عند الاستئناف)
+    dataset = dataset.apply(tf.data.experimental.ignore_errors())
+    return dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+
+def output_format(path, fmt=None):
+    if fmt:
+        return fmt
+    return 'jsonl' if path.lower().endswith(('.jsonl', '.json')) else 'csv'
+
+
+def scored_paths(path, fmt):
+    """المسارات المصنفة مسبقاً في ملف النتائج (للاستئناف بعد التوقف)"""
+    if not os.path.exists(path):
+        return set()
+    # سطر أخير غير مكتمل عند مقاطعة الكتابة يُحذف حتى لا يلتصق به السطر التالي
+    with open(path, 'rb+') as f:
+        data = f.read()
+        if data and not data.endswith(b'\n'):
+            f.truncate(data.rfind(b'\n') + 1)
+    done = set()
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        if fmt == 'csv':
+            for row in csv.DictReader(f):
+                done.add(row['path'])
+        else:
+            for line in f:
+                try:
+                    done.add(json.loads(line)['path'])
+                except (ValueError, KeyError):
+                    continue
+    return done
+
+
+class ResultWriter:
+    """كتابة النتائج تدريجياً (دفعة بدفعة) إلى CSV أو JSONL"""
+
+    def __init__(self, path, fmt):
+        self.fmt = fmt
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, 'a', encoding='utf-8', newline='')
+        self._csv = csv.DictWriter(self._file, fieldnames=CSV_FIELDS) if fmt == 'csv' else None
+        if self._csv is not None and new_file:
+            self._csv.writeheader()
+
+    def write(self, path, top_k):
+        row = {'path': path, 'result': top_k[0]['class'], 'score': top_k[0]['score']}
+        if self._csv is not None:
+            row['top_k'] = ';'.join(f"{item['class']}:{item['score']}" for item in top_k)
+            self._csv.writerow(row)
+        else:
+            row['top_k'] = top_k
+            self._file.write(json.dumps(row, ensure_ascii=False) + '\n')
+
+    def flush(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='تصنيف كل الصور داخل مجلد بنموذج 1cnn (38 فئة) مع حفظ تدريجي واستئناف')
+    parser.add_argument('input', nargs='?', default=os.path.join(BASE_DIR, 'test'), help='مجلد الصور (يشمل المجلدات الفرعية)')
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--output', default='bulk_scores.csv', help='ملف النتائج (.csv أو .jsonl)')
+    parser.add_argument('--format', choices=['csv', 'jsonl'], help='صيغة النتائج (افتراضياً حسب امتداد الملف)')
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--top-k', type=int, default=3)
+    parser.add_argument('--log-every', type=int, default=10, help='طباعة السرعة كل N دفعات')
+    parser.add_argument('--overwrite', action='store_true', help='البدء من جديد بدلاً من استئناف ملف النتائج')
+    args = parser.parse_args()
+
+    fmt = output_format(args.output, args.format)
+    if args.overwrite and os.path.exists(args.output):
+        os.remove(args.output)
+    done = scored_paths(args.output, fmt)
+    paths = [p for p in list_images(args.input) if p not in done]
+    print(f"{len(paths)} صورة للتصنيف ({len(done)} مصنفة مسبقاً في {args.output})")
+    if not paths:
+        return
+
+    model = tf.keras.models.load_model(args.model)
+    infer = tf.function(lambda x: model(x, training=False), reduce_retracing=True)
+    writer = ResultWriter(args.output, fmt)
+
+    scored = 0
+    started = time.perf_counter()
+    try:
+        for step, (batch_paths, images) in enumerate(build_dataset(paths, args.batch_size), start=1):
+            probabilities = infer(images).numpy()
+            for path, p in zip(batch_paths.numpy(), probabilities):
+                writer.write(path.decode('utf-8'), top_k_predictions(p, args.top_k))
+            # حفظ كل دفعة على القرص حتى يبدأ الاستئناف من آخر دفعة مكتملة
+            writer.flush()
+            scored += len(probabilities)
+            if step % args.log_every == 0:
+                elapsed = time.perf_counter() - started
+                print(f"{scored}/{len(paths)} صورة - {scored / elapsed:.1f} صورة/ثانية")
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"تم تصنيف {scored} صورة خلال {elapsed:.1f} ثانية ({scored / max(elapsed, 1e-9):.1f} صورة/ثانية)")
+    if scored < len(paths):
+        print(f"تم تخطي {len(paths) - scored} صورة تالفة أو غير مدعومة")
+    print(f"تم حفظ النتائج في {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TRAIN_SCRIPT = os.path.join(BASE_DIR, 'Train_plant_disease.py')
+
+# الاسم -> (TRAIN_PRECISION, TRAIN_XLA)
+CONFIGS = {
+    'float32': ('float32', False),
+    'mixed': ('mixed', False),
+    'mixed+xla': ('mixed', True),
+    'float32+xla': ('float32', True),
+}
+
+
+def run_config(name, epochs, max_batches, output_root):
+    """تشغيل Train_plant_disease.py في عملية مستقلة (السياسة العددية عامة لكل العملية) بمجلد إخراج خاص"""
+    precision, xla = CONFIGS[name]
+    output_dir = os.path.join(output_root, name.replace('+', '_'))
+    env = dict(os.environ, TRAIN_PRECISION=precision, TRAIN_XLA='1' if xla else '0', TRAIN_EPOCHS=str(epochs),
+               TRAIN_MAX_BATCHES=str(max_batches), TRAIN_OUTPUT_DIR=output_dir)
+    print(f"=== {name} ===")
+    subprocess.run([sys.executable, TRAIN_SCRIPT], cwd=BASE_DIR, env=env, check=True)
+    with open(os.path.join(output_dir, 'training_throughput.json'), 'r', encoding='utf-8') as f:
+        throughput = json.load(f)
+    with open(os.path.join(output_dir, 'training_hist.json'), 'r', encoding='utf-8') as f:
+        history = json.load(f)
+    epochs_rows = throughput['epochs']
+    # الحقبة الأولى تشمل التتبع وترجمة XLA، لذلك تُستبعد من المتوسط إذا وُجدت غيرها
+    steady = epochs_rows[1:] or epochs_rows
+    rates = [row['images_per_second'] for row in steady if row['images_per_second']]
+    return {
+        'config': name,
+        'policy': throughput.get('precision'),
+        'xla': throughput.get('xla'),
+        'epochs': len(epochs_rows),
+        'first_epoch_s': epochs_rows[0]['epoch_s'] if epochs_rows else None,
+        'mean_epoch_s': round(sum(row['epoch_s'] for row in steady) / len(steady), 2) if steady else None,
+        'images_per_second': round(sum(rates) / len(rates), 1) if rates else None,
+        'final_val_accuracy': round(history['val_accuracy'][-1], 4) if history.get('val_accuracy') else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='مقارنة زمن الحقبة والدقة بين float32 والدقة المختلطة و XLA لنموذج 1cnn')
+    parser.add_argument('--configs', default='float32,mixed,mixed+xla', help=f"من: {', '.join(CONFIGS)}")
+    parser.add_argument('--epochs', type=int, default=3)
+    parser.add_argument('--max-batches', type=int, default=0, help='حد لعدد الدفعات في كل حقبة (0 للكل)')
+    parser.add_argument('--output-root', default=os.path.join(BASE_DIR, 'precision_runs'))
+    parser.add_argument('--out', default=os.path.join(BASE_DIR, 'training_precision_comparison.json'))
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.configs.split(',') if name.strip()]
+    unknown = [name for name in names if name not in CONFIGS]
+    if unknown:
+        parser.error(f"إعدادات غير معروفة: {', '.join(unknown)}")
+
+    results = [run_config(name, args.epochs, args.max_batches, args.output_root) for name in names]
+    baseline = results[0]
+    for row in results:
+        if baseline['mean_epoch_s'] and row['mean_epoch_s']:
+            row['speedup'] = round(baseline['mean_epoch_s'] / row['mean_epoch_s'], 2)
+        if baseline['final_val_accuracy'] is not None and row['final_val_accuracy'] is not None:
+            row['val_accuracy_delta'] = round(row['final_val_accuracy'] - baseline['final_val_accuracy'], 4)
+
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump({'epochs': args.epochs, 'max_batches': args.max_batches, 'results': results}, f,
+                  ensure_ascii=False, indent=2)
+    print(f"{'config':<12} {'policy':<15} {'epoch_s':>8} {'img/s':>8} {'speedup':>8} {'val_acc':>8}")
+    for row in results:
+        print(f"{row['config']:<12} {row['policy']:<15} {row['mean_epoch_s']:>8} {row['images_per_second']:>8} "
+              f"{row.get('speedup', '-'):>8} {row['final_val_accuracy']:>8}")
+    print(f"تم حفظ المقارنة في {args.out}")
+
+
+if __name__ == '__main__':
+    main()
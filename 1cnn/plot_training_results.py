@@ -1,8 +1,10 @@
 import json
+import sys
 import matplotlib.pyplot as plt
 
-# تحميل نتائج التدريب
-with open('training_hist.json', 'r') as f:
+# تحميل نتائج التدريب (المسار اختياري، مثل ../model/training_hist.json من train_cnn_model.py)
+HISTORY_PATH = sys.argv[1] if len(sys.argv) > 1 else 'training_hist.json'
+with open(HISTORY_PATH, 'r') as f:
     history = json.load(f)
 
 # رسم منحنى الدقة
@@ -25,4 +27,51 @@ plt.ylabel('Loss')
 plt.title('Loss Curve')
 plt.legend()
 plt.grid(True)
-plt.show() 
\ No newline at end of file
+plt.show()
+
+# قياسات الأداء من TrainingTelemetry (موجودة فقط في التدريبات الأحدث)
+if 'images_per_second' in history:
+    epochs = range(1, len(history['images_per_second']) + 1)
+
+    # رسم سرعة التدريب وزمن الخطوة
+    fig, ax = plt.subplots(figsize=(10,5))
+    ax.plot(epochs, history['images_per_second'], label='Images/sec', color='purple', marker='o')
+    ax.set_xlabel('Epoch')
+    ax.set_ylabel('Images/sec')
+    ax2 = ax.twinx()
+    ax2.plot(epochs, history['step_ms'], label='Mean step (ms)', color='gray', linestyle='--')
+    if 'step_ms_p95' in history:
+        ax2.plot(epochs, history['step_ms_p95'], label='p95 step (ms)', color='black', linestyle=':')
+    ax2.set_ylabel('Step time (ms)')
+    fig.legend(loc='upper right')
+    ax.set_title('Training Throughput')
+    ax.grid(True)
+    plt.show()
+
+    # رسم انتظار خط الإدخال مقابل الحساب (الباقي حتى 100% هو عمل Keras بين الخطوات)
+    plt.figure(figsize=(10,5))
+    wait = [v * 100 for v in history['input_stall_share']]
+    compute = [v * 100 for v in history['compute_share']]
+    plt.bar(epochs, compute, label='Compute', color='teal')
+    plt.bar(epochs, wait, bottom=compute, label='Input wait (stall)', color='crimson')
+    plt.xlabel('Epoch')
+    plt.ylabel('% of training loop')
+    plt.ylim(0, 100)
+    plt.title('Input Stall vs Compute')
+    plt.legend()
+    plt.grid(True, axis='y')
+    plt.show()
+
+    # رسم الذاكرة واستخدام المعالج
+    fig, ax = plt.subplots(figsize=(10,5))
+    if 'peak_rss_mb' in history:
+        ax.plot(epochs, history['peak_rss_mb'], label='Peak RSS (MB)', color='brown', marker='o')
+    ax.set_xlabel('Epoch')
+    ax.set_ylabel('Peak RSS (MB)')
+    ax2 = ax.twinx()
+    ax2.plot(epochs, history['cpu_percent'], label='CPU utilization (%)', color='darkorange', linestyle='--')
+    ax2.set_ylabel('CPU (%)')
+    fig.legend(loc='upper right')
+    ax.set_title('Memory and CPU')
+    ax.grid(True)
+    plt.show()
@@ -0,0 +1,53 @@
+import tensorflow as tf
+
+PRECISIONS = ('float32', 'mixed', 'bfloat16', 'float16')
+
+
+def cpu_supports_bfloat16():
+    """تعليمات bfloat16 في المعالج (AVX512_BF16 أو AMX) عبر /proc/cpuinfo (لينكس فقط)"""
+    try:
+        with open('/proc/cpuinfo', 'r') as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return 'avx512_bf16' in flags or 'amx_bf16' in flags
+
+
+def select_policy(precision):
+    """float32 | mixed (تلقائي) | bfloat16 | float16 -> اسم سياسة Keras
+    mixed: float16 على GPU، و bfloat16 على معالج يدعمه، وإلا float32"""
+    if precision not in PRECISIONS:
+        raise ValueError(f"TRAIN_PRECISION غير معروف: {precision} (المتاح: {', '.join(PRECISIONS)})")
+    if precision == 'mixed':
+        if tf.config.list_physical_devices('GPU'):
+            precision = 'float16'
+        elif cpu_supports_bfloat16():
+            precision = 'bfloat16'
+        else:
+            print("المعالج لا يدعم bfloat16، سيتم التدريب بـ float32")
+            precision = 'float32'
+    return 'float32' if precision == 'float32' else f"mixed_{precision}"
+
+
+def build_optimizer(learning_rate, policy):
+    """Adam مع الأوزان الرئيسية float32 (سياسة mixed تبقي المتغيرات float32)
+    float16 يحتاج تدرج الخسارة (LossScaleOptimizer) لتجنب تلاشي التدرجات، أما bfloat16 فله نطاق float32 نفسه"""
+    optimizer = tf.keras.optimizers.Adam(learning_rate=learning_rate)
+    if policy == 'mixed_float16':
+        optimizer = tf.keras.mixed_precision.LossScaleOptimizer(optimizer)
+    return optimizer
+
+
+def float32_copy(model):
+    """نسخة float32 من نموذج مدرب بسياسة mixed للخدمة (app.py و bulk_score.py ومحول TFLite):
+    إعداد كل طبقة يحفظ سياستها، فبدون ذلك يعمل الاستدلال بـ bfloat16/float16 البطيء على المعالجات غير الداعمة
+    وتتغير الدرجات قليلاً. الأوزان نفسها float32 في الحالتين فتُنسخ كما هي"""
+    previous = tf.keras.mixed_precision.global_policy()
+    tf.keras.mixed_precision.set_global_policy('float32')
+    try:
+        copy = tf.keras.models.clone_model(
+            model, clone_function=lambda layer: layer.__class__.from_config(dict(layer.get_config(), dtype='float32')))
+        copy.set_weights(model.get_weights())
+    finally:
+        tf.keras.mixed_precision.set_global_policy(previous)
+    return copy
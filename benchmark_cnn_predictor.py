@@ -0,0 +1,78 @@
+import argparse
+import json
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from cascade_gate import latency_summary
+from keras_compiled_predictor import CompiledPredictor, parse_buckets
+
+# نفس مسار وحجم إدخال plant_disease_cnn_api.py
+MODEL_PATH = './model/plant_disease_model.h5'
+IMG_SIZE = 224
+
+
+def time_calls(fn, batch, runs):
+    """زمن كل استدعاء بالمللي ثانية بعد استدعاء تسخين"""
+    fn(batch)
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn(batch)
+        timings.append((time.perf_counter() - started) * 1000.0)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='مقارنة زمن model.predict مع الدالة المتتبعة مسبقاً (و XLA)')
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--runs', type=int, default=200)
+    parser.add_argument('--batch-sizes', default='1,3,8')
+    parser.add_argument('--buckets', default='1,2,4,8')
+    parser.add_argument('--out', default='cnn_predictor_benchmark.json')
+    args = parser.parse_args()
+
+    model = tf.keras.models.load_model(args.model)
+    buckets = parse_buckets(args.buckets)
+    compiled = CompiledPredictor(model, (IMG_SIZE, IMG_SIZE, 3), buckets=buckets)
+    compiled.warmup()
+    variants = {
+        'model.predict': lambda x: model.predict(x, verbose=0),
+        'compiled': compiled.predict,
+    }
+    try:
+        xla = CompiledPredictor(model, (IMG_SIZE, IMG_SIZE, 3), buckets=buckets, jit_compile=True)
+        xla.warmup()
+        variants['compiled_xla'] = xla.predict
+    except Exception as e:
+        print(f"تعذر تفعيل XLA: {str(e)}")
+
+    rng = np.random.default_rng(0)
+    report = {'model': args.model, 'runs': args.runs, 'buckets': list(buckets), 'results': []}
+    for batch_size in parse_buckets(args.batch_sizes):
+        batch = rng.random((batch_size, IMG_SIZE, IMG_SIZE, 3), dtype=np.float32)
+        reference = model.predict(batch, verbose=0)
+        baseline = None
+        for name, fn in variants.items():
+            timings = time_calls(fn, batch, args.runs)
+            summary = latency_summary(timings)
+            baseline = baseline or summary['mean']
+            row = {
+                'variant': name,
+                'batch_size': batch_size,
+                'latency_ms': summary,
+                'speedup': round(baseline / summary['mean'], 2),
+                'max_abs_diff': float(np.abs(fn(batch) - reference).max()),
+            }
+            report['results'].append(row)
+            print(f"{name:<14} batch={batch_size:<2} p50={summary['p50']:>8.2f}ms p95={summary['p95']:>8.2f}ms "
+                  f"speedup={row['speedup']:>5.2f}x diff={row['max_abs_diff']:.2e}")
+
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f'تم حفظ التقرير في {args.out}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+import argparse
+import io
+import json
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from cascade_gate import latency_summary
+from image_input import decode_image_buffer
+from image_preprocess import BatchPreprocessor
+
+
+def legacy_cnn_api(img):
+    """المعالجة السابقة في plant_disease_cnn_api: float64 ومصفوفات وسيطة لكل طلب"""
+    img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    img_resized = cv2.resize(img_rgb, (224, 224))
+    img_normalized = img_resized / 255.0
+    return np.expand_dims(img_normalized, axis=0)
+
+
+def legacy_1cnn(image_bytes):
+    """المعالجة السابقة في 1cnn/app.py عبر PIL"""
+    image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
+    image = image.resize((128, 128))
+    input_arr = np.array(image)
+    return np.expand_dims(input_arr, axis=0)
+
+
+class ThreadLocalPreprocessor:
+    """المعالجة السابقة في image_preprocess: مخزن دفعة كامل لكل خيط (للمقارنة مع المجمع المشترك)"""
+
+    def __init__(self, size, capacity=8):
+        self.size = size
+        self.capacity = capacity
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.allocations = 0
+
+    @contextmanager
+    def batch(self, images):
+        buffers = getattr(self._local, 'buffers', None)
+        if buffers is None:
+            buffers = (np.empty((self.capacity, self.size, self.size, 3), dtype=np.uint8),
+                       np.empty((self.size, self.size, 3), dtype=np.uint8))
+            self._local.buffers = buffers
+            with self._lock:
+                self.allocations += 1
+        batch, resized = buffers
+        for i, img in enumerate(images):
+            cv2.resize(img, (self.size, self.size), dst=resized)
+            cv2.cvtColor(resized, cv2.COLOR_BGR2RGB, dst=batch[i])
+        yield batch[:len(images)]
+
+
+def measure_threaded(preprocessor, img, requests, concurrency):
+    """مثل خادم werkzeug: خيط جديد لكل طلب، و concurrency طلب في نفس الوقت
+    -> زمن الطلب وعدد حجوزات المخازن (مخزن لكل خيط يعني حجزاً لكل طلب)"""
+    timings = []
+    lock = threading.Lock()
+
+    def handle():
+        started = time.perf_counter()
+        with preprocessor.batch((img,)) as batch:
+            batch.sum()  # استهلاك الدفعة داخل الكتلة كما يفعل النموذج
+        with lock:
+            timings.append((time.perf_counter() - started) * 1000.0)
+
+    started = time.perf_counter()
+    for first in range(0, requests, concurrency):
+        threads = [threading.Thread(target=handle) for _ in range(min(concurrency, requests - first))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elapsed = time.perf_counter() - started
+    return {'latency_ms': latency_summary(timings), 'requests_per_second': round(requests / elapsed, 1),
+            'allocations': preprocessor.allocations}
+
+
+def measure(fn, arg, runs):
+    """زمن كل استدعاء بالمللي ثانية، والذاكرة المحجوزة لكل استدعاء (tracemalloc في تشغيل منفصل)"""
+    fn(arg)
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn(arg)
+        timings.append((time.perf_counter() - started) * 1000.0)
+    tracemalloc.start()
+    fn(arg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'latency_ms': latency_summary(timings), 'peak_alloc_kb': round(peak / 1024, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='مقارنة زمن وحجز الذاكرة للمعالجة المسبقة القديمة و image_preprocess')
+    parser.add_argument('--image', help='صورة اختبار (افتراضياً صورة عشوائية 1280x960)')
+    parser.add_argument('--runs', type=int, default=300)
+    parser.add_argument('--concurrency', type=int, default=8, help='طلبات متزامنة في حالة الخيوط المتعددة')
+    parser.add_argument('--out', default='preprocess_benchmark.json')
+    args = parser.parse_args()
+
+    if args.image:
+        img = cv2.imread(args.image, cv2.IMREAD_COLOR)
+    else:
+        img = np.random.default_rng(0).integers(0, 256, (960, 1280, 3), dtype=np.uint8)
+    image_bytes = cv2.imencode('.jpg', img)[1].tobytes()
+
+    cnn_preprocessor = BatchPreprocessor(224)
+    cnn38_preprocessor = BatchPreprocessor(128, capacity=1)
+
+    def pooled(preprocessor, img):
+        # العرض يُستخدم بعد الكتلة لقراءة النوع والحجم فقط (خيط واحد، فلا يكتب طلب آخر في المخزن)
+        with preprocessor.batch((img,)) as batch:
+            return batch
+
+    cases = {
+        'cnn_api_legacy_float64': (legacy_cnn_api, img),
+        'cnn_api_uint8_inplace': (lambda i: pooled(cnn_preprocessor, i), img),
+        '1cnn_legacy_pil': (legacy_1cnn, image_bytes),
+        '1cnn_uint8_inplace': (lambda b: pooled(cnn38_preprocessor, decode_image_buffer(np.frombuffer(b, np.uint8),
+                                                                                        128, fit='short')), image_bytes),
+    }
+    report = {'image_shape': list(img.shape), 'runs': args.runs, 'results': {}}
+    for name, (fn, arg) in cases.items():
+        result = measure(fn, arg, args.runs)
+        output = fn(arg)
+        result['output'] = {'dtype': str(output.dtype), 'nbytes': int(output.nbytes)}
+        report['results'][name] = result
+        print(f"{name:<24} p50={result['latency_ms']['p50']:>7.3f}ms p95={result['latency_ms']['p95']:>7.3f}ms "
+              f"peak_alloc={result['peak_alloc_kb']:>9.1f}KB output={output.dtype}/{output.nbytes // 1024}KB")
+
+    # خيط لكل طلب: مخزن لكل خيط يحجز (8, 224, 224, 3) في كل طلب، والمجمع يعيد استخدام عدد ثابت من المخازن
+    report['threaded'] = {'concurrency': args.concurrency, 'results': {}}
+    for name, preprocessor in (('thread_local', ThreadLocalPreprocessor(224)), ('pooled', BatchPreprocessor(224))):
+        result = measure_threaded(preprocessor, img, args.runs, args.concurrency)
+        report['threaded']['results'][name] = result
+        print(f"{'threaded_' + name:<24} p50={result['latency_ms']['p50']:>7.3f}ms p95={result['latency_ms']['p95']:>7.3f}ms "
+              f"{result['requests_per_second']:>8.1f} req/s allocations={result['allocations']}")
+
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f'تم حفظ التقرير في {args.out}')
+
+
+if __name__ == '__main__':
+    main()
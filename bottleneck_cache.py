@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+
+FEATURE_DIM = 1280  # مخرج MobileNetV2 بعد GlobalAveragePooling2D
+
+
+def cache_key(identifiers, img_size, backbone='mobilenetv2_imagenet'):
+    """بصمة قائمة الصور (المسارات بالترتيب) وحجم الإدخال والعمود الفقري؛ تتغير فيُعاد الاستخراج"""
+    digest = hashlib.sha1(f"{backbone}:{img_size}".encode('utf-8'))
+    for identifier in identifiers:
+        digest.update(str(identifier).encode('utf-8'))
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+
+def feature_extractor(base_model):
+    """العمود الفقري المجمد + التجميع: صور (N, 224, 224, 3) بقيم 0-1 -> ميزات (N, 1280)"""
+    inputs = tf.keras.Input(shape=base_model.input_shape[1:])
+    outputs = tf.keras.layers.GlobalAveragePooling2D()(base_model(inputs, training=False))
+    return tf.keras.Model(inputs, outputs)
+
+
+def build_head(num_classes):
+    """نفس رأس التصنيف في train_cnn_model.py لكن على الميزات المجمعة مباشرة"""
+    return tf.keras.Sequential([
+        tf.keras.Input(shape=(FEATURE_DIM,)),
+        tf.keras.layers.Dense(128, activation='relu'),
+        tf.keras.layers.Dropout(0.5),
+        tf.keras.layers.Dense(num_classes, activation='softmax')
+    ], name='head')
+
+
+def assemble_model(base_model, head):
+    """النموذج الكامل للخدمة: صورة -> العمود الفقري (وضع الاستدلال دائماً لطبقات BatchNorm) -> التجميع -> الرأس"""
+    inputs = tf.keras.Input(shape=base_model.input_shape[1:])
+    features = tf.keras.layers.GlobalAveragePooling2D()(base_model(inputs, training=False))
+    return tf.keras.Model(inputs, head(features))
+
+
+def unfreeze_top(base_model, first_layer='block_13_expand'):
+    """فك تجميد الكتل العليا من MobileNetV2 (من first_layer حتى النهاية) للضبط الدقيق -> عدد الطبقات القابلة للتدريب"""
+    base_model.trainable = True
+    names = [layer.name for layer in base_model.layers]
+    start = names.index(first_layer) if first_layer in names else len(names)
+    for layer in base_model.layers[:start]:
+        layer.trainable = False
+    return len(base_model.layers) - start
+
+
+class FeatureCache:
+    """ميزات العمود الفقري المجمد على القرص (float16 بحجم N x 1280) مع التسميات، لكل جزء من البيانات
+    (التحقق، الصور الأصلية، أو نسخة زيادة بيانات) ملف .npy يُقرأ بـ mmap"""
+
+    def __init__(self, directory, key):
+        self.directory = directory
+        self.key = key
+        os.makedirs(directory, exist_ok=True)
+        self.meta_path = os.path.join(directory, 'meta.json')
+        self.meta = {}
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                self.meta = json.load(f)
+        if self.meta.get('key') != key:
+            # قائمة الصور أو العمود الفقري تغير: لا يُعاد استخدام أي ميزات قديمة
+            self.meta = {'key': key, 'parts': {}}
+        self._infer = {}  # دالة متتبعة واحدة لكل مستخرج حتى لا يُعاد التتبع لكل جزء
+
+    def _paths(self, name):
+        return os.path.join(self.directory, f"{name}_features.npy"), os.path.join(self.directory, f"{name}_labels.npy")
+
+    def get(self, name):
+        """(ميزات mmap، تسميات) أو None إذا لم تُستخرج بعد لهذه البصمة"""
+        if name not in self.meta['parts']:
+            return None
+        features_path, labels_path = self._paths(name)
+        if not (os.path.exists(features_path) and os.path.exists(labels_path)):
+            return None
+        return np.load(features_path, mmap_mode='r'), np.load(labels_path)
+
+    def extract(self, name, extractor, dataset):
+        """تمرير كل دفعات dataset (صور، تسميات one-hot) عبر العمود الفقري مرة واحدة وحفظ الميزات"""
+        cached = self.get(name)
+        if cached is not None:
+            print(f"ميزات {name} محفوظة مسبقاً ({len(cached[1])} صورة)")
+            return cached
+        infer = self._infer.get(id(extractor))
+        if infer is None:
+            infer = tf.function(lambda x: extractor(x, training=False), reduce_retracing=True)
+            self._infer[id(extractor)] = infer
+        features, labels = [], []
+        started = time.perf_counter()
+        for images, one_hot in dataset:
+            features.append(infer(images).numpy().astype(np.float16))
+            labels.append(np.argmax(one_hot.numpy(), axis=1).astype(np.int32))
+            print(f"{name}: {sum(len(l) for l in labels)} صورة", end='\r')
+        elapsed = time.perf_counter() - started
+        features = np.concatenate(features) if features else np.zeros((0, FEATURE_DIM), np.float16)
+        labels = np.concatenate(labels) if labels else np.zeros((0,), np.int32)
+        features_path, labels_path = self._paths(name)
+        np.save(features_path, features)
+        np.save(labels_path, labels)
+        self.meta['parts'][name] = {'images': int(len(labels)), 'extract_s': round(elapsed, 3),
+                                    'images_per_second': round(len(labels) / elapsed, 1) if elapsed > 0 else None}
+        with open(self.meta_path, 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f, ensure_ascii=False, indent=2)
+        print(f"\nتم استخراج ميزات {name}: {len(labels)} صورة خلال {elapsed:.1f} ثانية "
+              f"({features.nbytes / (1024 * 1024):.1f}MB)")
+        return np.load(features_path, mmap_mode='r'), labels
+
+
+def feature_dataset(parts, num_classes, batch_size=32, shuffle=False):
+    """tf.data من أجزاء ميزات محفوظة [(ميزات، تسميات)]: (float32 N x 1280، one-hot)"""
+    features = np.concatenate([np.asarray(f) for f, _ in parts])
+    labels = np.concatenate([l for _, l in parts])
+    dataset = tf.data.Dataset.from_tensor_slices((features, labels))
+    if shuffle:
+        dataset = dataset.shuffle(len(labels), reshuffle_each_iteration=True)
+    dataset = dataset.batch(batch_size).map(
+        lambda x, y: (tf.cast(x, tf.float32), tf.one_hot(y, num_classes)), num_parallel_calls=tf.data.AUTOTUNE)
+    return dataset.prefetch(tf.data.AUTOTUNE)
@@ -0,0 +1,50 @@
+import argparse
+import os
+import time
+
+from dataset_shards import DatasetShards, ShardWriter
+
+# مجموعات البيانات الافتراضية: (مجلد المصدر، مجلد الأجزاء، الحجم) لـ train_cnn_model.py و 1cnn/Train_plant_disease.py
+CNN38_DATA = os.path.join('1cnn', 'New Plant Diseases Dataset(Augmented)', 'New Plant Diseases Dataset(Augmented)')
+DEFAULT_DATASETS = [
+    ('./PlantVillage', './shards/plantvillage_224', 224),
+    (os.path.join(CNN38_DATA, 'train'), os.path.join('1cnn', 'shards', 'train_128'), 128),
+    (os.path.join(CNN38_DATA, 'valid'), os.path.join('1cnn', 'shards', 'valid_128'), 128),
+]
+
+
+def build(source, output, img_size, shard_size, workers):
+    if not os.path.isdir(source):
+        print(f"تخطي {source}: المجلد غير موجود")
+        return None
+    print(f"تحديث أجزاء {source} -> {output} ({img_size}px)")
+    started = time.perf_counter()
+    result = ShardWriter(output, source, img_size, shard_size, workers).update()
+    elapsed = time.perf_counter() - started
+    print(f"أضيفت {result['added']} وحُدثت {result['updated']} وحُذفت {result['removed']} "
+          f"وتعذر فك {result['failed']} صورة خلال {elapsed:.1f} ثانية")
+    print(DatasetShards(output).stats())
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='تحويل مجلدات الصور إلى أجزاء uint8 مفكوكة ومصغرة (memory-mapped) للتدريب')
+    parser.add_argument('--source', help='مجلد الصور (مجلد لكل فئة)؛ افتراضياً كل مجموعات البيانات المعروفة')
+    parser.add_argument('--output', help='مجلد الأجزاء (مطلوب مع --source)')
+    parser.add_argument('--img-size', type=int, default=224)
+    parser.add_argument('--shard-size', type=int, default=2048, help='عدد الصور في كل جزء')
+    parser.add_argument('--workers', type=int, default=None, help='خيوط فك الترميز')
+    args = parser.parse_args()
+
+    if args.source:
+        if not args.output:
+            parser.error('--output مطلوب مع --source')
+        datasets = [(args.source, args.output, args.img_size)]
+    else:
+        datasets = DEFAULT_DATASETS
+    for source, output, img_size in datasets:
+        build(source, output, img_size, args.shard_size, args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+import argparse
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+from cascade_gate import calibrate_threshold, latency_summary
+from export_yolo_onnx import list_images
+
+# لا تُقبل أي تنبؤات للفئة (ثقة المصنف لا تتجاوز 100%)
+NEVER_ACCEPT = 101.0
+
+
+def validation_split(data_dir, split):
+    """نفس تقسيم ImageDataGenerator(validation_split) في train_cnn_model.py:
+    أول split من ملفات كل فئة (بترتيب الأسماء) للتحقق"""
+    samples = []
+    for class_name in sorted(os.listdir(data_dir)):
+        class_dir = os.path.join(data_dir, class_name)
+        if not os.path.isdir(class_dir):
+            continue
+        paths = list_images(class_dir)
+        samples.extend((path, class_name) for path in paths[:int(len(paths) * split)])
+    return samples
+
+
+def predict_all(cnn, samples, batch_size):
+    """تنبؤات المصنف (اسم الفئة، الثقة %) لكل صورة مع زمن المصنف لكل صورة"""
+    predicted, confidences, labels, paths = [], [], [], []
+    per_image_ms = []
+    for start in range(0, len(samples), batch_size):
+        chunk = samples[start:start + batch_size]
+        images, chunk_labels, chunk_paths = [], [], []
+        for path, label in chunk:
+            img = cv2.imread(path, cv2.IMREAD_COLOR)
+            if img is None:
+                continue
+            images.append(img)
+            chunk_labels.append(label)
+            chunk_paths.append(path)
+        if not images:
+            continue
+        started = time.perf_counter()
+        with cnn.preprocess_batch(images) as batch:
+            probabilities = cnn.predict_batch(batch)
+        per_image_ms.append((time.perf_counter() - started) * 1000.0 / len(images))
+        for row in probabilities:
+            index = int(np.argmax(row))
+            predicted.append(str(cnn.class_names[index]))
+            confidences.append(float(row[index]) * 100)
+        labels.extend(chunk_labels)
+        paths.extend(chunk_paths)
+        print(f"{len(labels)}/{len(samples)}", end='\r')
+    print()
+    return predicted, np.array(confidences), labels, paths, per_image_ms
+
+
+def measure_detector_ms(paths, limit):
+    """زمن YOLO لكل صورة على عينة من الصور المصعّدة (نفس مسار plant_disease_api)"""
+    import plant_disease_api as api
+    if api.load_model() is None:
+        print("نموذج YOLO غير متاح، تخطي قياس زمن الكاشف")
+        return None
+    api.warmup_model()
+    timings = []
+    for path in paths[:limit]:
+        with open(path, 'rb') as f:
+            img = api.decode_for_detection(np.frombuffer(f.read(), dtype=np.uint8))
+        if img is None:
+            continue
+        started = time.perf_counter()
+        api.run_batch_inference([img])
+        timings.append((time.perf_counter() - started) * 1000.0)
+    return latency_summary(timings) if timings else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='معايرة عتبات ثقة المصنف للوضع المتتالي في plant_disease_api.py')
+    parser.add_argument('--data', default='./PlantVillage', help='مجلد الصور (مجلد لكل فئة) كما في train_cnn_model.py')
+    parser.add_argument('--validation-split', type=float, default=0.2)
+    parser.add_argument('--target-precision', type=float, default=0.98,
+                        help='أقل دقة مقبولة لتنبؤات المصنف التي لا تُصعّد إلى YOLO')
+    parser.add_argument('--min-class-samples', type=int, default=30,
+                        help='أقل عدد تنبؤات لفئة حتى تحصل على عتبة خاصة بها')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--measure-detector', type=int, default=0, metavar='N',
+                        help='قياس زمن YOLO على N صورة مصعّدة لتقدير الكلفة المتوسطة لكل صورة')
+    parser.add_argument('--out', default='./model/cascade_thresholds.json')
+    args = parser.parse_args()
+
+    import plant_disease_cnn_api as cnn
+    if not cnn.load_model_and_classes():
+        raise SystemExit("تعذر تحميل المصنف")
+    cnn.warmup_model()
+
+    samples = validation_split(args.data, args.validation_split)
+    print(f"معايرة على {len(samples)} صورة تحقق من {args.data}")
+    predicted, confidences, labels, paths, per_image_ms = predict_all(cnn, samples, args.batch_size)
+    if not labels:
+        raise SystemExit("لا توجد صور تحقق")
+    correct = np.array([p == label for p, label in zip(predicted, labels)])
+    predicted = np.array(predicted)
+
+    default, coverage, precision = calibrate_threshold(confidences, correct, args.target_precision)
+    if default is None:
+        print(f"لا توجد عتبة عامة تحقق دقة {args.target_precision}، كل الصور ستُصعّد")
+        default = NEVER_ACCEPT
+
+    # عتبة لكل فئة متوقعة: بعض الفئات يخطئ فيها المصنف بثقة عالية فتحتاج عتبة أعلى
+    per_class = {}
+    for class_name in sorted(set(predicted)):
+        mask = predicted == class_name
+        if mask.sum() < args.min_class_samples:
+            continue
+        threshold, _, _ = calibrate_threshold(confidences[mask], correct[mask], args.target_precision)
+        per_class[class_name] = threshold if threshold is not None else NEVER_ACCEPT
+
+    accepted = np.array([c >= per_class.get(p, default) for p, c in zip(predicted, confidences)])
+    escalation_rate = 1.0 - float(accepted.mean())
+    classifier_ms = latency_summary(per_image_ms)
+    report = {
+        'validation_images': len(labels),
+        'target_precision': args.target_precision,
+        'classifier_accuracy': round(float(correct.mean()), 4),
+        'accepted_accuracy': round(float(correct[accepted].mean()), 4) if accepted.any() else None,
+        'escalation_rate': round(escalation_rate, 4),
+        'classifier_ms_per_image': classifier_ms,
+    }
+    escalated_paths = [path for path, a in zip(paths, accepted) if not a]
+    if args.measure_detector:
+        detector_ms = measure_detector_ms(escalated_paths or paths, args.measure_detector)
+        if detector_ms is not None:
+            report['detector_ms_per_image'] = detector_ms
+            # كلفة المسار المتتالي = المصنف دائماً + الكاشف للصور المصعّدة فقط
+            expected = classifier_ms['mean'] + escalation_rate * detector_ms['mean']
+            report['expected_cascade_ms_per_image'] = round(expected, 2)
+            report['detector_only_ms_per_image'] = detector_ms['mean']
+
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump({'default': default, 'per_class': per_class, 'report': report}, f, ensure_ascii=False, indent=2)
+
+    print(f"العتبة العامة: {default}% (تغطية {coverage:.1%} بدقة {precision if precision is not None else 0:.2%})")
+    print(f"عتبات خاصة لـ {len(per_class)} فئة")
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    print(f"تم حفظ العتبات في {args.out}")
+
+
+if __name__ == '__main__':
+    main()
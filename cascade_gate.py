@@ -0,0 +1,104 @@
+import json
+import os
+import threading
+from collections import deque
+
+import numpy as np
+
+
+class CascadeThresholds:
+    """عتبات ثقة المصنف (٪) التي يُقبل فوقها جوابه دون تشغيل كاشف YOLO، لكل فئة أو عتبة عامة"""
+
+    def __init__(self, default=90.0, per_class=None, source=None):
+        self.default = float(default)
+        self.per_class = dict(per_class or {})
+        self.source = source
+
+    @classmethod
+    def load(cls, path, default=90.0):
+        """قراءة ملف calibrate_cascade.py؛ العتبة العامة فقط إذا لم يوجد الملف"""
+        if not path or not os.path.exists(path):
+            return cls(default)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            thresholds = cls(data.get('default', default), data.get('per_class'), source=path)
+            print(f"تم تحميل عتبات المصنف من {path} (العامة {thresholds.default}%، "
+                  f"{len(thresholds.per_class)} فئة)")
+            return thresholds
+        except (OSError, ValueError) as e:
+            print(f"خطأ في قراءة عتبات المصنف {path}: {str(e)}")
+            return cls(default)
+
+    def threshold_for(self, class_name):
+        return self.per_class.get(str(class_name), self.default)
+
+    def accept(self, class_name, confidence):
+        return confidence >= self.threshold_for(class_name)
+
+
+class CascadeStats:
+    """نسبة التصعيد إلى الكاشف والمئينات لزمن الطلب الكامل في كل مسار"""
+
+    def __init__(self, window=2000):
+        self._lock = threading.Lock()
+        self._latencies = {'classifier': deque(maxlen=window), 'detector': deque(maxlen=window)}
+        self.accepted = 0
+        self.escalated = 0
+        self.classifier_failures = 0
+
+    def record(self, path, seconds):
+        with self._lock:
+            if path == 'classifier':
+                self.accepted += 1
+            else:
+                self.escalated += 1
+            self._latencies[path].append(seconds * 1000.0)
+
+    def record_failure(self):
+        with self._lock:
+            self.classifier_failures += 1
+
+    def stats(self):
+        with self._lock:
+            total = self.accepted + self.escalated
+            by_path = {path: np.array(values) for path, values in self._latencies.items()}
+            snapshot = {
+                'requests': total,
+                'accepted_by_classifier': self.accepted,
+                'escalated_to_detector': self.escalated,
+                'escalation_rate': round(self.escalated / total, 4) if total else None,
+                'classifier_failures': self.classifier_failures,
+            }
+        combined = np.concatenate([v for v in by_path.values() if len(v)]) if total else None
+        for name, values in list(by_path.items()) + [('all', combined)]:
+            if values is not None and len(values):
+                snapshot[f'latency_ms_{name}'] = latency_summary(values)
+        return snapshot
+
+
+def latency_summary(values_ms):
+    values = np.asarray(values_ms, dtype=np.float64)
+    return {
+        'mean': round(float(values.mean()), 2),
+        'p50': round(float(np.percentile(values, 50)), 2),
+        'p95': round(float(np.percentile(values, 95)), 2),
+        'p99': round(float(np.percentile(values, 99)), 2),
+    }
+
+
+def calibrate_threshold(confidences, correct, target_precision, candidates=None, min_samples=1):
+    """أصغر عتبة تبقي دقة التنبؤات المقبولة >= target_precision (أصغر عتبة = أقل تصعيد)
+    تعيد (العتبة، نسبة المقبول، دقة المقبول)؛ العتبة None إذا لم تحقق أي عتبة الدقة المطلوبة"""
+    confidences = np.asarray(confidences, dtype=np.float64)
+    correct = np.asarray(correct, dtype=bool)
+    if candidates is None:
+        candidates = np.arange(50.0, 100.0, 0.5)
+    for threshold in candidates:
+        accepted = confidences >= threshold
+        if accepted.sum() < min_samples:
+            continue
+        precision = float(correct[accepted].mean())
+        if precision >= target_precision:
+            return float(threshold), float(accepted.mean()), precision
+    return None, 0.0, None
@@ -0,0 +1,214 @@
+import collections
+import math
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from export_yolo_onnx import list_images
+
+AUTOTUNE = tf.data.AUTOTUNE
+
+# نفس إعدادات ImageDataGenerator السابقة في train_cnn_model.py
+ROTATION_RANGE = 20      # درجات
+SHIFT_RANGE = 0.2        # نسبة من العرض والارتفاع
+SHEAR_RANGE = 0.2        # درجات (مثل shear_range في ImageDataGenerator)
+ZOOM_RANGE = 0.2         # تكبير/تصغير مستقل لكل محور بين 0.8 و 1.2
+
+
+def split_samples(data_dir, validation_split):
+    """نفس تقسيم ImageDataGenerator(validation_split) و flow_from_directory:
+    الفئات بترتيب الأسماء، وأول validation_split من ملفات كل فئة للتحقق والباقي للتدريب
+    -> (class_names, [(path, index)] للتدريب, [(path, index)] للتحقق)"""
+    class_names = sorted(name for name in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, name)))
+    training, validation = [], []
+    for index, class_name in enumerate(class_names):
+        paths = list_images(os.path.join(data_dir, class_name))
+        split = int(len(paths) * validation_split)
+        validation.extend((path, index) for path in paths[:split])
+        training.extend((path, index) for path in paths[split:])
+    return class_names, training, validation
+
+
+def decode_resized(path, img_size):
+    """قراءة وفك ترميز الصورة وتصغيرها (bilinear مثل cv2.resize في الخدمة) مع إبقائها uint8 للتخزين المؤقت"""
+    image = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+    image = tf.image.resize(image, (img_size, img_size), method='bilinear')
+    image = tf.cast(tf.round(tf.clip_by_value(image, 0.0, 255.0)), tf.uint8)
+    image.set_shape((img_size, img_size, 3))
+    return image
+
+
+def _affine_matrices(n, height, width):
+    """مصفوفات تحويل عشوائية (n, 3, 3) بنفس تركيب ImageDataGenerator.apply_affine_transform:
+    دوران ثم إزاحة ثم قص ثم تكبير حول مركز الصورة، من إحداثيات الإخراج إلى الإدخال"""
+    def uniform(limit):
+        return tf.random.uniform((n,), -limit, limit)
+
+    theta = uniform(ROTATION_RANGE * math.pi / 180)
+    tx = uniform(SHIFT_RANGE) * height
+    ty = uniform(SHIFT_RANGE) * width
+    shear = uniform(SHEAR_RANGE * math.pi / 180)
+    zx = tf.random.uniform((n,), 1 - ZOOM_RANGE, 1 + ZOOM_RANGE)
+    zy = tf.random.uniform((n,), 1 - ZOOM_RANGE, 1 + ZOOM_RANGE)
+    zeros, ones = tf.zeros((n,)), tf.ones((n,))
+
+    def matrix(rows):
+        return tf.stack([tf.stack(row, axis=-1) for row in rows], axis=1)
+
+    rotation = matrix([[tf.cos(theta), -tf.sin(theta), zeros], [tf.sin(theta), tf.cos(theta), zeros], [zeros, zeros, ones]])
+    shift = matrix([[ones, zeros, tx], [zeros, ones, ty], [zeros, zeros, ones]])
+    shearing = matrix([[ones, -tf.sin(shear), zeros], [zeros, tf.cos(shear), zeros], [zeros, zeros, ones]])
+    zoom = matrix([[zx, zeros, zeros], [zeros, zy, zeros], [zeros, zeros, ones]])
+
+    o_x, o_y = height / 2 - 0.5, width / 2 - 0.5
+    offset = tf.constant([[1, 0, o_x], [0, 1, o_y], [0, 0, 1]], tf.float32)
+    reset = tf.constant([[1, 0, -o_x], [0, 1, -o_y], [0, 0, 1]], tf.float32)
+    return offset @ rotation @ shift @ shearing @ zoom @ reset
+
+
+def augment_batch(images, labels):
+    """زيادة البيانات على دفعة كاملة دفعة واحدة (تحويل أفيني + قلب أفقي) ثم التطبيع إلى 0-1"""
+    n = tf.shape(images)[0]
+    height, width = images.shape[1], images.shape[2]
+    # أول 8 قيم من كل مصفوفة (الصف الأخير [0, 0, 1]) بصيغة ImageProjectiveTransform
+    transforms = tf.reshape(_affine_matrices(n, height, width), (n, 9))[:, :8]
+    images = tf.raw_ops.ImageProjectiveTransformV3(
+        images=tf.cast(images, tf.float32), transforms=transforms, output_shape=tf.constant([height, width]),
+        fill_value=0.0, interpolation='BILINEAR', fill_mode='NEAREST')
+    flip = tf.random.uniform((n, 1, 1, 1)) < 0.5
+    images = tf.where(flip, tf.reverse(images, axis=[2]), images)
+    return images * (1.0 / 255), labels
+
+
+def normalize_batch(images, labels):
+    return tf.cast(images, tf.float32) * (1.0 / 255), labels
+
+
+def build_dataset(samples, num_classes, img_size=224, batch_size=32, training=False, cache='', augment=None):
+    """خط إدخال tf.data: فك ترميز متوازٍ، تخزين الصور المفكوكة (uint8) مؤقتاً، ثم خلط وزيادة بيانات
+    متوازية على الدفعات، وتحضير الدفعات التالية أثناء خطوة التدريب
+    cache: '' في الذاكرة، أو مسار ملف على القرص، أو None لتعطيله
+    augment: زيادة البيانات دون خلط (افتراضياً مع training فقط)"""
+    augment = training if augment is None else augment
+    paths = [path for path, _ in samples]
+    labels = [label for _, label in samples]
+    dataset = tf.data.Dataset.from_tensor_slices((paths, labels))
+    dataset = dataset.map(lambda path, label: (decode_resized(path, img_size), tf.one_hot(label, num_classes)),
+                          num_parallel_calls=AUTOTUNE)
+    if cache is not None:
+        dataset = dataset.cache(cache)
+    if training:
+        dataset = dataset.shuffle(min(len(samples), 10000), reshuffle_each_iteration=True)
+        # دفعات بحجم ثابت مثل steps_per_epoch = samples // batch_size السابق
+        dataset = dataset.batch(batch_size, drop_remainder=True)
+        options = tf.data.Options()
+        options.deterministic = False  # ترتيب الدفعات غير مهم مع الخلط
+        dataset = dataset.with_options(options)
+    else:
+        dataset = dataset.batch(batch_size)
+    dataset = dataset.map(augment_batch if augment else normalize_batch, num_parallel_calls=AUTOTUNE)
+    return dataset.prefetch(AUTOTUNE)
+
+
+def build_shard_dataset(shards, positions, batch_size=32, training=False, augment=None):
+    """نفس build_dataset لكن من أجزاء dataset_shards المفكوكة مسبقاً بدلاً من ملفات JPEG"""
+    augment = training if augment is None else augment
+    dataset = shards.dataset(positions, batch_size, shuffle=training, drop_remainder=training)
+    dataset = dataset.map(augment_batch if augment else normalize_batch, num_parallel_calls=AUTOTUNE)
+    return dataset.prefetch(AUTOTUNE)
+
+
+def measure_pipeline(dataset, steps=50):
+    """سرعة خط الإدخال وحده دون النموذج (صورة/ثانية)، لمقارنتها بسرعة خطوة التدريب"""
+    images = 0
+    iterator = iter(dataset)
+    next(iterator)  # تجاهل زمن إنشاء المكرر وملء المخازن
+    started = time.perf_counter()
+    for _ in range(steps):
+        try:
+            batch, _ = next(iterator)
+        except StopIteration:
+            break
+        images += int(batch.shape[0])
+    elapsed = time.perf_counter() - started
+    return images / elapsed if elapsed > 0 else 0.0
+
+
+class InputStallMonitor(tf.keras.callbacks.Callback):
+    """زمن انتظار خطوة التدريب لخط الإدخال في كل حقبة
+    attach() يضيف مرحلة أخيرة تسجل لحظة وصول كل دفعة من مخزن prefetch، والفرق بينها وبين بداية
+    الخطوة هو زمن التوقف (صفر تقريباً إذا كان خط الإدخال يسبق النموذج).
+    النسبة من زمن حلقة التدريب (بداية أول دفعة حتى نهاية آخر دفعة) وليس الحقبة كاملة، لأن التحقق لا ينتظر
+    خط إدخال التدريب"""
+
+    def __init__(self, verbose=True):
+        super().__init__()
+        self.verbose = verbose
+        self._arrivals = collections.deque()
+        self._batch_begin = None
+        self._epoch_begin = None
+        self._loop_begin = None
+        self._loop_end = None
+        self._stall = 0.0
+        self._steps = 0
+        self._images = 0
+        self.epochs = []
+
+    def _mark(self, count):
+        self._arrivals.append((time.perf_counter(), int(count)))
+        return np.float32(0)
+
+    def attach(self, dataset):
+        def mark(images, labels):
+            marker = tf.py_function(self._mark, [tf.shape(images)[0]], tf.float32)
+            with tf.control_dependencies([marker]):
+                return tf.identity(images), labels
+        # بدون num_parallel_calls: تُنفذ المرحلة عند طلب الخطوة للدفعة وليس مسبقاً
+        return dataset.map(mark)
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._arrivals.clear()
+        self._stall = 0.0
+        self._steps = 0
+        self._images = 0
+        self._loop_begin = self._loop_end = None
+        self._epoch_begin = time.perf_counter()
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self._batch_begin = time.perf_counter()
+        if self._loop_begin is None:
+            self._loop_begin = self._batch_begin
+
+    def on_train_batch_end(self, batch, logs=None):
+        if self._arrivals and self._batch_begin is not None:
+            arrival, count = self._arrivals.popleft()
+            self._stall += max(0.0, arrival - self._batch_begin)
+            self._images += count
+        self._steps += 1
+        self._loop_end = time.perf_counter()
+
+    def loop_seconds(self):
+        """زمن حلقة التدريب في الحقبة الحالية (دون التحقق)"""
+        return (self._loop_end - self._loop_begin) if self._loop_begin is not None else 0.0
+
+    def on_epoch_end(self, epoch, logs=None):
+        elapsed = time.perf_counter() - self._epoch_begin
+        loop_s = self.loop_seconds()
+        share = self._stall / loop_s if loop_s > 0 else 0.0
+        self.epochs.append({'epoch': epoch + 1, 'steps': self._steps, 'images': self._images,
+                            'stall_s': round(self._stall, 3), 'train_s': round(loop_s, 3), 'epoch_s': round(elapsed, 3),
+                            'stall_share': round(share, 4)})
+        if logs is not None:
+            logs['input_stall_s'] = self._stall
+            logs['input_stall_share'] = share
+        if self.verbose:
+            print(f"\nانتظار خط الإدخال: {self._stall:.1f} ثانية من {loop_s:.1f} للخطوات ({share * 100:.1f}%)")
+
+    def summary(self):
+        stall = sum(e['stall_s'] for e in self.epochs)
+        train = sum(e['train_s'] for e in self.epochs)
+        return {'stall_s': round(stall, 3), 'train_s': round(train, 3),
+                'epoch_s': round(sum(e['epoch_s'] for e in self.epochs), 3),
+                'stall_share': round(stall / train, 4) if train else 0.0, 'epochs': self.epochs}
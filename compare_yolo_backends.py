@@ -0,0 +1,128 @@
+import argparse
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+import torch
+
+from export_yolo_onnx import list_images
+from plant_disease_api import MODEL_PATH, YOLOV5_DIR, YOLO_IMG_SIZE, CONF_THRESHOLD
+from yolo_onnx_backend import OnnxYoloDetector, default_onnx_path
+from yolo_postprocess import box_iou, detections_to_numpy
+
+
+def load_torch_backend():
+    """مسار PyTorch المرجعي بنفس إعدادات plant_disease_api"""
+    model = torch.hub.load(YOLOV5_DIR, 'custom', path=MODEL_PATH, source='local')
+    model.conf = CONF_THRESHOLD
+    model.iou = 0.45
+
+    def run(images):
+        results = model([img[:, :, ::-1] for img in images], size=YOLO_IMG_SIZE)
+        return [detections_to_numpy(det) for det in results.xyxy]
+    return run
+
+
+def time_backend(run, img, runs):
+    """تشغيل الخلفية عدة مرات على صورة واحدة وإرجاع آخر نتيجة ووسيط الزمن بالمللي ثانية"""
+    timings = []
+    det = None
+    for _ in range(runs):
+        started = time.perf_counter()
+        det = run([img])[0]
+        timings.append((time.perf_counter() - started) * 1000.0)
+    return det, float(np.median(timings))
+
+
+def compare_detections(reference, det):
+    """مقارنة أفضل صندوق من كل خلفية: تطابق الفئة، IoU، وفرق الثقة"""
+    if len(reference) == 0 or len(det) == 0:
+        return {'class_match': len(reference) == len(det), 'iou': None, 'conf_delta': None}
+    ref_best = reference[np.argmax(reference[:, 4])]
+    best = det[np.argmax(det[:, 4])]
+    return {
+        'class_match': int(ref_best[5]) == int(best[5]),
+        'iou': float(box_iou(ref_best[:4], best[None, :4])[0]),
+        'conf_delta': float(abs(ref_best[4] - best[4])),
+    }
+
+
+def summarize(name, latencies, comparisons, reference_latencies):
+    lat = np.array(latencies)
+    summary = {
+        'backend': name,
+        'images': len(latencies),
+        'latency_ms': {
+            'mean': round(float(lat.mean()), 2),
+            'p50': round(float(np.percentile(lat, 50)), 2),
+            'p95': round(float(np.percentile(lat, 95)), 2),
+        },
+        'speedup_vs_torch': round(float(np.mean(reference_latencies) / lat.mean()), 2),
+    }
+    if comparisons:
+        ious = [c['iou'] for c in comparisons if c['iou'] is not None]
+        deltas = [c['conf_delta'] for c in comparisons if c['conf_delta'] is not None]
+        summary['top1_agreement'] = round(float(np.mean([c['class_match'] for c in comparisons])), 4)
+        summary['mean_best_box_iou'] = round(float(np.mean(ious)), 4) if ious else None
+        summary['mean_conf_delta'] = round(float(np.mean(deltas)), 4) if deltas else None
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='مقارنة دقة وزمن خلفية ONNX Runtime مع مسار PyTorch')
+    parser.add_argument('--images', required=True, help='مجلد صور الاختبار')
+    parser.add_argument('--onnx', nargs='*', help='ملفات ONNX للمقارنة (افتراضياً best.onnx و best-int8.onnx)')
+    parser.add_argument('--limit', type=int, default=200)
+    parser.add_argument('--runs', type=int, default=3, help='عدد مرات التشغيل لكل صورة')
+    parser.add_argument('--out', default='yolo_backend_report.json')
+    args = parser.parse_args()
+
+    onnx_paths = args.onnx or [p for p in (default_onnx_path(MODEL_PATH), default_onnx_path(MODEL_PATH, int8=True))
+                               if os.path.exists(p)]
+    backends = {'torch': load_torch_backend()}
+    for path in onnx_paths:
+        backends[os.path.basename(path)] = OnnxYoloDetector(path, img_size=YOLO_IMG_SIZE, conf_thres=CONF_THRESHOLD)
+
+    images = list_images(args.images)[:args.limit]
+    print(f'مقارنة {len(backends)} خلفيات على {len(images)} صورة')
+
+    # تسخين كل خلفية قبل القياس
+    dummy = np.zeros((YOLO_IMG_SIZE, YOLO_IMG_SIZE, 3), dtype=np.uint8)
+    for run in backends.values():
+        run([dummy])
+
+    latencies = {name: [] for name in backends}
+    comparisons = {name: [] for name in backends if name != 'torch'}
+    for path in images:
+        img = cv2.imread(path, cv2.IMREAD_COLOR)
+        if img is None:
+            continue
+        reference, ms = time_backend(backends['torch'], img, args.runs)
+        latencies['torch'].append(ms)
+        for name, run in backends.items():
+            if name == 'torch':
+                continue
+            det, ms = time_backend(run, img, args.runs)
+            latencies[name].append(ms)
+            comparisons[name].append(compare_detections(reference, det))
+
+    report = {
+        'images_dir': args.images,
+        'img_size': YOLO_IMG_SIZE,
+        'conf_threshold': CONF_THRESHOLD,
+        'backends': [summarize(name, latencies[name], comparisons.get(name), latencies['torch'])
+                     for name in backends],
+    }
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    for row in report['backends']:
+        print(f"{row['backend']:<24} p50={row['latency_ms']['p50']:>8.2f}ms p95={row['latency_ms']['p95']:>8.2f}ms "
+              f"speedup={row['speedup_vs_torch']:>5.2f}x agreement={row.get('top1_agreement', 1.0)}")
+    print(f'تم حفظ التقرير في {args.out}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+import argparse
+import json
+import os
+import random
+import time
+
+import cv2
+import numpy as np
+import tensorflow as tf
+
+from calibrate_cascade import validation_split
+from cascade_gate import latency_summary
+from export_yolo_onnx import list_images
+from tflite_backend import TFLitePredictor, default_tflite_path
+
+# نفس مسارات وحجم إدخال plant_disease_cnn_api.py و train_cnn_model.py
+MODEL_PATH = './model/plant_disease_model.h5'
+DATA_PATH = './PlantVillage'
+IMG_SIZE = 224
+
+
+def load_image(path):
+    """نفس معالجة plant_disease_cnn_api: RGB بحجم 224x224 وقيم بين 0 و 1 (float32)"""
+    img = cv2.imread(path, cv2.IMREAD_COLOR)
+    if img is None:
+        return None
+    img = cv2.resize(cv2.cvtColor(img, cv2.COLOR_BGR2RGB), (IMG_SIZE, IMG_SIZE))
+    return img.astype(np.float32) / 255.0
+
+
+def representative_dataset(paths):
+    """صور المعايرة لتكميم INT8 (من بيانات التدريب وليس التحقق)"""
+    def generator():
+        for path in paths:
+            img = load_image(path)
+            if img is not None:
+                yield [img[np.newaxis]]
+    return generator
+
+
+def convert(model, variant, calibration_paths):
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if variant == 'fp16':
+        converter.target_spec.supported_types = [tf.float16]
+    else:
+        # تكميم كامل: الأوزان والتنشيطات والإدخال والإخراج بـ 8 بت
+        converter.representative_dataset = representative_dataset(calibration_paths)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.uint8
+        converter.inference_output_type = tf.uint8
+    return converter.convert()
+
+
+def evaluate(predict_fn, samples, class_names, batch_size=32):
+    """دقة top-1 وزمن كل صورة والاحتمالات على صور التحقق"""
+    probabilities, labels, timings = [], [], []
+    class_index = {str(name): i for i, name in enumerate(class_names)}
+    for start in range(0, len(samples), batch_size):
+        images, chunk_labels = [], []
+        for path, label in samples[start:start + batch_size]:
+            img = load_image(path)
+            if img is not None and label in class_index:
+                images.append(img)
+                chunk_labels.append(class_index[label])
+        if not images:
+            continue
+        batch = np.stack(images)
+        started = time.perf_counter()
+        probabilities.append(np.asarray(predict_fn(batch), dtype=np.float32))
+        timings.append((time.perf_counter() - started) * 1000.0 / len(images))
+        labels.extend(chunk_labels)
+    probabilities = np.concatenate(probabilities) if probabilities else np.zeros((0, len(class_names)))
+    return probabilities, np.array(labels), timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='تحويل مصنف MobileNetV2 إلى TFLite بصيغتي float16 و INT8 مع تقرير الدقة')
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--data', default=DATA_PATH, help='مجلد الصور (مجلد لكل فئة)')
+    parser.add_argument('--variants', default='fp16,int8')
+    parser.add_argument('--calibration-images', type=int, default=300)
+    parser.add_argument('--validation-split', type=float, default=0.2)
+    parser.add_argument('--eval-limit', type=int, default=0, help='أقصى عدد صور تحقق للتقرير (0 للكل)')
+    parser.add_argument('--threads', type=int, default=2)
+    parser.add_argument('--report', default='./model/tflite_report.json')
+    args = parser.parse_args()
+
+    model = tf.keras.models.load_model(args.model)
+    class_names = np.load(os.path.join(os.path.dirname(args.model), 'class_names.npy'), allow_pickle=True)
+
+    validation = validation_split(args.data, args.validation_split)
+    validation_paths = {path for path, _ in validation}
+    # صور المعايرة من جزء التدريب فقط حتى لا يتأثر تقرير الدقة بها
+    training_paths = [p for p in list_images(args.data) if p not in validation_paths]
+    random.Random(0).shuffle(training_paths)
+    calibration_paths = training_paths[:args.calibration_images]
+    if args.eval_limit:
+        validation = random.Random(0).sample(validation, min(args.eval_limit, len(validation)))
+
+    outputs = {}
+    for variant in [v.strip() for v in args.variants.split(',') if v.strip()]:
+        path = default_tflite_path(args.model, variant)
+        print(f"تحويل {variant} ...")
+        with open(path, 'wb') as f:
+            f.write(convert(model, variant, calibration_paths))
+        outputs[variant] = path
+        print(f"تم الحفظ في {path} ({os.path.getsize(path) / (1024 * 1024):.1f}MB)")
+
+    print(f"تقييم على {len(validation)} صورة تحقق")
+    reference, labels, keras_ms = evaluate(lambda x: model.predict(x, verbose=0), validation, class_names)
+    reference_top1 = reference.argmax(axis=1)
+    report = {
+        'model': args.model,
+        'validation_images': int(len(labels)),
+        'calibration_images': len(calibration_paths),
+        'variants': [{
+            'variant': 'keras',
+            'path': args.model,
+            'size_mb': round(os.path.getsize(args.model) / (1024 * 1024), 2),
+            'accuracy': round(float((reference_top1 == labels).mean()), 4) if len(labels) else None,
+            'ms_per_image': latency_summary(keras_ms) if keras_ms else None,
+        }],
+    }
+    for variant, path in outputs.items():
+        predictor = TFLitePredictor(path, num_threads=args.threads)
+        probabilities, _, ms = evaluate(predictor.predict, validation, class_names)
+        top1 = probabilities.argmax(axis=1)
+        accuracy = float((top1 == labels).mean()) if len(labels) else None
+        row = {
+            'variant': variant,
+            'path': path,
+            'size_mb': round(os.path.getsize(path) / (1024 * 1024), 2),
+            'accuracy': round(accuracy, 4) if accuracy is not None else None,
+            'accuracy_delta': round(accuracy - report['variants'][0]['accuracy'], 4) if accuracy is not None else None,
+            'top1_agreement_with_keras': round(float((top1 == reference_top1).mean()), 4) if len(labels) else None,
+            'max_prob_delta': round(float(np.abs(probabilities - reference).max()), 4) if len(labels) else None,
+            'ms_per_image': latency_summary(ms) if ms else None,
+        }
+        report['variants'].append(row)
+
+    with open(args.report, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    for row in report['variants']:
+        ms = row['ms_per_image'] or {}
+        print(f"{row['variant']:<6} {row['size_mb']:>7.2f}MB accuracy={row['accuracy']} "
+              f"delta={row.get('accuracy_delta', 0.0)} p50={ms.get('p50')}ms")
+    print(f"تم حفظ التقرير في {args.report}")
+
+
+if __name__ == '__main__':
+    main()
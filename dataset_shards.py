@@ -0,0 +1,221 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from export_yolo_onnx import list_images
+
+INDEX_FILE = 'index.json'
+INDEX_VERSION = 1
+REMOVED = -1  # وسم الصور المحذوفة من المصدر (تبقى خاناتها في الأجزاء ويتجاهلها القارئ)
+
+
+def shard_file(index):
+    return f"shard_{index:05d}.npy"
+
+
+def load_resized(path, img_size):
+    """صورة RGB بحجم img_size x img_size من نوع uint8 (bilinear مثل الخدمة وخط tf.data)، أو None إذا تعذر فكها"""
+    img = cv2.imread(path, cv2.IMREAD_COLOR)
+    if img is None:
+        return None
+    img = cv2.resize(img, (img_size, img_size), interpolation=cv2.INTER_LINEAR)
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+class ShardWriter:
+    """بناء وتحديث أجزاء ثابتة الحجم من صور مفكوكة ومصغرة (uint8) مع فهرس للتسميات
+    التحديث تزايدي: الصور الجديدة تُضاف في نهاية آخر جزء، والمعدلة (تغير الحجم أو وقت التعديل)
+    تُكتب في خانتها نفسها، والمحذوفة توسم REMOVED"""
+
+    def __init__(self, directory, source, img_size, shard_size=2048, workers=None):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.index_path = os.path.join(directory, INDEX_FILE)
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                self.index = json.load(f)
+            if self.index['img_size'] != img_size:
+                raise ValueError(f"الأجزاء في {directory} بحجم {self.index['img_size']} وليس {img_size}")
+        else:
+            self.index = {'version': INDEX_VERSION, 'source': os.path.abspath(source), 'img_size': img_size,
+                          'shard_size': shard_size, 'class_names': [], 'entries': []}
+        self.source = source
+        self.img_size = img_size
+        self.shard_size = self.index['shard_size']
+        self.workers = workers or min(8, os.cpu_count() or 1)
+        self._shards = {}
+
+    def _shard(self, number):
+        shard = self._shards.get(number)
+        if shard is None:
+            path = os.path.join(self.directory, shard_file(number))
+            if os.path.exists(path):
+                shard = np.load(path, mmap_mode='r+')
+            else:
+                shard = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8,
+                                                  shape=(self.shard_size, self.img_size, self.img_size, 3))
+            self._shards[number] = shard
+        return shard
+
+    def _scan(self):
+        """(المسار النسبي، اسم الفئة، وقت التعديل، الحجم) لكل صورة في المصدر (مجلد لكل فئة)"""
+        files = []
+        for class_name in sorted(os.listdir(self.source)):
+            class_dir = os.path.join(self.source, class_name)
+            if not os.path.isdir(class_dir):
+                continue
+            for path in list_images(class_dir):
+                stat = os.stat(path)
+                files.append((os.path.relpath(path, self.source).replace(os.sep, '/'), class_name,
+                              int(stat.st_mtime), stat.st_size))
+        return files
+
+    def _save_index(self):
+        # الكتابة في ملف مؤقت ثم الاستبدال حتى لا يبقى فهرس نصف مكتوب عند المقاطعة
+        for shard in self._shards.values():
+            shard.flush()
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.index, f, ensure_ascii=False)
+        os.replace(tmp_path, self.index_path)
+
+    def update(self, chunk_size=512):
+        """مزامنة الأجزاء مع مجلد المصدر -> إحصائيات التحديث"""
+        entries = self.index['entries']
+        class_names = self.index['class_names']
+        positions = {entry[0]: i for i, entry in enumerate(entries)}
+        current = self._scan()
+        seen = set()
+        jobs = []  # (الموضع في الفهرس أو None لصورة جديدة، المسار النسبي، الفئة، وقت التعديل، الحجم)
+        for relpath, class_name, mtime, size in current:
+            seen.add(relpath)
+            position = positions.get(relpath)
+            if position is None:
+                jobs.append((None, relpath, class_name, mtime, size))
+            elif entries[position][2:] != [mtime, size] or entries[position][1] == REMOVED:
+                jobs.append((position, relpath, class_name, mtime, size))
+
+        removed = 0
+        for position, entry in enumerate(entries):
+            if entry[0] not in seen and entry[1] != REMOVED:
+                entry[1] = REMOVED
+                removed += 1
+
+        added = updated = failed = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for start in range(0, len(jobs), chunk_size):
+                chunk = jobs[start:start + chunk_size]
+                images = pool.map(lambda job: load_resized(os.path.join(self.source, job[1]), self.img_size), chunk)
+                for (position, relpath, class_name, mtime, size), image in zip(chunk, images):
+                    if image is None:
+                        failed += 1
+                        continue
+                    if class_name not in class_names:
+                        class_names.append(class_name)
+                    label = class_names.index(class_name)
+                    if position is None:
+                        position = len(entries)
+                        entries.append([relpath, label, mtime, size])
+                        added += 1
+                    else:
+                        entries[position] = [relpath, label, mtime, size]
+                        updated += 1
+                    self._shard(position // self.shard_size)[position % self.shard_size] = image
+                self._save_index()
+                print(f"{min(start + chunk_size, len(jobs))}/{len(jobs)} صورة", end='\r')
+        if jobs:
+            print()
+        self._save_index()
+        return {'added': added, 'updated': updated, 'removed': removed, 'failed': failed,
+                'total': sum(1 for entry in entries if entry[1] != REMOVED)}
+
+
+class DatasetShards:
+    """قراءة الأجزاء كمصفوفات mmap: الصور لا تُفك ولا تُنسخ إلا عند تجميع الدفعة
+    التسميات مرتبة حسب أسماء الفئات أبجدياً مثل flow_from_directory و image_dataset_from_directory"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, INDEX_FILE), 'r', encoding='utf-8') as f:
+            self.index = json.load(f)
+        self.img_size = self.index['img_size']
+        self.shard_size = self.index['shard_size']
+        self.class_names = sorted(self.index['class_names'])
+        remap = np.array([self.class_names.index(name) for name in self.index['class_names']] + [REMOVED])
+        entries = self.index['entries']
+        stored = np.array([entry[1] for entry in entries], dtype=np.int64)
+        self._labels = remap[stored].astype(np.int32)  # REMOVED (-1) يبقى -1 عبر آخر عنصر في remap
+        self._paths = [entry[0] for entry in entries]
+        self.positions = np.flatnonzero(self._labels != REMOVED)
+        shard_count = (len(entries) + self.shard_size - 1) // self.shard_size
+        self._shards = [np.load(os.path.join(directory, shard_file(i)), mmap_mode='r') for i in range(shard_count)]
+
+    def __len__(self):
+        return len(self.positions)
+
+    def label(self, position):
+        return int(self._labels[position])
+
+    def path(self, position):
+        return self._paths[position]
+
+    def image(self, position):
+        """عرض على صورة واحدة داخل الجزء (دون نسخ)"""
+        return self._shards[position // self.shard_size][position % self.shard_size]
+
+    def gather(self, positions):
+        """دفعة (N, size, size, 3) من مواضع في الفهرس؛ المواضع المتتالية في جزء واحد تُعاد كعرض دون نسخ"""
+        positions = np.asarray(positions)
+        first = int(positions[0])
+        shard, slot = divmod(first, self.shard_size)
+        if (slot + len(positions) <= self.shard_size
+                and np.array_equal(positions, np.arange(first, first + len(positions)))):
+            return self._shards[shard][slot:slot + len(positions)]
+        batch = np.empty((len(positions), self.img_size, self.img_size, 3), dtype=np.uint8)
+        for i, position in enumerate(positions):
+            batch[i] = self.image(int(position))
+        return batch
+
+    def split(self, validation_split):
+        """نفس تقسيم split_samples: أول validation_split من صور كل فئة (بترتيب المسارات) للتحقق
+        -> (مواضع التدريب، مواضع التحقق)"""
+        training, validation = [], []
+        for label in range(len(self.class_names)):
+            members = sorted(self.positions[self._labels[self.positions] == label], key=lambda p: self._paths[p])
+            split = int(len(members) * validation_split)
+            validation.extend(members[:split])
+            training.extend(members[split:])
+        return np.array(sorted(training), dtype=np.int64), np.array(sorted(validation), dtype=np.int64)
+
+    def batches(self, positions, batch_size, shuffle=False, drop_remainder=False, seed=None):
+        """مولد دفعات (صور uint8، تسميات صحيحة)؛ مع الخلط تُرتب مواضع كل دفعة لتقليل القفز في الملفات"""
+        positions = np.asarray(positions if positions is not None else self.positions)
+        rng = np.random.default_rng(seed)
+        order = rng.permutation(positions) if shuffle else positions
+        stop = len(order) - len(order) % batch_size if drop_remainder else len(order)
+        for start in range(0, stop, batch_size):
+            chunk = np.sort(order[start:start + batch_size])
+            yield self.gather(chunk), self._labels[chunk]
+
+    def dataset(self, positions=None, batch_size=32, shuffle=False, drop_remainder=False):
+        """tf.data من الأجزاء: (دفعة uint8، تسميات one-hot) مع خلط جديد في كل حقبة"""
+        import tensorflow as tf
+        positions = self.positions if positions is None else positions
+        num_classes = len(self.class_names)
+        size = self.img_size
+
+        def generator():
+            yield from self.batches(positions, batch_size, shuffle, drop_remainder)
+
+        dataset = tf.data.Dataset.from_generator(generator, output_signature=(
+            tf.TensorSpec((batch_size if drop_remainder else None, size, size, 3), tf.uint8),
+            tf.TensorSpec((None,), tf.int32)))
+        return dataset.map(lambda images, labels: (images, tf.one_hot(labels, num_classes)))
+
+    def stats(self):
+        return {'directory': self.directory, 'images': len(self), 'classes': len(self.class_names),
+                'img_size': self.img_size, 'shards': len(self._shards),
+                'size_mb': round(sum(s.nbytes for s in self._shards) / (1024 * 1024), 1)}
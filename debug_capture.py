@@ -0,0 +1,185 @@
+import json
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+
+import cv2
+
+
+class DebugCapture:
+    """حفظ عينات من صور الطلبات للتصحيح في خيط خلفي ضمن مجلد دائري محدود الحجم"""
+
+    def __init__(self, directory, sample_rate=0.05, low_conf_threshold=50.0,
+                 max_files=200, max_bytes=200 * 1024 * 1024, queue_size=16, jpeg_quality=85):
+        self.base_directory = directory
+        self.directory = directory
+        self.sample_rate = sample_rate  # نسبة الطلبات المحفوظة عشوائياً
+        self.low_conf_threshold = low_conf_threshold  # حفظ كل تنبؤ ثقته (%) أقل من هذه العتبة
+        self.max_files = max_files  # الحد الكلي لكل العمال (انظر _configure_for_worker)
+        self.max_bytes = max_bytes
+        self._file_limit = max_files
+        self._byte_limit = max_bytes
+        self.queue_size = queue_size
+        self.jpeg_quality = jpeg_quality
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._entries = None  # deque من (المسارات، الحجم) بالترتيب الزمني
+        self._total_bytes = 0
+        self._seq = 0
+
+        self.captured = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def should_capture(self, confidence=None):
+        """تقرير ما إذا كان الطلب سيُحفظ: عينة عشوائية أو ثقة منخفضة"""
+        if self.low_conf_threshold is not None and confidence is not None and confidence < self.low_conf_threshold:
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def submit(self, img, prediction):
+        """تسليم الصورة للخيط الخلفي دون انتظار؛ تُهمل إذا كان الطابور ممتلئاً"""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((img, prediction, time.time()))
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+
+    def maybe_capture(self, img, prediction, confidence=None):
+        if not self.should_capture(confidence):
+            return False
+        return self.submit(img, prediction)
+
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(maxsize=self.queue_size)
+                self._configure_for_worker()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='debug-capture', daemon=True)
+            self._thread.start()
+
+    def _configure_for_worker(self):
+        """تحت prefork_server: مجلد فرعي ثابت لكل رقم عامل وحصة من الحد الكلي، حتى لا يحذف العمال ملفات
+        بعضهم ولا يتضاعف الحد الأقصى بعدد العمال"""
+        worker = os.environ.get('PREFORK_WORKER_INDEX')
+        if worker is None:
+            self.directory = self.base_directory
+            self._file_limit, self._byte_limit = self.max_files, self.max_bytes
+            return
+        workers = max(1, int(os.environ.get('PREFORK_WORKERS', 1)))
+        self.directory = os.path.join(self.base_directory, f"worker-{worker}")
+        self._file_limit = max(1, self.max_files // workers)
+        self._byte_limit = max(1, self.max_bytes // workers)
+
+    def _scan_existing(self):
+        """قراءة الملفات المحفوظة سابقاً حتى يبقى الحد الأقصى سارياً بعد إعادة التشغيل"""
+        os.makedirs(self.directory, exist_ok=True)
+        entries = deque()
+        total = 0
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith('.jpg'):
+                continue
+            image_path = os.path.join(self.directory, name)
+            sidecar_path = image_path[:-4] + '.json'
+            size = os.path.getsize(image_path)
+            if os.path.exists(sidecar_path):
+                size += os.path.getsize(sidecar_path)
+            entries.append(((image_path, sidecar_path), size))
+            total += size
+        self._entries = entries
+        self._total_bytes = total
+
+    def _evict(self):
+        """حذف أقدم الملفات عند تجاوز عدد الملفات أو الحجم الأقصى"""
+        while self._entries and (len(self._entries) > self._file_limit or self._total_bytes > self._byte_limit):
+            paths, size = self._entries.popleft()
+            self._total_bytes -= size
+            for path in paths:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _write(self, img, prediction, timestamp):
+        ok, encoded = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        if not ok:
+            raise RuntimeError("فشل ترميز الصورة بصيغة JPEG")
+
+        self._seq += 1
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(timestamp))
+        # pid يمنع التصادم مع عامل قديم يكمل طلباته في المجلد نفسه أثناء إعادة التحميل
+        base = os.path.join(self.directory,
+                            f"{stamp}-{int(timestamp * 1000) % 1000:03d}-{os.getpid()}-{self._seq:06d}")
+        image_path, sidecar_path = base + '.jpg', base + '.json'
+
+        with open(image_path, 'wb') as f:
+            f.write(encoded.tobytes())
+        sidecar = {'timestamp': timestamp, 'shape': list(img.shape), 'prediction': prediction}
+        with open(sidecar_path, 'w', encoding='utf-8') as f:
+            json.dump(sidecar, f, ensure_ascii=False, default=str)
+
+        size = os.path.getsize(image_path) + os.path.getsize(sidecar_path)
+        self._entries.append(((image_path, sidecar_path), size))
+        self._total_bytes += size
+        self._evict()
+
+    def _run(self):
+        try:
+            self._scan_existing()
+            self._evict()
+        except Exception as e:
+            print(f"فشل تجهيز مجلد التصحيح {self.directory}: {str(e)}")
+            self._entries = deque()
+        while True:
+            img, prediction, timestamp = self._queue.get()
+            try:
+                self._write(img, prediction, timestamp)
+                with self._lock:
+                    self.captured += 1
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                print(f"فشل في حفظ الصورة للتصحيح: {str(e)}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'directory': self.directory,
+                'sample_rate': self.sample_rate,
+                'low_conf_threshold': self.low_conf_threshold,
+                'captured': self.captured,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                'queue_depth': self._queue.qsize(),
+                'stored_files': len(self._entries) if self._entries is not None else None,
+                'stored_bytes': self._total_bytes,
+                'max_files': self._file_limit,
+                'max_bytes': self._byte_limit,
+            }
+
+
+def debug_capture_from_env(default_dir):
+    """إنشاء DebugCapture من متغيرات البيئة (DEBUG_SAMPLE_RATE=0 مع DEBUG_LOW_CONF= يعطله)"""
+    low_conf = os.environ.get('DEBUG_LOW_CONF', '50')
+    return DebugCapture(
+        os.environ.get('DEBUG_CAPTURE_DIR', default_dir),
+        sample_rate=float(os.environ.get('DEBUG_SAMPLE_RATE', 0.05)),
+        low_conf_threshold=float(low_conf) if low_conf else None,
+        max_files=int(os.environ.get('DEBUG_MAX_FILES', 200)),
+        max_bytes=int(float(os.environ.get('DEBUG_MAX_MB', 200)) * 1024 * 1024),
+        queue_size=int(os.environ.get('DEBUG_QUEUE_SIZE', 16)),
+    )
@@ -0,0 +1,116 @@
+import argparse
+import os
+import subprocess
+import sys
+
+import cv2
+
+from yolo_onnx_backend import default_onnx_path, preprocess_batch
+
+try:
+    from onnxruntime.quantization import CalibrationDataReader
+except ImportError:  # onnxruntime مطلوب فقط لخطوة التكميم
+    CalibrationDataReader = object
+
+# نفس المسارات المستخدمة في train_yolov5.py و plant_disease_api.py
+WEIGHTS_PATH = 'D:/DatabasesANDModels/plant_disease_coco/yolo_output/plant_disease_model/weights/best.pt'
+YOLOV5_DIR = 'D:/DatabasesANDModels/plant_disease_coco/yolov5'
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def list_images(folder):
+    """كل الصور داخل المجلد ومجلداته الفرعية بترتيب ثابت"""
+    paths = []
+    for root, _, files in os.walk(folder):
+        for name in files:
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(root, name))
+    return sorted(paths)
+
+
+def export_onnx(weights, img_size, yolov5_dir):
+    """تصدير best.pt إلى ONNX بحجم دفعة متغير باستخدام export.py الخاص بـ YOLOv5"""
+    command = [
+        sys.executable, os.path.join(yolov5_dir, 'export.py'),
+        '--weights', weights,
+        '--include', 'onnx',
+        '--imgsz', str(img_size),
+        '--dynamic',
+        '--device', 'cpu',
+    ]
+    print('تشغيل التصدير إلى ONNX...')
+    subprocess.check_call(command)
+    onnx_path = default_onnx_path(weights)
+    print(f'تم التصدير: {onnx_path}')
+    return onnx_path
+
+
+class ImageFolderCalibrationReader(CalibrationDataReader):
+    """قارئ بيانات المعايرة لـ quantize_static: صورنا بنفس المعالجة المسبقة المستخدمة عند التشغيل"""
+
+    def __init__(self, folder, input_name, img_size, limit):
+        self.paths = list_images(folder)[:limit]
+        self.input_name = input_name
+        self.img_size = img_size
+        self._iter = iter(self.paths)
+        print(f'عدد صور المعايرة: {len(self.paths)}')
+
+    def get_next(self):
+        for path in self._iter:
+            img = cv2.imread(path, cv2.IMREAD_COLOR)
+            if img is None:
+                continue
+            batch, _ = preprocess_batch([img], self.img_size)
+            return {self.input_name: batch}
+        return None
+
+    def rewind(self):
+        self._iter = iter(self.paths)
+
+
+def quantize_int8(onnx_path, calib_dir, img_size, limit):
+    """تكميم ثابت INT8 (QDQ) معاير على مجلد من صورنا"""
+    import onnxruntime as ort
+    from onnxruntime.quantization import CalibrationMethod, QuantFormat, QuantType, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    input_name = ort.InferenceSession(onnx_path, providers=['CPUExecutionProvider']).get_inputs()[0].name
+    reader = ImageFolderCalibrationReader(calib_dir, input_name, img_size, limit)
+    if not reader.paths:
+        raise SystemExit(f'لا توجد صور للمعايرة في {calib_dir}')
+
+    prepared_path = os.path.splitext(onnx_path)[0] + '-prep.onnx'
+    int8_path = default_onnx_path(onnx_path, int8=True)
+    print('تجهيز النموذج للتكميم (استنتاج الأشكال)...')
+    quant_pre_process(onnx_path, prepared_path)
+
+    print('تكميم النموذج إلى INT8...')
+    quantize_static(
+        prepared_path, int8_path, reader,
+        quant_format=QuantFormat.QDQ,
+        per_channel=True,
+        weight_type=QuantType.QInt8,
+        activation_type=QuantType.QUInt8,
+        calibrate_method=CalibrationMethod.MinMax,
+    )
+    os.remove(prepared_path)
+    print(f'تم التكميم: {int8_path}')
+    return int8_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='تصدير نموذج YOLOv5 إلى ONNX مع تكميم INT8 اختياري')
+    parser.add_argument('--weights', default=WEIGHTS_PATH)
+    parser.add_argument('--yolov5-dir', default=YOLOV5_DIR)
+    parser.add_argument('--img', type=int, default=416)
+    parser.add_argument('--int8-calib', help='مجلد صور للمعايرة؛ عند تحديده يتم إنتاج نسخة INT8 أيضاً')
+    parser.add_argument('--calib-limit', type=int, default=200, help='أقصى عدد صور للمعايرة')
+    args = parser.parse_args()
+
+    onnx_path = export_onnx(args.weights, args.img, args.yolov5_dir)
+    if args.int8_calib:
+        quantize_int8(onnx_path, args.int8_calib, args.img, args.calib_limit)
+
+
+if __name__ == '__main__':
+    main()
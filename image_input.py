@@ -0,0 +1,279 @@
+import base64
+import binascii
+import io
+import threading
+import time
+
+import cv2
+import numpy as np
+from flask import Request
+
+from service_metrics import no_stage
+
+# أنواع المحتوى المقبولة كجسم طلب خام
+RAW_IMAGE_TYPES = ('image/jpeg', 'image/jpg', 'image/png', 'image/webp', 'image/bmp', 'application/octet-stream')
+
+# أسماء الحقول المقبولة للصورة في multipart/form-data
+IMAGE_FIELD_NAMES = ('image', 'file')
+
+# عوامل التصغير المتاحة أثناء فك ترميز JPEG في مجال DCT (من الأكبر إلى الأصغر)
+REDUCED_DECODE_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+# علامات SOF في JPEG التي تحمل أبعاد الصورة (باستثناء DHT و JPG و DAC)
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+class InMemoryUploadRequest(Request):
+    """إبقاء الملفات المرفوعة في الذاكرة (BytesIO) بدلاً من ملف مؤقت لقراءتها دون نسخ إضافية"""
+
+    _upload_limit = None
+
+    @property
+    def max_content_length(self):
+        """حد حجم الطلب: قيمة خاصة بالمسار إن عُينت، وإلا MAX_CONTENT_LENGTH من الإعدادات
+        (تعيين request.max_content_length مدعوم في Flask 3.1 فقط، وهذه الخاصية تتيحه في الإصدارات الأقدم)"""
+        if self._upload_limit is not None:
+            return self._upload_limit
+        return super().max_content_length
+
+    @max_content_length.setter
+    def max_content_length(self, value):
+        self._upload_limit = value
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return io.BytesIO()
+
+
+class ImagePayload:
+    """بايتات الصورة المشفرة (بدون نسخ) مع بقية حقول الطلب"""
+
+    def __init__(self, buffer, fields, source):
+        self.buffer = buffer  # np.ndarray من نوع uint8 يشير إلى بايتات الطلب مباشرة
+        self.fields = fields  # حقول إضافية مثل plant
+        self.source = source  # json | multipart | raw
+
+
+def base64_to_buffer(base64_string):
+    """فك ترميز base64 إلى مصفوفة uint8 تشير إلى البايتات الناتجة دون نسخها"""
+    if not isinstance(base64_string, str):
+        print("بيانات الصورة ليست نصية")
+        return None
+
+    if len(base64_string) < 100:
+        print("بيانات الصورة قصيرة جدًا")
+        return None
+
+    # إزالة بادئة data URL إن وجدت (data:image/jpeg;base64,...)
+    comma = base64_string.find(',', 0, 100)
+    if comma != -1:
+        base64_string = base64_string[comma + 1:]
+
+    try:
+        img_bytes = base64.b64decode(base64_string)
+    except (binascii.Error, ValueError) as e:
+        print(f"بيانات base64 غير صالحة: {str(e)}")
+        return None
+    return np.frombuffer(img_bytes, dtype=np.uint8)
+
+
+class DecodeStats:
+    """إحصائيات فك الترميز: الزمن، عامل التصغير، والذاكرة الموفرة مقارنة بفك الترميز الكامل"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.decoded = 0
+        self.failed = 0
+        self.total_ms = 0.0
+        self.decoded_bytes = 0
+        self.full_bytes = 0
+        self.peak_decoded_bytes = 0
+        self.reductions = {}
+
+    def record(self, ms, factor, decoded_bytes, full_bytes):
+        with self._lock:
+            self.decoded += 1
+            self.total_ms += ms
+            self.decoded_bytes += decoded_bytes
+            self.full_bytes += full_bytes
+            self.peak_decoded_bytes = max(self.peak_decoded_bytes, decoded_bytes)
+            self.reductions[factor] = self.reductions.get(factor, 0) + 1
+
+    def record_failure(self):
+        with self._lock:
+            self.failed += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'decoded': self.decoded,
+                'failed': self.failed,
+                'mean_decode_ms': round(self.total_ms / self.decoded, 2) if self.decoded else 0.0,
+                'mean_decoded_mb': round(self.decoded_bytes / self.decoded / 1e6, 2) if self.decoded else 0.0,
+                'mean_full_resolution_mb': round(self.full_bytes / self.decoded / 1e6, 2) if self.decoded else 0.0,
+                'peak_decoded_mb': round(self.peak_decoded_bytes / 1e6, 2),
+                'reduction_factors': {str(k): v for k, v in sorted(self.reductions.items())},
+            }
+
+
+decode_stats = DecodeStats()
+
+
+def read_image_size(buffer):
+    """قراءة أبعاد الصورة (العرض، الارتفاع) من ترويسة JPEG أو PNG دون فك ترميزها"""
+    data = memoryview(buffer)
+    n = len(data)
+    if n >= 24 and bytes(data[:8]) == b'\x89PNG\r\n\x1a\n':
+        return int.from_bytes(data[16:20], 'big'), int.from_bytes(data[20:24], 'big'), 'png'
+    if n < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        return None
+
+    i = 2
+    while i + 9 < n:
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:  # حشو بين المقاطع
+            i += 1
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:  # علامات بدون طول
+            i += 2
+            continue
+        length = (data[i + 2] << 8) | data[i + 3]
+        if marker in JPEG_SOF_MARKERS:
+            height = (data[i + 5] << 8) | data[i + 6]
+            width = (data[i + 7] << 8) | data[i + 8]
+            return width, height, 'jpeg'
+        i += 2 + length
+    return None
+
+
+def choose_reduction(width, height, target_size, fit='short'):
+    """أكبر عامل تصغير يبقي الصورة أكبر من حجم إدخال النموذج
+    fit='short': الضلع الأقصر >= target (تغيير الحجم إلى مربع كما في المصنف 224)
+    fit='long': الضلع الأطول >= target (letterbox كما في YOLO 416)"""
+    side = min(width, height) if fit == 'short' else max(width, height)
+    for factor, flag in REDUCED_DECODE_FLAGS:
+        if side // factor >= target_size:
+            return factor, flag
+    return 1, cv2.IMREAD_COLOR
+
+
+def decode_image_buffer(buffer, target_size=None, fit='short', max_size=None):
+    """فك ترميز الصورة من مصفوفة البايتات مباشرة إلى صورة OpenCV (BGR)
+    مع target_size تُفك صور JPEG بدقة مخفضة (1/2، 1/4، 1/8) تكفي لحجم إدخال النموذج
+    مع max_size لا يتجاوز الضلع الأطول للصورة الناتجة هذا الحد (تصغير INTER_AREA بعد فك الترميز عند الحاجة)"""
+    if buffer is None or buffer.size == 0:
+        return None
+
+    started = time.perf_counter()
+    factor, flag = 1, cv2.IMREAD_COLOR
+    header = read_image_size(buffer)
+    # التصغير في مجال DCT متاح لـ JPEG فقط؛ بقية الصيغ تُفك كاملة
+    if target_size and header is not None and header[2] == 'jpeg':
+        factor, flag = choose_reduction(header[0], header[1], target_size, fit)
+
+    img = cv2.imdecode(buffer, flag)
+    if img is None:
+        decode_stats.record_failure()
+        print("فشل في فك ترميز بيانات الصورة")
+        return None
+
+    full_bytes = header[0] * header[1] * 3 if header is not None else img.nbytes
+    decode_stats.record((time.perf_counter() - started) * 1000.0, factor, img.nbytes, full_bytes)
+
+    if max_size and max(img.shape[:2]) > max_size:
+        scale = max_size / max(img.shape[:2])
+        img = cv2.resize(img, (max(1, round(img.shape[1] * scale)), max(1, round(img.shape[0] * scale))),
+                         interpolation=cv2.INTER_AREA)
+    return img
+
+
+def base64_to_image(base64_string):
+    """تحويل صورة base64 إلى صورة OpenCV"""
+    try:
+        img = decode_image_buffer(base64_to_buffer(base64_string))
+        if img is None:
+            print("فشل في تحويل بيانات base64 إلى صورة")
+        return img
+    except Exception as e:
+        print(f"خطأ في معالجة الصورة: {str(e)}")
+        return None
+
+
+def _upload_buffer(storage):
+    """مصفوفة تشير إلى بايتات الملف المرفوع؛ بدون نسخ عند وجوده في الذاكرة"""
+    stream = storage.stream
+    if hasattr(stream, 'getbuffer'):
+        return np.frombuffer(stream.getbuffer(), dtype=np.uint8)
+    return np.frombuffer(stream.read(), dtype=np.uint8)
+
+
+def read_image_payload(req, stage=no_stage):
+    """قراءة الصورة من JSON (base64) أو multipart/form-data أو جسم طلب خام (image/jpeg, image/png)
+    stage: مقياس زمن المراحل (ServiceMetrics.stage) لتحليل الجسم وفك ترميز base64"""
+    mimetype = req.mimetype or ''
+
+    if mimetype == 'multipart/form-data':
+        with stage('parse'):
+            files = req.files
+        for name in IMAGE_FIELD_NAMES:
+            if name in files:
+                return ImagePayload(_upload_buffer(files[name]), req.form.to_dict(), 'multipart')
+        return None
+
+    if mimetype in RAW_IMAGE_TYPES:
+        # الحقول الإضافية تُمرر في عنوان الطلب مثل ?plant=طماطم
+        with stage('parse'):
+            data = req.get_data(cache=False)
+        if not data:
+            return None
+        return ImagePayload(np.frombuffer(data, dtype=np.uint8), req.args.to_dict(), 'raw')
+
+    with stage('parse'):
+        data = req.get_json(silent=True)
+    if not isinstance(data, dict) or 'image' not in data:
+        return None
+    with stage('base64_decode'):
+        buffer = base64_to_buffer(data['image'])
+    return ImagePayload(buffer, data, 'json')
+
+
+def read_image_payloads(req, stage=no_stage):
+    """قراءة عدة صور من طلب واحد: JSON بحقل images (قائمة base64) أو عدة أجزاء image/file في multipart"""
+    if (req.mimetype or '') == 'multipart/form-data':
+        with stage('parse'):
+            files = req.files
+        buffers = [_upload_buffer(storage) for name in IMAGE_FIELD_NAMES for storage in files.getlist(name)]
+        return buffers, req.form.to_dict()
+
+    with stage('parse'):
+        data = req.get_json(silent=True)
+    if not isinstance(data, dict):
+        return [], {}
+    if not isinstance(data.get('images'), list):
+        return [], data
+    # يبقى فك ترميز base64 مؤجلاً حتى يتم بالتوازي مع فك ترميز الصور
+    return data['images'], data
+
+
+def image_item_buffer(item):
+    """بايتات عنصر من read_image_payloads: فك base64 للنصوص، و None لأي نوع آخر غير مصفوفة بايتات"""
+    if isinstance(item, str):
+        return base64_to_buffer(item)
+    if not isinstance(item, np.ndarray):
+        print("عنصر الصورة ليس نصاً ولا بايتات")
+        return None
+    return item
+
+
+def decode_image_item(item, target_size=None, fit='short', max_size=None):
+    """فك ترميز عنصر من read_image_payloads: نص base64 أو مصفوفة بايتات"""
+    return decode_image_buffer(image_item_buffer(item), target_size, fit, max_size)
+
+
+def field_flag(fields, name):
+    """قراءة حقل منطقي سواء جاء من JSON أو من نموذج/عنوان نصي"""
+    value = fields.get(name)
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
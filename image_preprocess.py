@@ -0,0 +1,95 @@
+import threading
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+
+
+class PreprocessLease:
+    """مخزن مستعار من مجمع BatchPreprocessor: صالح حتى نهاية كتلة with"""
+
+    def __init__(self, preprocessor, batch, resized):
+        self.preprocessor = preprocessor
+        self.batch = batch
+        self.resized = resized
+
+    def fill(self, images):
+        """صور BGR بأي حجم -> عرض (N, size, size, 3) من نوع uint8 على المخزن المستعار"""
+        p = self.preprocessor
+        batch = self.batch
+        for i, img in enumerate(images):
+            if p.color is None:
+                cv2.resize(img, (p.size, p.size), dst=batch[i], interpolation=p.interpolation)
+            else:
+                # تصغير أولاً ثم تحويل الألوان على الصورة الصغيرة
+                cv2.resize(img, (p.size, p.size), dst=self.resized, interpolation=p.interpolation)
+                cv2.cvtColor(self.resized, p.color, dst=batch[i])
+        return batch[:len(images)]
+
+    def one(self, img):
+        """صورة واحدة -> (1, size, size, 3)"""
+        return self.fill((img,))
+
+
+class BatchPreprocessor:
+    """تجهيز دفعات صور uint8 للنموذج داخل مخازن محجوزة مسبقاً يُعاد استخدامها بين الطلبات
+    cv2.resize و cv2.cvtColor يكتبان مباشرة في المخزن (dst=) فلا تُنشأ مصفوفات وسيطة لكل طلب،
+    والتطبيع (القسمة على 255) يحدث داخل رسم النموذج وليس في بايثون.
+    المخازن في مجمع مشترك بقفل وليس لكل خيط: خادم werkzeug ينشئ خيطاً لكل اتصال، فمخزن لكل خيط
+    يعني حجزاً جديداً في كل طلب تقريباً"""
+
+    def __init__(self, size, capacity=8, color=cv2.COLOR_BGR2RGB, interpolation=cv2.INTER_LINEAR, max_free=4):
+        self.size = size
+        self.capacity = max(1, int(capacity))  # أكبر دفعة متوقعة (للتوثيق والتسخين؛ المخازن بحجم الطلب)
+        self.color = color  # None لإبقاء ترتيب القنوات BGR
+        self.interpolation = interpolation
+        self.max_free = max(1, int(max_free))  # أقصى عدد مخازن تبقى في المجمع بعد انتهاء الطلبات
+        self._free = []  # (batch, resized) مرتبة حسب عدد الصور
+        self._lock = threading.Lock()
+        self.allocations = 0
+
+    def _acquire(self, n):
+        with self._lock:
+            # أصغر مخزن متاح يتسع لـ n صورة
+            for i, (batch, resized) in enumerate(self._free):
+                if len(batch) >= n:
+                    del self._free[i]
+                    return batch, resized
+            self.allocations += 1
+        # مخزن بحجم الطلب (صورة واحدة لا تحجز مخزن دفعة كاملة)
+        return (np.empty((n, self.size, self.size, 3), dtype=np.uint8),
+                np.empty((self.size, self.size, 3), dtype=np.uint8))
+
+    def _release(self, buffers):
+        with self._lock:
+            self._free.append(buffers)
+            self._free.sort(key=lambda b: len(b[0]))
+            if len(self._free) > self.max_free:
+                self._free.pop(0)  # الاحتفاظ بالمخازن الأكبر لأنها تخدم أي دفعة أصغر
+
+    @contextmanager
+    def lease(self, n):
+        """استعارة مخزن يتسع لـ n صورة وإعادته للمجمع عند الخروج من with"""
+        batch, resized = self._acquire(max(1, n))
+        try:
+            yield PreprocessLease(self, batch, resized)
+        finally:
+            self._release((batch, resized))
+
+    @contextmanager
+    def batch(self, images):
+        """with preprocessor.batch(images) as batch: دفعة uint8 صالحة داخل الكتلة فقط، فتُمرر للنموذج فيها"""
+        with self.lease(len(images)) as lease:
+            yield lease.fill(images)
+
+    def stats(self):
+        with self._lock:
+            return {'allocations': self.allocations, 'free_buffers': len(self._free),
+                    'free_mb': round(sum(b.nbytes + r.nbytes for b, r in self._free) / (1024 * 1024), 2)}
+
+
+def normalize_in_python(batch, scale=1.0 / 255):
+    """للنماذج التي لا تحتوي طبقة التطبيع: نسخة float32 واحدة بدلاً من float64 الناتجة عن / 255.0"""
+    out = batch.astype(np.float32)
+    out *= scale
+    return out
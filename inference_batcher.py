@@ -0,0 +1,200 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+
+class BatchQueueFull(Exception):
+    """طابور الدفعات ممتلئ ولا يمكن قبول طلب جديد"""
+
+
+class BatchTimeout(Exception):
+    """انتهت مهلة انتظار نتيجة الطلب قبل تنفيذ دفعته"""
+
+
+class MicroBatcher:
+    """مجدول دفعات صغيرة: يجمع الطلبات التي تصل خلال نافذة زمنية قصيرة ويشغلها كاستدعاء واحد للنموذج"""
+
+    def __init__(self, infer_fn, window_ms=10, max_batch_size=8, max_queue_depth=64, stats_window=1000):
+        # infer_fn تستقبل قائمة مدخلات وتعيد قائمة نتائج بنفس الترتيب
+        self.infer_fn = infer_fn
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_queue_depth = max(1, int(max_queue_depth))
+
+        self._queue = queue.Queue(maxsize=self.max_queue_depth)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+        # إحصائيات امتلاء الدفعات وزمن الانتظار في الطابور
+        self._batch_sizes = deque(maxlen=stats_window)
+        self._queue_waits = deque(maxlen=stats_window)
+        self._total_batches = 0
+        self._total_requests = 0
+        self._rejected = 0
+        self._timed_out = 0
+        self._failed_batches = 0
+
+    def _ensure_started(self):
+        """تشغيل خيط الجدولة عند أول طلب (وإعادة تشغيله بعد fork)"""
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            if self._pid != os.getpid():
+                # الطابور والأقفال الموروثة من العملية الأم غير صالحة بعد fork
+                self._queue = queue.Queue(maxsize=self.max_queue_depth)
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+            self._thread.start()
+
+    def submit(self, item, timeout=None):
+        """إرسال مدخل واحد وانتظار نتيجته الخاصة من الدفعة"""
+        self._ensure_started()
+        future = Future()
+        try:
+            self._queue.put_nowait((item, future, time.perf_counter()))
+        except queue.Full:
+            with self._lock:
+                self._rejected += 1
+            raise BatchQueueFull(f"طابور الدفعات ممتلئ ({self.max_queue_depth} طلب)")
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            # إلغاء الطلب حتى لا يشغله خيط الجدولة إن لم يبدأ بعد
+            future.cancel()
+            with self._lock:
+                self._timed_out += 1
+            raise BatchTimeout(f"انتهت مهلة انتظار نتيجة الدفعة ({timeout} ثانية)")
+
+    def submit_many(self, items, timeout=None):
+        """إرسال عدة مدخلات معاً (مثل مربعات صورة كبيرة) وانتظار نتائجها بنفس الترتيب
+        تُرفض كلها إذا لم يتسع الطابور لها جميعاً، حتى يبقى حد max_queue_depth سارياً"""
+        self._ensure_started()
+        items = list(items)
+        with self._lock:
+            if self._queue.qsize() + len(items) > self.max_queue_depth:
+                self._rejected += 1
+                raise BatchQueueFull(f"طابور الدفعات لا يتسع لـ {len(items)} مدخلات ({self.max_queue_depth} طلب)")
+        futures = []
+        try:
+            for item in items:
+                future = Future()
+                self._queue.put_nowait((item, future, time.perf_counter()))
+                futures.append(future)
+        except queue.Full:
+            # طلب متزامن ملأ الطابور بين الفحص والإضافة
+            for future in futures:
+                future.cancel()
+            with self._lock:
+                self._rejected += 1
+            raise BatchQueueFull(f"طابور الدفعات ممتلئ ({self.max_queue_depth} طلب)")
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            return [future.result(timeout=None if deadline is None else max(0.0, deadline - time.monotonic()))
+                    for future in futures]
+        except FutureTimeoutError:
+            for future in futures:
+                future.cancel()
+            with self._lock:
+                self._timed_out += 1
+            raise BatchTimeout(f"انتهت مهلة انتظار نتائج الدفعة ({timeout} ثانية)")
+
+    def _collect_batch(self):
+        """جمع الطلبات حتى انتهاء النافذة الزمنية أو بلوغ الحجم الأقصى للدفعة"""
+        first = self._queue.get()
+        batch = [first]
+        deadline = first[2] + self.window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                # التقاط ما هو موجود فعلاً في الطابور دون انتظار إضافي
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except queue.Empty:
+                    break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            # تخطي الطلبات التي ألغيت بعد انتهاء مهلتها
+            batch = [entry for entry in batch if entry[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            started = time.perf_counter()
+            items = [entry[0] for entry in batch]
+
+            with self._lock:
+                self._total_batches += 1
+                self._total_requests += len(batch)
+                self._batch_sizes.append(len(batch))
+                for _, _, enqueued in batch:
+                    self._queue_waits.append((started - enqueued) * 1000.0)
+
+            try:
+                outputs = self.infer_fn(items)
+                if len(outputs) != len(items):
+                    raise RuntimeError(f"عدد النتائج ({len(outputs)}) لا يطابق حجم الدفعة ({len(items)})")
+            except Exception as e:
+                print(f"فشل تنفيذ الدفعة: {str(e)}")
+                with self._lock:
+                    self._failed_batches += 1
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future, _), output in zip(batch, outputs):
+                future.set_result(output)
+
+    def stats(self):
+        """إحصائيات امتلاء الدفعات وزمن الانتظار في الطابور"""
+        with self._lock:
+            sizes = list(self._batch_sizes)
+            waits = sorted(self._queue_waits)
+            snapshot = {
+                'window_ms': self.window * 1000.0,
+                'max_batch_size': self.max_batch_size,
+                'max_queue_depth': self.max_queue_depth,
+                'queue_depth': self._queue.qsize(),
+                'total_batches': self._total_batches,
+                'total_requests': self._total_requests,
+                'rejected_requests': self._rejected,
+                'timed_out_requests': self._timed_out,
+                'failed_batches': self._failed_batches,
+            }
+
+        if sizes:
+            mean_size = sum(sizes) / len(sizes)
+            snapshot['mean_batch_size'] = round(mean_size, 2)
+            snapshot['mean_batch_fill'] = round(mean_size / self.max_batch_size, 3)
+            snapshot['batch_size_histogram'] = {
+                str(size): sizes.count(size) for size in range(1, self.max_batch_size + 1) if sizes.count(size)
+            }
+        if waits:
+            snapshot['queue_wait_ms'] = {
+                'p50': round(_percentile(waits, 50), 2),
+                'p95': round(_percentile(waits, 95), 2),
+                'p99': round(_percentile(waits, 99), 2),
+                'max': round(waits[-1], 2),
+            }
+        return snapshot
+
+
+def _percentile(sorted_values, pct):
+    """حساب المئين من قائمة مرتبة"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
@@ -0,0 +1,502 @@
+import gc
+import importlib
+import importlib.util
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import numpy as np
+from flask import Flask, request, jsonify
+from flask_cors import CORS
+
+from image_preprocess import BatchPreprocessor
+from image_input import InMemoryUploadRequest, read_image_payload, decode_image_buffer, decode_stats, field_flag
+from model_readiness import ModelReadiness
+from service_metrics import ServiceMetrics, install_flask_metrics
+
+# بوابة واحدة تستضيف كل النماذج بدلاً من تشغيل plant_disease_api.py أو plant_disease_cnn_api.py أو 1cnn/app.py
+# على المنفذ 5000 واحداً في كل مرة: /api/detect?model=yolo|mobilenet|cnn38
+app = Flask(__name__)
+CORS(app)  # تمكين CORS للسماح بالاتصال من الواجهة الأمامية
+app.request_class = InMemoryUploadRequest
+app.config['MAX_CONTENT_LENGTH'] = int(float(os.environ.get('MAX_UPLOAD_MB', 25)) * 1024 * 1024)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CNN38_DIR = os.path.join(BASE_DIR, '1cnn')
+
+GATEWAY_MODELS = [m.strip() for m in os.environ.get('GATEWAY_MODELS', 'yolo,mobilenet,cnn38').split(',') if m.strip()]
+GATEWAY_DEFAULT_MODEL = os.environ.get('GATEWAY_DEFAULT_MODEL', 'yolo')
+# النماذج المحملة عند بدء التشغيل؛ البقية تُحمّل عند أول طلب وتبقى في الذاكرة
+GATEWAY_PRELOAD = [m.strip() for m in os.environ.get('GATEWAY_PRELOAD', GATEWAY_DEFAULT_MODEL).split(',') if m.strip()]
+# حد الذاكرة للنماذج المحملة (0 بلا حد): يُزال الأقل استخداماً عند تجاوزه
+GATEWAY_MEMORY_BUDGET_BYTES = int(float(os.environ.get('GATEWAY_MEMORY_BUDGET_MB', 0)) * 1024 * 1024)
+GATEWAY_TIMEOUT_S = float(os.environ.get('GATEWAY_TIMEOUT_S', 30))  # مهلة انتظار نتيجة النموذج
+GATEWAY_MAX_PENDING = int(os.environ.get('GATEWAY_MAX_PENDING', 32))  # أقصى طلبات جارية أو منتظرة لكل نموذج
+GATEWAY_MAX_FILES = int(os.environ.get('GATEWAY_MAX_FILES', 16))  # أقصى عدد ملفات في طلب /predict واحد
+
+CNN38_MODEL_PATH = os.environ.get('CNN38_MODEL_PATH', os.path.join(CNN38_DIR, 'trained_model.h5'))
+CNN38_IMG_SIZE = 128
+
+
+def current_rss_bytes():
+    """الذاكرة المقيمة الحالية للعملية (لينكس فقط)؛ None إذا لم تتوفر"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class ModelEntry:
+    """نموذج مسجل في البوابة: دوال التحميل والتفريغ وفك الترميز والتنبؤ، ومنفذ خيوط وحد تزامن خاص به"""
+
+    def __init__(self, name, load_fn, unload_fn, decode_fn, predict_fn, concurrency=1,
+                 max_pending=GATEWAY_MAX_PENDING, model_path=None, description='', predict_batch_fn=None):
+        self.name = name
+        self.load_fn = load_fn  # تعيد True عند نجاح التحميل
+        self.unload_fn = unload_fn
+        self.decode_fn = decode_fn  # بايتات الصورة -> صورة BGR بالدقة التي يحتاجها النموذج
+        self.predict_fn = predict_fn  # (صورة، حقول الطلب) -> استجابة JSON
+        self.predict_batch_fn = predict_batch_fn  # (صور، حقول الطلب) -> استجابة لكل صورة بتمريرة واحدة (اختياري)
+        self.concurrency = max(1, int(concurrency))
+        self.max_pending = max(self.concurrency, int(max_pending))
+        self.model_path = model_path
+        self.description = description
+
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix=f'gateway-{name}')
+        self.slots = threading.BoundedSemaphore(self.max_pending)
+        self.load_lock = threading.Lock()
+        self.loaded = False
+        self.memory_bytes = 0
+        self.load_seconds = None
+        self.in_flight = 0
+        self.last_used = 0.0
+
+        self.requests = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def estimate_memory(self, rss_delta):
+        """الذاكرة المنسوبة للنموذج: فرق الذاكرة المقيمة عند التحميل، أو حجم ملف الأوزان"""
+        if rss_delta is not None and rss_delta > 0:
+            return rss_delta
+        if self.model_path and os.path.exists(self.model_path):
+            return os.path.getsize(self.model_path)
+        return 0
+
+    def stats(self):
+        return {
+            'loaded': self.loaded,
+            'memory_mb': round(self.memory_bytes / (1024 * 1024), 1),
+            'load_seconds': self.load_seconds,
+            'concurrency': self.concurrency,
+            'in_flight': self.in_flight,
+            'requests': self.requests,
+            'rejected': self.rejected,
+            'timed_out': self.timed_out,
+            'loads': self.loads,
+            'evictions': self.evictions,
+        }
+
+
+class ModelRegistry:
+    """تحميل النماذج عند الطلب وإبقاؤها مقيمة، مع إزالة الأقل استخداماً (LRU) عند تجاوز حد الذاكرة"""
+
+    def __init__(self, memory_budget_bytes=0):
+        self.memory_budget_bytes = memory_budget_bytes
+        self.entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def register(self, entry):
+        self.entries[entry.name] = entry
+        return entry
+
+    def get(self, name):
+        return self.entries.get(name)
+
+    def resident_bytes(self):
+        return sum(e.memory_bytes for e in self.entries.values() if e.loaded)
+
+    def ensure_loaded(self, entry):
+        """تحميل النموذج عند أول استخدام (قفل لكل نموذج حتى لا يُحمّل مرتين)"""
+        if entry.loaded:
+            return True
+        with entry.load_lock:
+            if entry.loaded:
+                return True
+            rss_before = current_rss_bytes()
+            started = time.perf_counter()
+            if not entry.load_fn():
+                print(f"تعذر تحميل النموذج {entry.name}")
+                return False
+            entry.load_seconds = time.perf_counter() - started
+            rss_after = current_rss_bytes()
+            delta = rss_after - rss_before if rss_before is not None and rss_after is not None else None
+            entry.memory_bytes = entry.estimate_memory(delta)
+            entry.loads += 1
+            with self._lock:
+                entry.loaded = True
+                entry.last_used = time.monotonic()
+            print(f"تم تحميل النموذج {entry.name} خلال {entry.load_seconds:.2f} ثانية "
+                  f"({entry.memory_bytes / (1024 * 1024):.0f}MB)")
+        self.evict_if_needed(keep=entry)
+        return True
+
+    def evict_if_needed(self, keep=None):
+        """إزالة النماذج الأقل استخداماً حتى تعود الذاكرة تحت الحد (النماذج المشغولة لا تُزال)"""
+        if not self.memory_budget_bytes:
+            return
+        while True:
+            with self._lock:
+                if self.resident_bytes() <= self.memory_budget_bytes:
+                    return
+                candidates = [e for e in self.entries.values()
+                              if e.loaded and e is not keep and e.in_flight == 0]
+                if not candidates:
+                    return
+                victim = min(candidates, key=lambda e: e.last_used)
+            # قفل التحميل أولاً (نفس ترتيب ensure_loaded: load_lock ثم _lock) حتى لا يُعاد تعيين loaded
+            # بين تعليمه كمُزال وتفريغه فعلياً، ثم إعادة التحقق لأن الحالة قد تتغير قبل الحصول على القفل
+            with victim.load_lock:
+                with self._lock:
+                    if not victim.loaded or victim.in_flight:
+                        continue
+                    victim.loaded = False
+                print(f"إزالة النموذج {victim.name} من الذاكرة (حد الذاكرة {self.memory_budget_bytes // (1024 * 1024)}MB)")
+                victim.unload_fn()
+                victim.memory_bytes = 0
+                victim.evictions += 1
+            gc.collect()
+
+    def run(self, entry, img, fields, batch=False):
+        """تنفيذ التنبؤ داخل منفذ النموذج (batch: قائمة صور عبر predict_batch_fn)"""
+        with self._lock:
+            entry.in_flight += 1
+            entry.last_used = time.monotonic()
+        try:
+            if not self.ensure_loaded(entry):
+                return None
+            with metrics.stage(f'{entry.name}_inference'):
+                if batch:
+                    return entry.predict_batch_fn(img, fields)
+                return entry.predict_fn(img, fields)
+        finally:
+            with self._lock:
+                entry.in_flight -= 1
+
+    def stats(self):
+        return {
+            'memory_budget_mb': round(self.memory_budget_bytes / (1024 * 1024), 1),
+            'resident_mb': round(self.resident_bytes() / (1024 * 1024), 1),
+            'models': {name: e.stats() for name, e in self.entries.items()},
+        }
+
+
+class ModelUnavailable(Exception):
+    """تعذر تحميل النموذج المطلوب"""
+
+
+class GatewayBusy(Exception):
+    """عدد الطلبات الجارية أو المنتظرة للنموذج بلغ حده"""
+
+
+def submit_prediction(entry, img, fields, timeout=GATEWAY_TIMEOUT_S, batch=False):
+    """تنفيذ التنبؤ في منفذ النموذج مع حد للطلبات المنتظرة ومهلة للانتظار"""
+    if not entry.slots.acquire(blocking=False):
+        entry.rejected += 1
+        raise GatewayBusy(f"النموذج {entry.name} مشغول ({entry.max_pending} طلب)")
+    entry.requests += 1
+    future = entry.executor.submit(registry.run, entry, img, fields, batch)
+    # تحرير المقعد عند انتهاء التنفيذ أو إلغائه، وليس عند عودة الطلب
+    future.add_done_callback(lambda f: entry.slots.release())
+    try:
+        result = future.result(timeout=timeout)
+    except FutureTimeoutError:
+        future.cancel()
+        entry.timed_out += 1
+        raise GatewayBusy(f"انتهت مهلة انتظار النموذج {entry.name} ({timeout} ثانية)")
+    if result is None:
+        raise ModelUnavailable(entry.name)
+    return result
+
+
+def _release_module_attr(module_name, *names):
+    module = sys.modules.get(module_name)
+    if module is not None:
+        for name in names:
+            setattr(module, name, None)
+
+
+def _release_keras():
+    """حذف المراجع وحده لا يحرر ذاكرة Keras: الحالة العامة (الرسم وأسماء الطبقات) تبقي الأوزان محجوزة
+    النماذج الأخرى المحملة تبقى صالحة للاستخدام بعد clear_session في TensorFlow 2"""
+    tf = sys.modules.get('tensorflow')
+    if tf is not None:
+        tf.keras.backend.clear_session()
+
+
+# --- YOLOv5 (plant_disease_api.py): التقطيع والدفعات كما في الخدمة الأصلية ---
+
+def _yolo():
+    return importlib.import_module('plant_disease_api')
+
+
+def yolo_entry():
+    def load():
+        return _yolo().load_model() is not None
+
+    def predict(img, fields):
+        api = _yolo()
+        from yolo_postprocess import summarize_detections
+        det = api.detect_image(img)
+        summary = summarize_detections(det, api.get_class_names(), conf_thres=api.CONF_THRESHOLD,
+                                       top_k=api.TOP_K_DISEASES, return_boxes=True)
+        return api.build_detection_response(summary, fields.get('plant', 'طماطم'), field_flag(fields, 'return_boxes'))
+
+    def decode(buffer):
+        return _yolo().decode_for_detection(buffer)
+
+    # التزامن يساوي حجم الدفعة حتى يجمع مجدول الدفعات طلبات البوابة المتزامنة في استدعاء واحد
+    concurrency = int(os.environ.get('BATCH_MAX_SIZE', 8))
+    return ModelEntry('yolo', load, lambda: _release_module_attr('plant_disease_api', 'model'), decode, predict,
+                      concurrency=concurrency, description='YOLOv5 - كشف الأمراض مع مربعات الإحاطة')
+
+
+# --- MobileNetV2 (plant_disease_cnn_api.py) ---
+
+def _mobilenet():
+    return importlib.import_module('plant_disease_cnn_api')
+
+
+def mobilenet_entry():
+    def load():
+        return _mobilenet().load_model_and_classes()
+
+    def predict(img, fields):
+        cnn = _mobilenet()
+        disease_name, confidence = cnn.classify_image(img)
+        return cnn.build_prediction_response(disease_name, confidence, fields.get('plant', 'طماطم'))
+
+    def decode(buffer):
+        # فك ترميز JPEG بأكبر تصغير يبقي الضلع الأقصر >= 224
+        return decode_image_buffer(buffer, 224, fit='short')
+
+    def unload():
+        _release_module_attr('plant_disease_cnn_api', 'model', 'predictor')
+        _release_keras()
+
+    return ModelEntry('mobilenet', load, unload, decode, predict, model_path='./model/plant_disease_model.h5',
+                      description='MobileNetV2 - تصنيف أمراض الطماطم والبطاطا والفلفل')
+
+
+# --- نموذج 38 فئة (1cnn/app.py) ---
+
+cnn38_model = None
+cnn38_preprocessor = BatchPreprocessor(CNN38_IMG_SIZE, capacity=1)
+
+
+def _cnn38_app():
+    """تحميل 1cnn/app.py باسم مستقل (اسم app يتعارض مع هذا التطبيق) للحصول على CLASS_NAMES"""
+    module = sys.modules.get('cnn38_app')
+    if module is None:
+        spec = importlib.util.spec_from_file_location('cnn38_app', os.path.join(CNN38_DIR, 'app.py'))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules['cnn38_app'] = module
+        spec.loader.exec_module(module)
+    return module
+
+
+def cnn38_entry():
+    def load():
+        global cnn38_model
+        try:
+            import tensorflow as tf
+            class_names = _cnn38_app().CLASS_NAMES
+            if not os.path.exists(CNN38_MODEL_PATH):
+                print(f"خطأ: ملف النموذج غير موجود في المسار {CNN38_MODEL_PATH}")
+                return False
+            cnn38_model = tf.keras.models.load_model(CNN38_MODEL_PATH)
+            print(f"تم تحميل نموذج 1cnn ({len(class_names)} فئة)")
+            return True
+        except Exception as e:
+            print(f"خطأ في تحميل نموذج 1cnn: {str(e)}")
+            return False
+
+    def unload():
+        global cnn38_model
+        cnn38_model = None
+        _release_keras()
+
+    def decode(buffer):
+        return decode_image_buffer(buffer, CNN38_IMG_SIZE, fit='short')
+
+    def response(probabilities):
+        top_k = _cnn38_app().top_k_predictions(probabilities)
+        name = top_k[0]['class']
+        return {
+            'result': name,
+            'confidence': round(top_k[0]['score'] * 100, 1),
+            'plant': name.split('___')[0],
+            'top_k': top_k,
+        }
+
+    def predict(img, fields):
+        # نفس معالجة 1cnn/app.py: RGB بحجم 128x128 وقيم 0-255 دون تطبيع
+        with cnn38_preprocessor.batch((img,)) as batch:
+            return response(cnn38_model.predict(batch, verbose=0)[0])
+
+    def predict_batch(images, fields):
+        # كل ملفات طلب /predict بتمريرة أمامية واحدة كما في 1cnn/app.py
+        with cnn38_preprocessor.batch(images) as batch:
+            return [response(p) for p in cnn38_model.predict(batch, verbose=0)]
+
+    return ModelEntry('cnn38', load, unload, decode, predict, model_path=CNN38_MODEL_PATH,
+                      description='CNN بـ 38 فئة من PlantVillage (1cnn)', predict_batch_fn=predict_batch)
+
+
+MODEL_FACTORIES = {'yolo': yolo_entry, 'mobilenet': mobilenet_entry, 'cnn38': cnn38_entry}
+
+registry = ModelRegistry(GATEWAY_MEMORY_BUDGET_BYTES)
+for _name in GATEWAY_MODELS:
+    if _name in MODEL_FACTORIES:
+        registry.register(MODEL_FACTORIES[_name]())
+    else:
+        print(f"نموذج غير معروف في GATEWAY_MODELS: {_name}")
+
+readiness = ModelReadiness('gateway')
+
+metrics = ServiceMetrics('gateway')
+install_flask_metrics(app, metrics)
+metrics.model_load_seconds.set_function(lambda: readiness.load_seconds, service=metrics.service)
+metrics.register_stats('gateway', registry.stats)
+metrics.register_stats('decode', decode_stats.stats)
+
+
+def preload_models():
+    """تحميل النماذج المحددة في GATEWAY_PRELOAD عند بدء التشغيل"""
+    ok = True
+    for name in GATEWAY_PRELOAD:
+        entry = registry.get(name)
+        if entry is not None:
+            ok = registry.ensure_loaded(entry) and ok
+    return ok
+
+
+def handle_detect(model_name):
+    payload = read_image_payload(request, stage=metrics.stage)
+    if payload is None:
+        return jsonify({'error': 'No image provided'}), 400
+    entry = registry.get(model_name)
+    if entry is None:
+        return jsonify({'error': f'Unknown model: {model_name}', 'models': list(registry.entries)}), 404
+
+    fields = payload.fields
+    # فك الترميز مرة واحدة بالدقة التي يحتاجها النموذج المختار
+    with metrics.stage('image_decode'):
+        img = entry.decode_fn(payload.buffer)
+    payload = None  # تحرير المرجع إلى بايتات الطلب قبل إغلاقه
+    if img is None:
+        return jsonify({'error': 'Invalid image'}), 400
+
+    try:
+        response = submit_prediction(entry, img, fields)
+    except GatewayBusy as e:
+        print(str(e))
+        return jsonify({'error': 'Server busy, retry later'}), 503
+    except ModelUnavailable:
+        return jsonify({'error': 'Model not available'}), 503
+    except Exception as e:
+        print(f"خطأ في التنبؤ بالنموذج {model_name}: {str(e)}")
+        return jsonify({'error': 'Prediction failed'}), 500
+    with metrics.stage('serialize'):
+        return jsonify(dict(response, model=entry.name))
+
+
+def handle_detect_files(model_name, files):
+    """عدة ملفات في طلب واحد -> تنبؤ واحد بالدفعة، مع نتيجة أو خطأ لكل ملف بنفس ترتيبها"""
+    entry = registry.get(model_name)
+    if entry is None or entry.predict_batch_fn is None:
+        return jsonify({'error': f'Model does not support multiple files: {model_name}'}), 400
+    if len(files) > GATEWAY_MAX_FILES:
+        return jsonify({'error': f'Too many files (max {GATEWAY_MAX_FILES})'}), 400
+
+    with metrics.stage('image_decode'):
+        images = [entry.decode_fn(np.frombuffer(f.read(), dtype=np.uint8)) for f in files]
+    valid = [i for i, img in enumerate(images) if img is not None]
+    if not valid:
+        return jsonify({'error': 'Invalid image'}), 400
+
+    try:
+        responses = submit_prediction(entry, [images[i] for i in valid], request.form, batch=True)
+    except GatewayBusy as e:
+        print(str(e))
+        return jsonify({'error': 'Server busy, retry later'}), 503
+    except ModelUnavailable:
+        return jsonify({'error': 'Model not available'}), 503
+    except Exception as e:
+        print(f"خطأ في التنبؤ بالنموذج {model_name}: {str(e)}")
+        return jsonify({'error': 'Prediction failed'}), 500
+
+    results = [{'filename': f.filename, 'error': 'Invalid image'} for f in files]
+    for i, response in zip(valid, responses):
+        results[i] = dict(response, filename=files[i].filename)
+    with metrics.stage('serialize'):
+        return jsonify({'results': results, 'count': len(results), 'model': entry.name})
+
+
+@app.route('/', methods=['GET'])
+def index():
+    return jsonify({
+        'status': 'running',
+        'message': 'بوابة موحدة لنماذج الكشف عن أمراض النباتات',
+        'default_model': GATEWAY_DEFAULT_MODEL,
+        'models': {name: e.description for name, e in registry.entries.items()},
+        'endpoints': {
+            '/api/detect?model=': 'POST - صورة (JSON base64 أو multipart أو جسم خام) مع اختيار النموذج',
+            '/predict': 'POST - توافق مع 1cnn/app.py (حقل file واحد أو أكثر، نموذج cnn38)',
+            '/api/models': 'GET - حالة النماذج والذاكرة المستخدمة',
+            '/metrics': 'GET - مقاييس Prometheus',
+            '/ready': 'GET - جاهزية البوابة بعد تحميل النماذج المحددة مسبقاً'
+        }
+    })
+
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    return jsonify(readiness.status()), (200 if readiness.ready else 503)
+
+
+@app.route('/api/models', methods=['GET'])
+def models():
+    return jsonify(registry.stats())
+
+
+@app.route('/api/detect', methods=['POST'])
+def detect():
+    model_name = request.args.get('model')
+    if not model_name:
+        data = request.get_json(silent=True) if request.is_json else request.form
+        model_name = (data or {}).get('model') or GATEWAY_DEFAULT_MODEL
+    return handle_detect(model_name)
+
+
+@app.route('/predict', methods=['POST'])
+def predict():
+    """نفس مسار 1cnn/app.py: ملف واحد -> نتيجة واحدة، عدة ملفات -> results لكل ملف"""
+    files = request.files.getlist('file')
+    if not files:
+        return jsonify({'error': 'No file uploaded'}), 400
+    if len(files) > 1:
+        return handle_detect_files('cnn38', files)
+    return handle_detect('cnn38')
+
+
+if __name__ == '__main__':
+    readiness.start(preload_models, None)
+    app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 5000)), threaded=True)
@@ -3,6 +3,8 @@ from pydantic import BaseModel
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
 import torch
 from fastapi.middleware.cors import CORSMiddleware
+import time
+from service_metrics import ServiceMetrics, install_fastapi_metrics
 
 app = FastAPI()
 
@@ -15,10 +17,16 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# مقاييس زمن مراحل الطلب والطلبات الجارية بصيغة Prometheus على /metrics
+metrics = ServiceMetrics('arabert-intent')
+install_fastapi_metrics(app, metrics)
+
 # تحميل النموذج والتوكنيزر
 model_path = "./arabert-intent"
+load_started = time.perf_counter()
 tokenizer = AutoTokenizer.from_pretrained(model_path)
 model = AutoModelForSequenceClassification.from_pretrained(model_path)
+metrics.model_load_seconds.set(time.perf_counter() - load_started, service=metrics.service)
 id2label = {0: "sensor_data", 1: "crop_info", 2: "combined"}
 
 class Query(BaseModel):
@@ -26,8 +34,10 @@ class Query(BaseModel):
 
 @app.post("/predict")
 def predict_intent(query: Query):
-    inputs = tokenizer(query.text, return_tensors="pt", truncation=True, padding=True, max_length=32)
-    with torch.no_grad():
+    with metrics.stage('preprocess'):
+        inputs = tokenizer(query.text, return_tensors="pt", truncation=True, padding=True, max_length=32)
+    with torch.no_grad(), metrics.stage('forward'):
         outputs = model(**inputs)
+    with metrics.stage('postprocess'):
         pred = torch.argmax(outputs.logits, dim=1).item()
     return {"intent": id2label[pred]} 
\ No newline at end of file
@@ -0,0 +1,72 @@
+import threading
+
+import numpy as np
+import tensorflow as tf
+
+DEFAULT_BUCKETS = (1, 2, 4, 8)
+
+
+def parse_buckets(value):
+    """'1,2,4,8' -> (1, 2, 4, 8)"""
+    buckets = sorted({int(v) for v in str(value).split(',') if v.strip()})
+    return tuple(b for b in buckets if b > 0) or DEFAULT_BUCKETS
+
+
+class CompiledPredictor:
+    """استدلال Keras عبر دوال tf.function متتبعة مسبقاً بشكل إدخال ثابت (N, H, W, 3) لكل حجم دفعة
+    بدلاً من model.predict الذي يبني محول بيانات وحلقة callbacks في كل استدعاء
+    الدفعات الصغيرة تُكمل بأصفار إلى أقرب حجم في buckets حتى لا يُعاد التتبع (أو ترجمة XLA) لكل حجم جديد
+    rescale=1/255 يجعل الإدخال uint8 ويضيف طبقة Rescaling داخل الرسم، فلا ينقل بايثون إلا بايتات الصورة"""
+
+    def __init__(self, model, input_shape=(224, 224, 3), buckets=DEFAULT_BUCKETS, jit_compile=False, rescale=None):
+        self.model = model
+        self.input_shape = tuple(input_shape)
+        self.buckets = tuple(sorted(buckets))
+        self.jit_compile = jit_compile
+        self.rescale = rescale
+        self.input_dtype = np.uint8 if rescale is not None else np.float32
+        if rescale is not None:
+            rescaling = tf.keras.layers.Rescaling(rescale)
+            self._function = tf.function(lambda x: model(rescaling(tf.cast(x, tf.float32)), training=False),
+                                         jit_compile=jit_compile)
+        else:
+            self._function = tf.function(lambda x: model(x, training=False), jit_compile=jit_compile)
+        self._concrete = {}
+        self._lock = threading.Lock()
+
+    def _concrete_for(self, bucket):
+        fn = self._concrete.get(bucket)
+        if fn is None:
+            with self._lock:
+                fn = self._concrete.get(bucket)
+                if fn is None:
+                    spec = tf.TensorSpec((bucket,) + self.input_shape, tf.as_dtype(self.input_dtype))
+                    fn = self._function.get_concrete_function(spec)
+                    self._concrete[bucket] = fn
+        return fn
+
+    def warmup(self):
+        """تتبع كل الأحجام وتشغيلها مرة (مع XLA تحدث الترجمة عند أول تشغيل وليس عند التتبع)"""
+        for bucket in self.buckets:
+            self._concrete_for(bucket)(tf.zeros((bucket,) + self.input_shape, tf.as_dtype(self.input_dtype)))
+
+    def bucket_for(self, n):
+        for bucket in self.buckets:
+            if bucket >= n:
+                return bucket
+        return self.buckets[-1]
+
+    def predict(self, batch):
+        """مثل model.predict: مصفوفة (N, H, W, 3) -> احتمالات numpy (N, classes)"""
+        batch = np.asarray(batch, dtype=self.input_dtype)
+        n = len(batch)
+        largest = self.buckets[-1]
+        if n > largest:
+            return np.concatenate([self.predict(batch[i:i + largest]) for i in range(0, n, largest)])
+        bucket = self.bucket_for(n)
+        if bucket != n:
+            padded = np.zeros((bucket,) + self.input_shape, dtype=self.input_dtype)
+            padded[:n] = batch
+            batch = padded
+        outputs = self._concrete_for(bucket)(tf.constant(batch))
+        return outputs.numpy()[:n]
@@ -0,0 +1,75 @@
+import os
+import threading
+import time
+
+
+class ModelReadiness:
+    """تتبع مرحلة تحميل النموذج وتسخينه حتى تصبح الخدمة جاهزة لاستقبال الطلبات"""
+
+    def __init__(self, service_name):
+        self.service_name = service_name
+        self.state = 'starting'  # starting -> loading -> warming -> ready | failed
+        self.load_seconds = None
+        self.warmup_seconds = None
+        self.error = None
+        self._thread = None
+
+    @property
+    def ready(self):
+        return self.state == 'ready'
+
+    def start(self, load_fn, warmup_fn, background=True):
+        """تحميل الأوزان ثم تشغيل استدلالات وهمية، في خيط خلفي افتراضياً
+        warmup_fn=None يكتفي بالتحميل (العملية الرئيسية في prefork_server.py)"""
+        if background:
+            self._thread = threading.Thread(target=self._run, args=(load_fn, warmup_fn),
+                                            name=f'{self.service_name}-warmup', daemon=True)
+            self._thread.start()
+        else:
+            self._run(load_fn, warmup_fn)
+        return self
+
+    def warm(self, warmup_fn, background=True):
+        """تسخين نموذج محمل مسبقاً فقط، مثل العمال بعد fork من العملية الرئيسية"""
+        return self.start(None, warmup_fn, background)
+
+    def _run(self, load_fn, warmup_fn):
+        try:
+            if load_fn is not None:
+                self.state = 'loading'
+                started = time.perf_counter()
+                loaded = load_fn()
+                self.load_seconds = time.perf_counter() - started
+                print(f"[metrics] service={self.service_name} model_load_seconds={self.load_seconds:.3f}")
+                if loaded is None or loaded is False:
+                    raise RuntimeError("تعذر تحميل النموذج")
+
+            if warmup_fn is not None:
+                self.state = 'warming'
+                started = time.perf_counter()
+                warmup_fn()
+                self.warmup_seconds = time.perf_counter() - started
+                print(f"[metrics] service={self.service_name} model_warmup_seconds={self.warmup_seconds:.3f}")
+
+            self.state = 'ready'
+            print(f"الخدمة {self.service_name} جاهزة لاستقبال الطلبات")
+        except Exception as e:
+            self.state = 'failed'
+            self.error = str(e)
+            print(f"فشل تجهيز النموذج للخدمة {self.service_name}: {str(e)}")
+
+    def status(self):
+        """حالة الجاهزية بصيغة قابلة للإرسال كـ JSON"""
+        return {
+            'service': self.service_name,
+            'ready': self.ready,
+            'state': self.state,
+            'model_load_seconds': self.load_seconds,
+            'model_warmup_seconds': self.warmup_seconds,
+            'error': self.error,
+        }
+
+
+def is_serving_process(debug):
+    """في وضع debug يعمل الخادم داخل العملية الفرعية للمُعيد التحميل فقط"""
+    return not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'
@@ -1,22 +1,95 @@
 from flask import Flask, request, jsonify
 import torch
-import base64
 import numpy as np
-import cv2
 import os
 import yaml
 from flask_cors import CORS
 from PIL import Image
 import io
+import importlib
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from inference_batcher import MicroBatcher, BatchQueueFull, BatchTimeout
+from model_readiness import ModelReadiness, is_serving_process
+from yolo_postprocess import summarize_detections
+from yolo_onnx_backend import OnnxYoloDetector, default_onnx_path
+from tiled_inference import TilingMetrics, run_tiled
+from debug_capture import debug_capture_from_env
+from image_input import (InMemoryUploadRequest, read_image_payload, read_image_payloads, read_image_size,
+                         decode_image_buffer, image_item_buffer, decode_stats, field_flag)
+from prediction_cache import prediction_cache_from_env, content_key, perceptual_hash
+from service_metrics import ServiceMetrics, install_flask_metrics
+from cascade_gate import CascadeThresholds, CascadeStats
+from video_stream_detector import FrameDiffer, TemporalSmoother, detect_stream, mjpeg_frames, video_file_frames
 
 app = Flask(__name__)
 CORS(app)  # تمكين CORS للسماح بالاتصال من الواجهة الأمامية
+# إبقاء الملفات المرفوعة في الذاكرة لفك ترميزها دون نسخ، مع حد أقصى لحجم الطلب
+app.request_class = InMemoryUploadRequest
+app.config['MAX_CONTENT_LENGTH'] = int(float(os.environ.get('MAX_UPLOAD_MB', 25)) * 1024 * 1024)
 
 # تحميل نموذج YOLOv5 المدرب مسبقًا - تعديل المسار إلى مسار صحيح
 # استخدام النموذج المدرب الخاص بالمستخدم
 MODEL_PATH = "D:/DatabasesANDModels/plant_disease_coco/yolo_output/plant_disease_model/weights/best.pt"
 YAML_PATH = "D:/DatabasesANDModels/plant_disease_coco/data.yaml"
+YOLOV5_DIR = "D:/DatabasesANDModels/plant_disease_coco/yolov5"
 model = None
+model_lock = threading.Lock()
+# استدعاء واحد للنموذج في كل مرة: طبقة Detect في YOLOv5 تعيد بناء grid المشتركة عند تغير حجم الإدخال
+inference_lock = threading.Lock()
+
+# حجم إدخال النموذج (نفس قيمة --img في train_yolov5.py) وعدد استدلالات التسخين
+YOLO_IMG_SIZE = 416
+WARMUP_RUNS = int(os.environ.get('WARMUP_RUNS', 3))
+
+# محرك التشغيل: torch (YOLOv5 عبر torch.hub) أو onnx (ONNX Runtime، انظر export_yolo_onnx.py)
+YOLO_BACKEND = os.environ.get('YOLO_BACKEND', 'torch').lower()
+YOLO_ONNX_PATH = os.environ.get('YOLO_ONNX_PATH', default_onnx_path(MODEL_PATH))
+YOLO_ONNX_THREADS = int(os.environ.get('YOLO_ONNX_THREADS', 0)) or None  # خيوط ONNX Runtime (الافتراضي كل الأنوية)
+# ملف الأوزان الذي تحمله الخلفية المختارة فعلاً
+ACTIVE_MODEL_PATH = YOLO_ONNX_PATH if YOLO_BACKEND == 'onnx' else MODEL_PATH
+
+# عتبة الثقة وعدد الأمراض المُبلغ عنها لكل صورة
+CONF_THRESHOLD = float(os.environ.get('CONF_THRESHOLD', 0.25))
+TOP_K_DISEASES = int(os.environ.get('TOP_K_DISEASES', 3))
+
+# إعدادات تجميع الطلبات في دفعات (قابلة للتعديل عبر متغيرات البيئة)
+BATCH_WINDOW_MS = float(os.environ.get('BATCH_WINDOW_MS', 10))  # نافذة انتظار تجميع الطلبات
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', 8))  # أقصى عدد صور في الدفعة الواحدة
+BATCH_QUEUE_DEPTH = int(os.environ.get('BATCH_QUEUE_DEPTH', 64))  # أقصى عدد طلبات تنتظر في الطابور
+BATCH_TIMEOUT_S = float(os.environ.get('BATCH_TIMEOUT_S', 30))  # مهلة انتظار نتيجة الطلب
+
+# الكشف بالتقطيع للصور عالية الدقة (صور الهاتف 12MP والطائرات المسيرة) حتى لا تختفي البقع الصغيرة
+TILING_ENABLED = os.environ.get('TILING_ENABLED', '1') == '1'
+TILE_THRESHOLD = int(os.environ.get('TILE_THRESHOLD', 1600))  # يُفعّل عندما يتجاوز الضلع الأطول هذا الحد
+TILE_OVERLAP = float(os.environ.get('TILE_OVERLAP', 0.2))
+TILE_MIN_STD = float(os.environ.get('TILE_MIN_STD', 6.0))  # مربعات أقل تبايناً تعتبر خلفية وتُتخطى
+TILE_DECODE_SIDE = int(os.environ.get('TILE_DECODE_SIDE', 2048))  # أقصى ضلع للصورة المقطعة (حد لعدد المربعات)
+
+# مسار الدفعات /api/detect/batch لصور المسح الميداني (عدة أوراق لكل نبات أو صف)
+BATCH_ENDPOINT_MAX_IMAGES = int(os.environ.get('BATCH_ENDPOINT_MAX_IMAGES', 64))
+# حد حجم طلب الدفعات مستقل عن MAX_UPLOAD_MB: عشرون صورة هاتف بصيغة base64 تتجاوز 80MB
+BATCH_MAX_UPLOAD_BYTES = int(float(os.environ.get('BATCH_MAX_UPLOAD_MB', 256)) * 1024 * 1024)
+DECODE_WORKERS = int(os.environ.get('DECODE_WORKERS', min(8, os.cpu_count() or 1)))
+
+# مسار الفيديو /api/detect/stream لكاميرات الصوبة (ملف فيديو أو تدفق MJPEG)
+STREAM_MAX_UPLOAD_BYTES = int(float(os.environ.get('STREAM_MAX_UPLOAD_MB', 512)) * 1024 * 1024)
+STREAM_MAX_SECONDS = float(os.environ.get('STREAM_MAX_SECONDS', 300))  # أقصى مدة معالجة لطلب واحد
+STREAM_MAX_SIDE = int(os.environ.get('STREAM_MAX_SIDE', 1280))  # تصغير الإطارات الكبيرة قبل الكشف
+STREAM_DIFF_THRESHOLD = float(os.environ.get('STREAM_DIFF_THRESHOLD', 4.0))  # فرق الإطارات شبه المكررة (0-255)
+STREAM_MAX_SKIP = int(os.environ.get('STREAM_MAX_SKIP', 30))
+STREAM_EMA_ALPHA = float(os.environ.get('STREAM_EMA_ALPHA', 0.3))
+STREAM_ALERT_THRESHOLD = float(os.environ.get('STREAM_ALERT_THRESHOLD', 0.5))
+STREAM_ALERT_FRAMES = int(os.environ.get('STREAM_ALERT_FRAMES', 3))  # إطارات متتالية قبل التنبيه
+MJPEG_STREAM_TYPES = ('multipart/x-mixed-replace', 'video/x-motion-jpeg', 'video/mjpeg')
+
+# الوضع المتتالي: مصنف MobileNetV2 الخفيف (plant_disease_cnn_api) أولاً، ثم YOLO فقط إذا كانت ثقته منخفضة
+CASCADE_ENABLED = os.environ.get('CASCADE_ENABLED', '0') == '1'
+CASCADE_THRESHOLDS_PATH = os.environ.get('CASCADE_THRESHOLDS_PATH', './model/cascade_thresholds.json')  # من calibrate_cascade.py
+CASCADE_DEFAULT_THRESHOLD = float(os.environ.get('CASCADE_DEFAULT_THRESHOLD', 90.0))  # ثقة % عند غياب ملف المعايرة
+HEALTHY_DISEASES = ('نبات سليم', 'سليم')
 
 # تحميل أسماء الفئات من ملف data.yaml
 def load_class_names():
@@ -100,110 +173,370 @@ def get_mock_result(plant_name="طماطم"):
 def load_model():
     """تحميل نموذج YOLOv5"""
     global model
-    try:
-        if model is None:
-            print("محاولة تحميل النموذج من مسار:", MODEL_PATH)
-            
-            # التحقق من وجود الملف
-            if not os.path.exists(MODEL_PATH):
-                print(f"خطأ: ملف النموذج غير موجود في المسار {MODEL_PATH}")
-                return None
-                
-            # محاولة تحميل النموذج مباشرة
-            try:
-                model = torch.hub.load('D:/DatabasesANDModels/plant_disease_coco/yolov5', 'custom', 
-                                      path=MODEL_PATH, source='local')
-                model.conf = 0.25  # خفض مستوى الثقة لزيادة فرص الكشف
-                model.iou = 0.45  # عتبة IoU
-                print("تم تحميل النموذج بنجاح")
-            except Exception as e:
-                print(f"فشل تحميل النموذج باستخدام torch.hub.load: {str(e)}")
+    if model is not None:
+        return model
+    # قفل لمنع تحميل النموذج مرتين عند تزامن التسخين مع أول طلب
+    with model_lock:
+        try:
+            if model is None and YOLO_BACKEND == 'onnx':
+                print("محاولة تحميل نموذج ONNX من مسار:", YOLO_ONNX_PATH)
+                if not os.path.exists(YOLO_ONNX_PATH):
+                    print(f"خطأ: ملف النموذج غير موجود في المسار {YOLO_ONNX_PATH}")
+                    return None
+                model = OnnxYoloDetector(YOLO_ONNX_PATH, img_size=YOLO_IMG_SIZE,
+                                         conf_thres=CONF_THRESHOLD, iou_thres=0.45,
+                                         num_threads=YOLO_ONNX_THREADS, stage=metrics.stage)
+                print("تم تحميل نموذج ONNX بنجاح")
+            elif model is None:
+                print("محاولة تحميل النموذج من مسار:", MODEL_PATH)
                 
-                # محاولة تحميل النموذج باستخدام طريقة أخرى
+                # التحقق من وجود الملف
+                if not os.path.exists(MODEL_PATH):
+                    print(f"خطأ: ملف النموذج غير موجود في المسار {MODEL_PATH}")
+                    return None
+                    
+                # محاولة تحميل النموذج مباشرة
                 try:
-                    model = torch.load(MODEL_PATH, map_location=torch.device('cpu'))
-                    if hasattr(model, 'model'):
-                        model = model['model']
-                    print("تم تحميل النموذج باستخدام torch.load")
-                except Exception as e2:
-                    print(f"فشل تحميل النموذج باستخدام torch.load: {str(e2)}")
-                    model = None
-    except Exception as e:
-        print(f"خطأ عام في تحميل النموذج: {str(e)}")
-        model = None
+                    model = torch.hub.load(YOLOV5_DIR, 'custom', 
+                                          path=MODEL_PATH, source='local')
+                    model.conf = CONF_THRESHOLD  # خفض مستوى الثقة لزيادة فرص الكشف
+                    model.iou = 0.45  # عتبة IoU
+                    print("تم تحميل النموذج بنجاح")
+                except Exception as e:
+                    print(f"فشل تحميل النموذج باستخدام torch.hub.load: {str(e)}")
+                    
+                    # محاولة تحميل النموذج باستخدام طريقة أخرى
+                    try:
+                        model = torch.load(MODEL_PATH, map_location=torch.device('cpu'))
+                        if hasattr(model, 'model'):
+                            model = model['model']
+                        print("تم تحميل النموذج باستخدام torch.load")
+                    except Exception as e2:
+                        print(f"فشل تحميل النموذج باستخدام torch.load: {str(e2)}")
+                        model = None
+        except Exception as e:
+            print(f"خطأ عام في تحميل النموذج: {str(e)}")
+            model = None
     
     return model
 
-def base64_to_image(base64_string):
-    """تحويل صورة base64 إلى صورة OpenCV"""
-    try:
-        # التحقق من صحة بيانات base64
-        if not isinstance(base64_string, str):
-            print("بيانات الصورة ليست نصية")
-            return None
-        
-        if len(base64_string) < 100:
-            print("بيانات الصورة قصيرة جدًا")
-            return None
-            
-        # تحويل صورة base64 إلى صورة OpenCV
-        if ',' in base64_string:
-            base64_string = base64_string.split(',')[1]
-        
-        img_bytes = base64.b64decode(base64_string)
-        img_array = np.frombuffer(img_bytes, dtype=np.uint8)
-        img = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
-        
-        if img is None:
-            print("فشل في تحويل بيانات base64 إلى صورة")
-            return None
-            
-        return img
-    except Exception as e:
-        print(f"خطأ في معالجة الصورة: {str(e)}")
-        return None
+def warmup_model():
+    """تشغيل استدلالات وهمية بحجم الإدخال الحقيقي لتهيئة النموذج قبل أول طلب"""
+    dummy = np.zeros((YOLO_IMG_SIZE, YOLO_IMG_SIZE, 3), dtype=np.uint8)
+    for _ in range(WARMUP_RUNS):
+        run_batch_inference([dummy])
+    # تسخين مسار الدفعة الكاملة أيضاً حتى لا يدفع أول طلب متزامن ثمن تهيئته
+    run_batch_inference([dummy] * BATCH_MAX_SIZE)
+    if CASCADE_ENABLED:
+        # تحميل المصنف هنا وليس في load_model: في prefork_server.py يعمل التسخين داخل العامل بعد fork
+        classifier = get_classifier()
+        if classifier.load_model_and_classes():
+            classifier.warmup_model()
+
+def run_batch_inference(images):
+    """تشغيل النموذج على دفعة صور BGR وإرجاع مصفوفة كشف (n, 6) لكل صورة"""
+    with inference_lock:
+        return _run_batch_inference_locked(images)
+
+def _run_batch_inference_locked(images):
+    if YOLO_BACKEND == 'onnx':
+        return model(images)
+    # YOLOv5 AutoShape يتوقع صور RGB
+    results = model([img[:, :, ::-1] for img in images], size=YOLO_IMG_SIZE)
+    # AutoShape يقيس بنفسه زمن المعالجة المسبقة والاستدلال و NMS (مللي ثانية لكل صورة)
+    times = getattr(results, 't', None)
+    if times and len(times) == 3:
+        for name, ms in zip(('preprocess', 'forward', 'nms'), times):
+            metrics.observe_stage(name, ms * len(images) / 1000.0)
+    return list(results.xyxy)
+
+# مجدول الدفعات المشترك بين جميع الطلبات
+batcher = MicroBatcher(run_batch_inference, window_ms=BATCH_WINDOW_MS,
+                       max_batch_size=BATCH_MAX_SIZE, max_queue_depth=BATCH_QUEUE_DEPTH)
+
+def batched_inference(images):
+    """تمرير عدة صور (مربعات أو صور دفعة) عبر مجدول الدفعات حتى يبقى حد الطابور والتزامن ساريين"""
+    return batcher.submit_many(images, timeout=BATCH_TIMEOUT_S)
+
+# إحصائيات وضع التقطيع
+tiling_metrics = TilingMetrics()
+
+# خيوط فك ترميز الصور بالتوازي لمسار الدفعات (cv2.imdecode يحرر GIL)
+decode_pool = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix='decode')
+
+# حالة تحميل النموذج وتسخينه لمسار /ready
+readiness = ModelReadiness('yolov5')
+
+# حفظ عينات الطلبات للتصحيح في خيط خلفي بدلاً من debug_image.jpg و runs/detect/expN
+debug_capture = debug_capture_from_env('debug_captures/yolov5')
+
+# ذاكرة مؤقتة لملخصات الكشف للصور المكررة أو شبه المتطابقة (تُفرغ عند تغير ملف النموذج)
+prediction_cache = prediction_cache_from_env(ACTIVE_MODEL_PATH)
+
+# عتبات المصنف ونسبة التصعيد إلى الكاشف في الوضع المتتالي
+cascade_thresholds = CascadeThresholds.load(CASCADE_THRESHOLDS_PATH, CASCADE_DEFAULT_THRESHOLD) if CASCADE_ENABLED else None
+cascade_stats = CascadeStats()
+
+# مقاييس زمن مراحل الطلب والطلبات الجارية بصيغة Prometheus على /metrics
+metrics = ServiceMetrics('yolov5')
+install_flask_metrics(app, metrics)
+metrics.model_load_seconds.set_function(lambda: readiness.load_seconds, service=metrics.service)
+metrics.register_stats('batching', batcher.stats)
+metrics.register_stats('decode', decode_stats.stats)
+metrics.register_stats('tiling', tiling_metrics.stats)
+metrics.register_stats('debug_capture', debug_capture.stats)
+metrics.register_stats('prediction_cache', lambda: prediction_cache.stats() if prediction_cache is not None else None)
+metrics.register_stats('cascade', lambda: cascade_stats.stats() if CASCADE_ENABLED else None)
 
 def translate_disease_name(english_name):
     """ترجمة اسم المرض من الإنجليزية إلى العربية"""
     return DISEASE_TRANSLATIONS.get(english_name, english_name)
 
+def get_class_names():
+    """أسماء الفئات من data.yaml، أو من النموذج نفسه إذا لم يتوفر الملف"""
+    if DISEASE_CLASSES:
+        return DISEASE_CLASSES
+    return getattr(model, 'names', []) if model is not None else []
+
+def build_detection_response(summary, plant_name, include_boxes=False):
+    """بناء استجابة الكشف من ملخص الفئات (أعلى مرض ثقةً أولاً)"""
+    if not summary['classes']:
+        print("لم يتم العثور على أي أمراض، إرجاع 'سليم'")
+        response = {
+            'disease': 'نبات سليم',
+            'confidence': 95.0,
+            'plant': plant_name,
+            'severity': 'منخفض',
+            'treatment': TREATMENTS['نبات سليم']['treatment'],
+            'preventive': TREATMENTS['نبات سليم']['preventive'],
+            'timeDetected': '',
+            'diseases': []
+        }
+        if include_boxes:
+            response['boxes'] = summary.get('boxes', [])
+        return response
+    
+    best = summary['classes'][0]
+    english_disease_name = best['name']
+    disease_name = translate_disease_name(english_disease_name)
+    confidence = round(best['confidence'] * 100, 1)
+    print(f"أفضل تنبؤ: {english_disease_name} ({disease_name}) بثقة {confidence}%")
+    
+    # الحصول على معلومات العلاج
+    treatment_info = TREATMENTS.get(disease_name, {
+        'treatment': 'استشر خبير زراعي',
+        'preventive': 'مراقبة النبات بانتظام',
+        'severity': 'متوسط'
+    })
+    
+    # إعداد الاستجابة
+    response = {
+        'disease': disease_name,
+        'confidence': confidence,
+        'plant': plant_name,
+        'severity': treatment_info['severity'],
+        'treatment': treatment_info['treatment'],
+        'preventive': treatment_info['preventive'],
+        'timeDetected': '',
+        'english_name': english_disease_name,  # إضافة الاسم الإنجليزي للتصحيح
+        # جميع الأمراض المكتشفة على الورقة (أعلى k حسب الثقة)
+        'diseases': [{
+            'disease': translate_disease_name(c['name']),
+            'english_name': c['name'],
+            'confidence': round(c['confidence'] * 100, 1),
+            'count': c['count']
+        } for c in summary['classes']]
+    }
+    if include_boxes:
+        response['boxes'] = summary.get('boxes', [])
+    return response
+
+def get_classifier():
+    """خدمة المصنف تُستورد عند أول استخدام فقط حتى لا يُحمّل TensorFlow عند تعطيل الوضع المتتالي"""
+    return importlib.import_module('plant_disease_cnn_api')
+
+def classify_for_cascade(img, plant_name, include_boxes=False):
+    """تشغيل المصنف وإرجاع استجابته إذا تجاوزت ثقته العتبة المعايرة لفئته، وإلا None للتصعيد إلى YOLO"""
+    classifier = get_classifier()
+    if not classifier.load_model_and_classes():
+        return None
+    with metrics.stage('classifier'):
+        class_name, confidence = classifier.classify_image(img)
+    if not cascade_thresholds.accept(class_name, confidence):
+        print(f"ثقة المصنف {confidence:.1f}% أقل من العتبة {cascade_thresholds.threshold_for(class_name)}%، "
+              f"التصعيد إلى YOLO")
+        return None
+    response = classifier.build_prediction_response(class_name, confidence, plant_name)
+    response['confidence'] = round(confidence, 1)
+    response['english_name'] = str(class_name)
+    response['diseases'] = [{'disease': response['disease'], 'english_name': str(class_name),
+                             'confidence': response['confidence'], 'count': 1}]
+    response['source'] = 'classifier'
+    if include_boxes:
+        response['boxes'] = []  # المصنف لا يحدد مواقع الإصابة
+    return response
+
+def decode_for_detection(buffer):
+    """فك ترميز JPEG بأصغر دقة تكفي: حجم إدخال النموذج للصور العادية، وللصور التي ستُقطّع
+    دقة بين TILE_THRESHOLD و TILE_DECODE_SIDE (صورة 4000x3000 تُفك بنصف الدقة إلى 2000x1500)"""
+    if buffer is None:
+        return None
+    if not TILING_ENABLED:
+        return decode_image_buffer(buffer, YOLO_IMG_SIZE, fit='long')
+    header = read_image_size(buffer)
+    if header is not None and max(header[:2]) > TILE_THRESHOLD:
+        return decode_image_buffer(buffer, TILE_THRESHOLD, fit='long', max_size=TILE_DECODE_SIDE)
+    return decode_image_buffer(buffer, YOLO_IMG_SIZE, fit='long', max_size=TILE_DECODE_SIDE)
+
+def detect_image(img):
+    """كشف على صورة واحدة: بالتقطيع للصور الكبيرة (المربعات تشكل دفعتها الخاصة) وإلا عبر مجدول الدفعات"""
+    if TILING_ENABLED and max(img.shape[:2]) > TILE_THRESHOLD:
+        det = run_tiled(img, batched_inference, tile=YOLO_IMG_SIZE, overlap=TILE_OVERLAP,
+                        batch_size=BATCH_MAX_SIZE, min_std=TILE_MIN_STD, metrics=tiling_metrics)
+        print(f"تم تنفيذ الكشف بالتقطيع لصورة بأبعاد {img.shape[1]}x{img.shape[0]}")
+        return det
+    return batcher.submit(img, timeout=BATCH_TIMEOUT_S)
+
+def detect_images(images):
+    """كشف على قائمة صور عبر مجدول الدفعات: الكبيرة بالتقطيع والبقية في دفعات بحجم BATCH_MAX_SIZE"""
+    detections = [None] * len(images)
+    small = []
+    for i, img in enumerate(images):
+        if TILING_ENABLED and max(img.shape[:2]) > TILE_THRESHOLD:
+            detections[i] = run_tiled(img, batched_inference, tile=YOLO_IMG_SIZE, overlap=TILE_OVERLAP,
+                                      batch_size=BATCH_MAX_SIZE, min_std=TILE_MIN_STD, metrics=tiling_metrics)
+        else:
+            small.append(i)
+    for start in range(0, len(small), BATCH_MAX_SIZE):
+        chunk = small[start:start + BATCH_MAX_SIZE]
+        for i, det in zip(chunk, batched_inference([images[i] for i in chunk])):
+            detections[i] = det
+    return detections
+
+def aggregate_plant_results(results):
+    """تجميع نتائج أوراق النبات الواحد: المرض السائد ونسبة الأوراق المصابة والتوصية العلاجية"""
+    analyzed = [r for r in results if 'error' not in r]
+    infected = [r for r in analyzed if r['disease'] not in HEALTHY_DISEASES]
+    
+    disease_counts = {}
+    disease_confidence = {}
+    for r in infected:
+        disease_counts[r['disease']] = disease_counts.get(r['disease'], 0) + 1
+        disease_confidence[r['disease']] = disease_confidence.get(r['disease'], 0.0) + r['confidence']
+    
+    if infected:
+        # المرض الأكثر تكراراً بين الأوراق، وعند التعادل الأعلى ثقة إجمالية
+        dominant = max(disease_counts, key=lambda d: (disease_counts[d], disease_confidence[d]))
+    else:
+        dominant = 'نبات سليم'
+    treatment_info = TREATMENTS.get(dominant, {
+        'treatment': 'استشر خبير زراعي',
+        'preventive': 'مراقبة النبات بانتظام',
+        'severity': 'متوسط'
+    })
+    
+    return {
+        'images': len(results),
+        'analyzed': len(analyzed),
+        'infected': len(infected),
+        'infected_share': round(100.0 * len(infected) / len(analyzed), 1) if analyzed else 0.0,
+        'dominant_disease': dominant,
+        'dominant_confidence': round(disease_confidence[dominant] / disease_counts[dominant], 1) if infected else None,
+        'disease_counts': disease_counts,
+        'severity': treatment_info['severity'],
+        'treatment': treatment_info['treatment'],
+        'preventive': treatment_info['preventive']
+    }
+
 @app.route('/', methods=['GET'])
 def index():
     """صفحة الترحيب"""
     return jsonify({
         'status': 'running',
         'message': 'خدمة API للكشف عن أمراض النباتات',
+        'backend': YOLO_BACKEND,
         'endpoints': {
-            '/api/detect': 'POST - إرسال صورة للكشف عن الأمراض'
+            '/api/detect': 'POST - إرسال صورة للكشف عن الأمراض (JSON base64 أو multipart/form-data أو image/jpeg|png خام)',
+            '/api/detect/batch': 'POST - إرسال عدة صور لنبات واحد مع نتيجة مجمعة (المرض السائد ونسبة الإصابة)',
+            '/api/detect/stream': 'POST - ملف فيديو (حقل video أو جسم video/*) أو تدفق MJPEG مع تنبيهات منعمة عبر الإطارات',
+            '/api/stats': 'GET - إحصائيات تجميع الطلبات في دفعات والذاكرة المؤقتة وحفظ صور التصحيح والوضع المتتالي',
+            '/metrics': 'GET - زمن كل مرحلة من مراحل الطلب والطلبات الجارية بصيغة Prometheus',
+            '/ready': 'GET - جاهزية الخدمة بعد تحميل النموذج وتسخينه'
         },
         'supported_diseases': list(DISEASE_TRANSLATIONS.values())
     })
 
+@app.route('/ready', methods=['GET'])
+def ready():
+    """فحص الجاهزية لموزع الأحمال: 200 فقط بعد انتهاء التسخين"""
+    return jsonify(readiness.status()), (200 if readiness.ready else 503)
+
+@app.route('/api/stats', methods=['GET'])
+def stats():
+    """إحصائيات امتلاء الدفعات وزمن الانتظار في الطابور"""
+    return jsonify({
+        'batching': batcher.stats(),
+        'decode': decode_stats.stats(),
+        'tiling': tiling_metrics.stats(),
+        'debug_capture': debug_capture.stats(),
+        'prediction_cache': prediction_cache.stats() if prediction_cache is not None else None,
+        'cascade': cascade_stats.stats() if CASCADE_ENABLED else None
+    })
+
 @app.route('/api/detect', methods=['POST'])
 def detect_disease():
     """الكشف عن أمراض النباتات من الصورة"""
+    request_started = time.perf_counter()
     try:
-        # استلام الصورة من الطلب
-        data = request.json
-        if not data or 'image' not in data:
+        # استلام الصورة من الطلب: JSON (base64) أو multipart/form-data أو جسم خام image/jpeg|png
+        payload = read_image_payload(request, stage=metrics.stage)
+        if payload is None:
             print("لم يتم توفير صورة")
             return jsonify({'error': 'No image provided'}), 400
         
-        print("استلام طلب للكشف عن الأمراض")
+        print(f"استلام طلب للكشف عن الأمراض ({payload.source})")
+        data = payload.fields
         plant_name = data.get('plant', 'طماطم')
+        include_boxes = field_flag(data, 'return_boxes')
         
-        # تحويل الصورة من base64 إلى صورة
-        img = base64_to_image(data['image'])
+        # البحث في الذاكرة المؤقتة بمفتاح المحتوى قبل فك ترميز الصورة
+        cache_key = None
+        if prediction_cache is not None and payload.buffer is not None:
+            cache_key = content_key(payload.buffer)
+            cached = prediction_cache.get(cache_key)
+            if cached is not None:
+                print("تم العثور على النتيجة في الذاكرة المؤقتة")
+                return jsonify(build_detection_response(cached, plant_name, include_boxes))
+        
+        # فك ترميز الصورة مباشرة من بايتات الطلب
+        with metrics.stage('image_decode'):
+            img = decode_for_detection(payload.buffer)
+        payload = None  # تحرير المرجع إلى بايتات الطلب قبل إغلاقه
         if img is None:
             print("فشل في تحويل الصورة")
             return jsonify(get_mock_result(plant_name))
         
-        # حفظ الصورة للتصحيح
-        try:
-            cv2.imwrite('debug_image.jpg', img)
-            print("تم حفظ الصورة للتصحيح في debug_image.jpg")
-        except Exception as e:
-            print(f"فشل في حفظ الصورة للتصحيح: {str(e)}")
+        # البحث عن صورة شبه متطابقة (إعادة رفع أو إعادة تصوير)
+        phash = None
+        if cache_key is not None:
+            phash = perceptual_hash(img) if prediction_cache.perceptual_enabled else None
+            cached = prediction_cache.get_similar(phash)
+            if cached is not None:
+                print("تم العثور على نتيجة صورة مشابهة في الذاكرة المؤقتة")
+                return jsonify(build_detection_response(cached, plant_name, include_boxes))
+        
+        # الوضع المتتالي: جواب المصنف مباشرة عندما تكون ثقته كافية
+        if CASCADE_ENABLED:
+            try:
+                response = classify_for_cascade(img, plant_name, include_boxes)
+            except Exception as e:
+                print(f"خطأ في المصنف، التصعيد إلى YOLO: {str(e)}")
+                cascade_stats.record_failure()
+                response = None
+            if response is not None:
+                cascade_stats.record('classifier', time.perf_counter() - request_started)
+                with metrics.stage('serialize'):
+                    return jsonify(response)
         
         # التحقق من وجود نموذج
         model = load_model()
@@ -211,110 +544,178 @@ def detect_disease():
             print("النموذج غير متاح")
             return jsonify(get_mock_result(plant_name))
         
-        # تنفيذ الكشف
+        # تنفيذ الكشف عبر مجدول الدفعات، أو بالتقطيع للصور الكبيرة (المربعات تشكل دفعتها الخاصة)
+        # مرحلة inference تشمل انتظار الدفعة؛ أزمنة preprocess/forward/nms تُسجل داخل run_batch_inference
+        inference_started = time.perf_counter()
         try:
-            results = model(img)
+            with metrics.stage('inference'):
+                det = detect_image(img)
             print("تم تنفيذ الكشف بنجاح")
-            
-            # حفظ نتائج الكشف للتصحيح
-            try:
-                results.save()
-                print("تم حفظ نتائج الكشف")
-            except Exception as e:
-                print(f"فشل في حفظ نتائج الكشف: {str(e)}")
-                
+        except (BatchQueueFull, BatchTimeout) as e:
+            print(str(e))
+            return jsonify({'error': 'Server busy, retry later'}), 503
         except Exception as e:
             print(f"خطأ في تنفيذ الكشف: {str(e)}")
             return jsonify(get_mock_result(plant_name))
         
-        # معالجة النتائج
+        # معالجة النتائج مباشرة على مصفوفة الكشف الخام دون بناء DataFrame
         try:
-            # طباعة كل المعلومات المتاحة عن النتائج للتصحيح
-            print("نوع النتائج:", type(results))
-            
-            predictions = results.pandas().xyxy[0].to_dict(orient='records')
-            print(f"التنبؤات: {predictions}")
-            
-            # طباعة الأعمدة المتاحة في النتائج
-            if hasattr(results.pandas().xyxy[0], 'columns'):
-                print("الأعمدة المتاحة:", list(results.pandas().xyxy[0].columns))
-                
+            with metrics.stage('postprocess'):
+                summary = summarize_detections(det, get_class_names(),
+                                               conf_thres=CONF_THRESHOLD, top_k=TOP_K_DISEASES,
+                                               return_boxes=True)
+                response = build_detection_response(summary, plant_name, include_boxes)
         except Exception as e:
             print(f"خطأ في معالجة النتائج: {str(e)}")
             return jsonify(get_mock_result(plant_name))
         
-        if not predictions:
-            print("لم يتم العثور على أي أمراض، إرجاع 'سليم'")
-            return jsonify({
-                'disease': 'نبات سليم',
-                'confidence': 95.0,
-                'plant': plant_name,
-                'severity': 'منخفض',
-                'treatment': TREATMENTS['نبات سليم']['treatment'],
-                'preventive': TREATMENTS['نبات سليم']['preventive'],
-                'timeDetected': ''
-            })
-        
-        # اختيار التنبؤ ذو أعلى ثقة
-        best_prediction = max(predictions, key=lambda x: x['confidence'])
-        print(f"أفضل تنبؤ: {best_prediction}")
-        
-        # طباعة مفاتيح التنبؤ للتصحيح
-        print("مفاتيح التنبؤ:", list(best_prediction.keys()))
-        
-        # استخراج اسم المرض والثقة
-        english_disease_name = None
-        
-        # محاولة استخراج اسم المرض من مفاتيح مختلفة
-        if 'name' in best_prediction:
-            english_disease_name = best_prediction['name']
-            print(f"تم العثور على اسم المرض في مفتاح 'name': {english_disease_name}")
-        elif 'class' in best_prediction:
-            class_index = int(best_prediction['class'])
-            print(f"تم العثور على مؤشر الفئة: {class_index}")
-            if 0 <= class_index < len(DISEASE_CLASSES):
-                english_disease_name = DISEASE_CLASSES[class_index]
-                print(f"تم تحويل مؤشر الفئة إلى اسم المرض: {english_disease_name}")
-            else:
-                english_disease_name = "plants"  # افتراض أنه سليم إذا كان المؤشر خارج النطاق
-                print(f"مؤشر الفئة خارج النطاق، استخدام القيمة الافتراضية: {english_disease_name}")
-        else:
-            print("لم يتم العثور على مفتاح للاسم في التنبؤ")
-            english_disease_name = "plants"  # قيمة افتراضية
-        
-        # ترجمة اسم المرض إلى العربية
-        disease_name = translate_disease_name(english_disease_name)
-        print(f"اسم المرض بالإنجليزية: {english_disease_name}, بالعربية: {disease_name}")
+        if cache_key is not None:
+            prediction_cache.put(cache_key, summary, phash, time.perf_counter() - inference_started)
         
-        confidence = round(float(best_prediction['confidence']) * 100, 1)
-        print(f"الثقة: {confidence}%")
-        
-        # الحصول على معلومات العلاج
-        treatment_info = TREATMENTS.get(disease_name, {
-            'treatment': 'استشر خبير زراعي',
-            'preventive': 'مراقبة النبات بانتظام',
-            'severity': 'متوسط'
-        })
-        
-        # إعداد الاستجابة
-        response = {
-            'disease': disease_name,
-            'confidence': confidence,
-            'plant': plant_name,
-            'severity': treatment_info['severity'],
-            'treatment': treatment_info['treatment'],
-            'preventive': treatment_info['preventive'],
-            'timeDetected': '',
-            'english_name': english_disease_name  # إضافة الاسم الإنجليزي للتصحيح
-        }
+        # حفظ عينة للتصحيح (عشوائياً أو عند انخفاض الثقة) دون انتظار الكتابة على القرص
+        if debug_capture.should_capture(response['confidence'] if summary['classes'] else None):
+            debug_capture.submit(img, dict(response, boxes=summary['boxes']))
         
         print(f"إرسال الاستجابة: {response}")
-        return jsonify(response)
+        if CASCADE_ENABLED:
+            response['source'] = 'detector'
+            cascade_stats.record('detector', time.perf_counter() - request_started)
+        with metrics.stage('serialize'):
+            return jsonify(response)
     
     except Exception as e:
         print(f"خطأ عام: {str(e)}")
-        plant_name = request.json.get('plant', 'طماطم') if request.json else 'طماطم'
+        data = request.get_json(silent=True) or request.form
+        plant_name = data.get('plant', 'طماطم') if data else 'طماطم'
         return jsonify(get_mock_result(plant_name))
 
+@app.route('/api/detect/batch', methods=['POST'])
+def detect_disease_batch():
+    """الكشف عن الأمراض في عدة صور (أوراق نبات أو صف في الصوبة) بطلب واحد"""
+    request.max_content_length = BATCH_MAX_UPLOAD_BYTES
+    items, data = read_image_payloads(request, stage=metrics.stage)
+    if not items:
+        print("لم يتم توفير صور")
+        return jsonify({'error': 'No images provided'}), 400
+    if len(items) > BATCH_ENDPOINT_MAX_IMAGES:
+        return jsonify({'error': f'Too many images (max {BATCH_ENDPOINT_MAX_IMAGES})'}), 413
+    
+    plant_name = data.get('plant', 'طماطم')
+    include_boxes = field_flag(data, 'return_boxes')
+    print(f"استلام طلب دفعة للكشف عن الأمراض ({len(items)} صورة)")
+    
+    # فك ترميز الصور بالتوازي
+    with metrics.stage('image_decode'):
+        images = list(decode_pool.map(lambda item: decode_for_detection(image_item_buffer(item)), items))
+    items = None  # تحرير المراجع إلى بايتات الطلب قبل إغلاقه
+    valid = [i for i, img in enumerate(images) if img is not None]
+    
+    if load_model() is None:
+        print("النموذج غير متاح")
+        return jsonify({'error': 'Model not available'}), 503
+    
+    try:
+        with metrics.stage('inference'):
+            detections = detect_images([images[i] for i in valid])
+    except (BatchQueueFull, BatchTimeout) as e:
+        print(str(e))
+        return jsonify({'error': 'Server busy, retry later'}), 503
+    except Exception as e:
+        print(f"خطأ في تنفيذ الكشف: {str(e)}")
+        return jsonify({'error': 'Detection failed'}), 500
+    
+    results = [{'index': i, 'error': 'Invalid image'} for i in range(len(images))]
+    class_names = get_class_names()
+    with metrics.stage('postprocess'):
+        for i, det in zip(valid, detections):
+            summary = summarize_detections(det, class_names, conf_thres=CONF_THRESHOLD,
+                                           top_k=TOP_K_DISEASES, return_boxes=include_boxes)
+            results[i] = dict(build_detection_response(summary, plant_name, include_boxes), index=i)
+        response = {'results': results, 'aggregate': dict(aggregate_plant_results(results), plant=plant_name)}
+    print(f"نتيجة الدفعة: {response['aggregate']}")
+    with metrics.stage('serialize'):
+        return jsonify(response)
+
+def save_video_upload(stream, filename=''):
+    """نسخ الفيديو المرفوع إلى ملف مؤقت على دفعات (cv2.VideoCapture يحتاج مساراً)"""
+    suffix = os.path.splitext(filename or '')[1] or '.mp4'
+    handle, path = tempfile.mkstemp(prefix='stream_', suffix=suffix)
+    with os.fdopen(handle, 'wb') as f:
+        while True:
+            chunk = stream.read(1024 * 1024)
+            if not chunk:
+                break
+            f.write(chunk)
+    return path
+
+def translate_stream_event(event):
+    return dict(event, disease=translate_disease_name(event['class']))
+
+@app.route('/api/detect/stream', methods=['POST'])
+def detect_disease_stream():
+    """الكشف على إطارات فيديو: تخطي الإطارات شبه المكررة وتجميع البقية في دفعات وتنعيم النتائج عبر الزمن"""
+    request.max_content_length = STREAM_MAX_UPLOAD_BYTES
+    if load_model() is None:
+        print("النموذج غير متاح")
+        return jsonify({'error': 'Model not available'}), 503
+    
+    video_path = None
+    try:
+        if request.mimetype in MJPEG_STREAM_TYPES:
+            # تدفق حي: قراءة الجسم على قطع في خيط القارئ دون انتظار نهاية الطلب
+            stream = request.stream
+            frames = mjpeg_frames(iter(lambda: stream.read(64 * 1024), b''),
+                                  decode_fn=lambda buffer: decode_image_buffer(buffer, YOLO_IMG_SIZE, fit='long'))
+            live = True
+        else:
+            upload = request.files.get('video')
+            if upload is not None:
+                video_path = save_video_upload(upload.stream, upload.filename)
+            elif request.mimetype.startswith('video/'):
+                video_path = save_video_upload(request.stream)
+            else:
+                return jsonify({'error': 'No video provided'}), 400
+            frames = video_file_frames(video_path)
+            live = False
+        print(f"استلام طلب كشف على فيديو ({'MJPEG' if live else 'ملف'})")
+        
+        with metrics.stage('inference'):
+            events, stream_stats, smoothed = detect_stream(
+                frames, batched_inference, get_class_names(), live=live, max_side=STREAM_MAX_SIDE,
+                batch_size=BATCH_MAX_SIZE, conf_thres=CONF_THRESHOLD, max_seconds=STREAM_MAX_SECONDS,
+                differ=FrameDiffer(STREAM_DIFF_THRESHOLD, max_skip=STREAM_MAX_SKIP),
+                smoother=TemporalSmoother(STREAM_EMA_ALPHA, STREAM_ALERT_THRESHOLD,
+                                          min_frames=STREAM_ALERT_FRAMES, ignore_classes=('plants',)))
+    except ValueError as e:
+        print(str(e))
+        return jsonify({'error': 'Invalid video'}), 400
+    except (BatchQueueFull, BatchTimeout) as e:
+        print(str(e))
+        return jsonify({'error': 'Server busy, retry later'}), 503
+    except Exception as e:
+        print(f"خطأ في الكشف على الفيديو: {str(e)}")
+        return jsonify({'error': 'Detection failed'}), 500
+    finally:
+        if video_path is not None:
+            os.remove(video_path)
+    
+    active = {}
+    for event in events:
+        if event['event'] == 'alert_start':
+            active[event['class']] = event
+        else:
+            active.pop(event['class'], None)
+    response = {
+        'events': [translate_stream_event(e) for e in events],
+        'active_alerts': [translate_stream_event(e) for e in active.values()],
+        'smoothed_confidence': {translate_disease_name(name): value for name, value in smoothed.items()},
+        'stats': stream_stats
+    }
+    print(f"نتيجة الفيديو: {stream_stats}")
+    return jsonify(response)
+
 if __name__ == '__main__':
+    # تحميل النموذج وتسخينه عند بدء التشغيل بدلاً من أول طلب
+    if is_serving_process(debug=True):
+        readiness.start(load_model, warmup_model)
     app.run(debug=True, host='0.0.0.0', port=5000) 
\ No newline at end of file
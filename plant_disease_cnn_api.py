@@ -1,61 +1,150 @@
 import tensorflow as tf
 import os
 import numpy as np
-import cv2
-import base64
+import threading
+import time
 from flask import Flask, request, jsonify
 from flask_cors import CORS
+from model_readiness import ModelReadiness, is_serving_process
+from debug_capture import debug_capture_from_env
+from image_input import InMemoryUploadRequest, read_image_payload, decode_image_buffer, decode_stats
+from prediction_cache import prediction_cache_from_env, content_key, perceptual_hash
+from service_metrics import ServiceMetrics, install_flask_metrics
+from keras_compiled_predictor import CompiledPredictor, parse_buckets
+from tflite_backend import TFLitePredictor, default_tflite_path
+from image_preprocess import BatchPreprocessor, normalize_in_python
 
 app = Flask(__name__)
 CORS(app)  # تمكين CORS للسماح بالاتصال من الواجهة الأمامية
+# إبقاء الملفات المرفوعة في الذاكرة لفك ترميزها دون نسخ، مع حد أقصى لحجم الطلب
+app.request_class = InMemoryUploadRequest
+app.config['MAX_CONTENT_LENGTH'] = int(float(os.environ.get('MAX_UPLOAD_MB', 25)) * 1024 * 1024)
 
 # مسارات النموذج والفئات - استخدام مسارات نسبية للمجلد الحالي
 MODEL_PATH = "./model/plant_disease_model.h5"
 CLASS_NAMES_PATH = "./model/class_names.npy"
 
+# حجم إدخال النموذج وعدد استدلالات التسخين
+IMG_SIZE = 224
+WARMUP_RUNS = int(os.environ.get('WARMUP_RUNS', 3))
+
+# الاستدلال عبر دالة متتبعة مسبقاً بدلاً من model.predict (CNN_COMPILED=0 للعودة إلى predict)
+CNN_COMPILED = os.environ.get('CNN_COMPILED', '1') == '1'
+CNN_XLA = os.environ.get('CNN_XLA', '0') == '1'  # ترجمة الدالة بـ XLA (jit_compile)
+CNN_BATCH_BUCKETS = parse_buckets(os.environ.get('CNN_BATCH_BUCKETS', '1,2,4,8'))
+
+# محرك التشغيل: keras أو tflite (نموذج float16 أو INT8 مع XNNPACK، انظر convert_cnn_tflite.py)
+CNN_BACKEND = os.environ.get('CNN_BACKEND', 'keras').lower()
+CNN_TFLITE_PATH = os.environ.get('CNN_TFLITE_PATH', default_tflite_path(MODEL_PATH, 'int8'))
+CNN_TFLITE_THREADS = int(os.environ.get('CNN_TFLITE_THREADS', 2))  # خيوط XNNPACK لكل مفسر
+CNN_TFLITE_INTERPRETERS = int(os.environ.get('CNN_TFLITE_INTERPRETERS', 2))  # مفسرات المجمع (طلبات متوازية)
+# ملف الأوزان الذي تحمله الخلفية المختارة فعلاً
+ACTIVE_MODEL_PATH = CNN_TFLITE_PATH if CNN_BACKEND == 'tflite' else MODEL_PATH
+
 # تحميل النموذج وأسماء الفئات
 model = None
 class_names = None
+predictor = None  # CompiledPredictor حول model، أو TFLitePredictor عند CNN_BACKEND=tflite
+model_lock = threading.Lock()
+
+# حالة تحميل النموذج وتسخينه لمسار /ready
+readiness = ModelReadiness('mobilenetv2')
+
+# حفظ عينات الطلبات للتصحيح في خيط خلفي بدلاً من debug_image.jpg
+debug_capture = debug_capture_from_env('debug_captures/mobilenetv2')
+
+# ذاكرة مؤقتة للتنبؤات للصور المكررة أو شبه المتطابقة (تُفرغ عند تغير ملف النموذج)
+prediction_cache = prediction_cache_from_env(ACTIVE_MODEL_PATH)
+
+# مقاييس زمن مراحل الطلب والطلبات الجارية بصيغة Prometheus على /metrics
+metrics = ServiceMetrics('mobilenetv2')
+install_flask_metrics(app, metrics)
+metrics.model_load_seconds.set_function(lambda: readiness.load_seconds, service=metrics.service)
+metrics.register_stats('decode', decode_stats.stats)
+metrics.register_stats('debug_capture', debug_capture.stats)
+metrics.register_stats('prediction_cache', lambda: prediction_cache.stats() if prediction_cache is not None else None)
+metrics.register_stats('tflite', lambda: predictor.stats() if isinstance(predictor, TFLitePredictor) else None)
 
 def load_model_and_classes():
     """تحميل النموذج وأسماء الفئات"""
-    global model, class_names
+    if model is not None:
+        return True
+    # قفل لمنع تحميل النموذج مرتين عند تزامن التسخين مع أول طلب
+    with model_lock:
+        return _load_model_and_classes_locked()
+
+def _load_model_and_classes_locked():
+    global model, class_names, predictor
     try:
         if model is None:
             print("تحميل النموذج...")
             # إنشاء مجلد النموذج إذا لم يكن موجوداً
             os.makedirs(os.path.dirname(MODEL_PATH), exist_ok=True)
             
-            if os.path.exists(MODEL_PATH):
-                model = tf.keras.models.load_model(MODEL_PATH)
+            # التحميل في متغيرات محلية ثم نشر class_names قبل model، لأن المسار السريع
+            # في load_model_and_classes يعتبر الخدمة جاهزة بمجرد تعيين model
+            loaded_predictor = None
+            if CNN_BACKEND == 'tflite':
+                if not os.path.exists(CNN_TFLITE_PATH):
+                    print(f"خطأ: ملف النموذج غير موجود في المسار {CNN_TFLITE_PATH}")
+                    return False
+                # لا حاجة لتحميل Keras: model يشير إلى المفسر حتى يبقى فحص التحميل كما هو
+                loaded_predictor = loaded_model = TFLitePredictor(CNN_TFLITE_PATH, num_threads=CNN_TFLITE_THREADS,
+                                                                    pool_size=CNN_TFLITE_INTERPRETERS)
+                print(f"تم تحميل نموذج TFLite من {CNN_TFLITE_PATH}")
+            elif os.path.exists(MODEL_PATH):
+                loaded_model = tf.keras.models.load_model(MODEL_PATH)
                 print("تم تحميل النموذج")
             else:
                 print(f"خطأ: ملف النموذج غير موجود في المسار {MODEL_PATH}")
                 print("سيتم إنشاء نموذج تجريبي بسيط...")
                 # إنشاء نموذج تجريبي بسيط
-                model = create_demo_model()
+                loaded_model = create_demo_model()
                 print("تم إنشاء نموذج تجريبي")
-                return True
                 
             if os.path.exists(CLASS_NAMES_PATH):
-                class_names = np.load(CLASS_NAMES_PATH, allow_pickle=True)
-                print(f"تم تحميل أسماء الفئات: {class_names}")
+                loaded_class_names = np.load(CLASS_NAMES_PATH, allow_pickle=True)
+                print(f"تم تحميل أسماء الفئات: {loaded_class_names}")
             else:
                 print(f"خطأ: ملف أسماء الفئات غير موجود في المسار {CLASS_NAMES_PATH}")
                 # إنشاء أسماء فئات تجريبية
-                class_names = np.array(['طماطم_سليم', 'طماطم_لفحة_متأخرة', 'طماطم_لفحة_مبكرة', 
+                loaded_class_names = np.array(['طماطم_سليم', 'طماطم_لفحة_متأخرة', 'طماطم_لفحة_مبكرة', 
                                     'خيار_بياض_زغبي', 'خيار_بياض_دقيقي', 'كوسة_تبقع_أوراق'])
-                print(f"تم إنشاء أسماء فئات تجريبية: {class_names}")
-                np.save(CLASS_NAMES_PATH, class_names)
+                print(f"تم إنشاء أسماء فئات تجريبية: {loaded_class_names}")
+                np.save(CLASS_NAMES_PATH, loaded_class_names)
+            
+            class_names = loaded_class_names
+            if loaded_predictor is None and CNN_COMPILED:
+                # التطبيع داخل الرسم (Rescaling) حتى يستقبل النموذج بكسلات uint8 مباشرة
+                loaded_predictor = CompiledPredictor(loaded_model, (IMG_SIZE, IMG_SIZE, 3),
+                                                     buckets=CNN_BATCH_BUCKETS, jit_compile=CNN_XLA,
+                                                     rescale=1.0 / 255)
+            predictor = loaded_predictor
+            model = loaded_model
         return True
     except Exception as e:
         print(f"خطأ في تحميل النموذج: {str(e)}")
         return False
 
+def warmup_model():
+    """تشغيل استدلالات وهمية بحجم الإدخال الحقيقي لتهيئة الرسم البياني قبل أول طلب"""
+    if predictor is not None:
+        # تتبع الدالة لكل أحجام الدفعات مرة واحدة عند بدء التشغيل (أو إنشاء مفسر TFLite لخيط التسخين)
+        predictor.warmup()
+    dummy = np.zeros((1, IMG_SIZE, IMG_SIZE, 3), dtype=np.uint8)
+    for _ in range(WARMUP_RUNS):
+        predict_batch(dummy)
+
+def predict_batch(img_batch):
+    """احتمالات الفئات لدفعة uint8 (N, 224, 224, 3) من preprocess_batch"""
+    if predictor is not None:
+        return predictor.predict(img_batch)
+    return model.predict(normalize_in_python(img_batch), verbose=0)
+
 def create_demo_model():
     """إنشاء نموذج تجريبي بسيط للاختبار"""
     simple_model = tf.keras.Sequential([
-        tf.keras.layers.Input(shape=(224, 224, 3)),
+        tf.keras.layers.Input(shape=(IMG_SIZE, IMG_SIZE, 3)),
         tf.keras.layers.Conv2D(16, 3, activation='relu'),
         tf.keras.layers.GlobalAveragePooling2D(),
         tf.keras.layers.Dense(6, activation='softmax')  # 6 فئات
@@ -66,34 +155,6 @@ def create_demo_model():
     simple_model.save(MODEL_PATH)
     return simple_model
 
-def base64_to_image(base64_string):
-    """تحويل صورة base64 إلى صورة OpenCV"""
-    try:
-        if not isinstance(base64_string, str):
-            print("بيانات الصورة ليست نصية")
-            return None
-        
-        if len(base64_string) < 100:
-            print("بيانات الصورة قصيرة جدًا")
-            return None
-            
-        # تحويل صورة base64 إلى صورة OpenCV
-        if ',' in base64_string:
-            base64_string = base64_string.split(',')[1]
-        
-        img_bytes = base64.b64decode(base64_string)
-        img_array = np.frombuffer(img_bytes, dtype=np.uint8)
-        img = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
-        
-        if img is None:
-            print("فشل في تحويل بيانات base64 إلى صورة")
-            return None
-            
-        return img
-    except Exception as e:
-        print(f"خطأ في معالجة الصورة: {str(e)}")
-        return None
-
 # قاموس المعلومات العلاجية للأمراض
 TREATMENTS = {
     "Tomato_healthy": {
@@ -174,31 +235,103 @@ def arabic_plant_name(disease_code):
     else:
         return 'غير معروف'
 
+# مجمع مخازن uint8 مشترك بين الخيوط: تصغير وتحويل ألوان في المكان دون مصفوفات float64 وسيطة
+preprocessor = BatchPreprocessor(IMG_SIZE, capacity=max(CNN_BATCH_BUCKETS))
+metrics.register_stats('preprocess', preprocessor.stats)
+
+def preprocess_batch(images):
+    """with preprocess_batch(images) as batch: صور BGR -> دفعة RGB من نوع uint8 (N, 224, 224, 3) صالحة داخل الكتلة"""
+    return preprocessor.batch(images)
+
+def classify_image(img):
+    """تصنيف صورة BGR وإرجاع (اسم الفئة، الثقة %)؛ يفترض أن النموذج محمل"""
+    with preprocessor.lease(1) as buffers:
+        with metrics.stage('preprocess'):
+            img_batch = buffers.one(img)
+    
+        # التنبؤ
+        with metrics.stage('forward'):
+            predictions = predict_batch(img_batch)
+    
+    predicted_class_idx = np.argmax(predictions[0])
+    confidence = float(predictions[0][predicted_class_idx]) * 100
+    disease_name = class_names[predicted_class_idx]
+    print(f"تم التعرف على: {disease_name} بثقة {confidence:.2f}%")
+    return disease_name, confidence
+
+def build_prediction_response(disease_name, confidence, plant_name):
+    """بناء استجابة التصنيف بالاسم العربي ومعلومات العلاج"""
+    # تحويل اسم المرض إلى اسم عربي أكثر وضوحاً
+    readable_disease_name = arabic_disease_name(disease_name)
+    plant_type = arabic_plant_name(disease_name)
+    
+    # الحصول على معلومات العلاج
+    treatment_info = TREATMENTS.get(disease_name, TREATMENTS['default'])
+    
+    return {
+        'disease': readable_disease_name,
+        'confidence': confidence,
+        'plant': plant_type or plant_name,  # استخدام النوع المكتشف إذا توفر وإلا استخدم المدخل
+        'severity': get_severity(confidence),
+        'treatment': treatment_info['treatment'],
+        'preventive': treatment_info['preventive'],
+        'timeDetected': ''
+    }
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """فحص الجاهزية لموزع الأحمال: 200 فقط بعد انتهاء التسخين"""
+    return jsonify(readiness.status()), (200 if readiness.ready else 503)
+
+@app.route('/api/stats', methods=['GET'])
+def stats():
+    """إحصائيات فك الترميز والذاكرة المؤقتة وحفظ صور التصحيح"""
+    return jsonify({
+        'decode': decode_stats.stats(),
+        'debug_capture': debug_capture.stats(),
+        'prediction_cache': prediction_cache.stats() if prediction_cache is not None else None
+    })
+
 @app.route('/api/detect', methods=['POST'])
 def detect_disease():
     """الكشف عن أمراض النباتات من الصورة"""
     try:
-        # استلام الصورة من الطلب
-        data = request.json
-        if not data or 'image' not in data:
+        # استلام الصورة من الطلب: JSON (base64) أو multipart/form-data أو جسم خام image/jpeg|png
+        payload = read_image_payload(request, stage=metrics.stage)
+        if payload is None:
             print("لم يتم توفير صورة")
             return jsonify({'error': 'No image provided'}), 400
         
-        print("استلام طلب للكشف عن الأمراض")
+        print(f"استلام طلب للكشف عن الأمراض ({payload.source})")
+        data = payload.fields
         plant_name = data.get('plant', 'طماطم')
         
-        # تحويل الصورة من base64 إلى صورة
-        img = base64_to_image(data['image'])
+        # البحث في الذاكرة المؤقتة بمفتاح المحتوى قبل فك ترميز الصورة
+        cache_key = None
+        if prediction_cache is not None and payload.buffer is not None:
+            cache_key = content_key(payload.buffer)
+            cached = prediction_cache.get(cache_key)
+            if cached is not None:
+                print("تم العثور على النتيجة في الذاكرة المؤقتة")
+                return jsonify(cached)
+        
+        # فك ترميز الصورة مباشرة من بايتات الطلب
+        # فك ترميز JPEG بأكبر تصغير يبقي الضلع الأقصر >= 224 لأن الصورة ستُصغر إلى 224x224 على أي حال
+        with metrics.stage('image_decode'):
+            img = decode_image_buffer(payload.buffer, IMG_SIZE, fit='short')
+        payload = None  # تحرير المرجع إلى بايتات الطلب قبل إغلاقه
         if img is None:
             print("فشل في تحويل الصورة")
             return jsonify(get_mock_result(plant_name))
         
-        # حفظ الصورة للتصحيح
-        try:
-            cv2.imwrite('debug_image.jpg', img)
-            print("تم حفظ الصورة للتصحيح في debug_image.jpg")
-        except Exception as e:
-            print(f"فشل في حفظ الصورة للتصحيح: {str(e)}")
+        # البحث عن صورة شبه متطابقة (إعادة رفع أو إعادة تصوير)
+        phash = None
+        if cache_key is not None:
+            phash = perceptual_hash(img) if prediction_cache.perceptual_enabled else None
+            cached = prediction_cache.get_similar(phash)
+            if cached is not None:
+                print("تم العثور على نتيجة صورة مشابهة في الذاكرة المؤقتة")
+                return jsonify(cached)
         
         # التحقق من وجود نموذج
         if not load_model_and_classes():
@@ -207,35 +340,19 @@ def detect_disease():
         
         # معالجة الصورة للنموذج
         try:
-            img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            img_resized = cv2.resize(img_rgb, (224, 224))
-            img_normalized = img_resized / 255.0
-            img_batch = np.expand_dims(img_normalized, axis=0)
-            
-            # التنبؤ
-            predictions = model.predict(img_batch)
-            predicted_class_idx = np.argmax(predictions[0])
-            confidence = float(predictions[0][predicted_class_idx]) * 100
-            disease_name = class_names[predicted_class_idx]
-            
-            print(f"تم التعرف على: {disease_name} بثقة {confidence:.2f}%")
+            inference_started = time.perf_counter()
+            disease_name, confidence = classify_image(img)
+            with metrics.stage('postprocess'):
+                response = build_prediction_response(disease_name, confidence, plant_name)
             
-            # تحويل اسم المرض إلى اسم عربي أكثر وضوحاً
-            readable_disease_name = arabic_disease_name(disease_name)
-            plant_type = arabic_plant_name(disease_name)
+            if cache_key is not None:
+                prediction_cache.put(cache_key, response, phash, time.perf_counter() - inference_started)
             
-            # الحصول على معلومات العلاج
-            treatment_info = TREATMENTS.get(disease_name, TREATMENTS['default'])
+            # حفظ عينة للتصحيح (عشوائياً أو عند انخفاض الثقة) دون انتظار الكتابة على القرص
+            debug_capture.maybe_capture(img, dict(response, class_name=str(disease_name)), confidence)
             
-            return jsonify({
-                'disease': readable_disease_name,
-                'confidence': confidence,
-                'plant': plant_type or plant_name,  # استخدام النوع المكتشف إذا توفر وإلا استخدم المدخل
-                'severity': get_severity(confidence),
-                'treatment': treatment_info['treatment'],
-                'preventive': treatment_info['preventive'],
-                'timeDetected': ''
-            })
+            with metrics.stage('serialize'):
+                return jsonify(response)
             
         except Exception as e:
             print(f"خطأ في تحليل الصورة: {str(e)}")
@@ -246,4 +363,7 @@ def detect_disease():
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
+    # تحميل النموذج وتسخينه عند بدء التشغيل بدلاً من أول طلب
+    if is_serving_process(debug=True):
+        readiness.start(load_model_and_classes, warmup_model)
     app.run(debug=True, host='0.0.0.0', port=5000) 
\ No newline at end of file
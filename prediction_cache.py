@@ -0,0 +1,181 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+
+
+def content_key(buffer):
+    """مفتاح محتوى دقيق من بايتات الصورة المشفرة كما وصلت في الطلب"""
+    return hashlib.blake2b(memoryview(buffer), digest_size=16).hexdigest()
+
+
+def perceptual_hash(img):
+    """بصمة إدراكية (dHash) من 64 بت: تبقى متقاربة للصور شبه المتطابقة وإعادة التصوير"""
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+class PredictionCache:
+    """ذاكرة تخزين مؤقت للتنبؤات بمفتاح المحتوى وبالبصمة الإدراكية مع LRU ومدة صلاحية وحد للحجم"""
+
+    def __init__(self, model_path, max_entries=1024, max_bytes=16 * 1024 * 1024, ttl_seconds=3600,
+                 phash_max_distance=4, model_check_interval=2.0):
+        self.model_path = model_path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.phash_max_distance = phash_max_distance  # None يعطل المطابقة الإدراكية
+        self.model_check_interval = model_check_interval
+
+        self._entries = OrderedDict()  # key -> (value, phash, size, created, inference_seconds)
+        self._phash_index = {}  # key -> phash
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._model_signature = self._read_model_signature()
+        self._last_model_check = time.monotonic()
+
+        self.exact_hits = 0
+        self.perceptual_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.saved_inference_seconds = 0.0
+
+    @property
+    def perceptual_enabled(self):
+        return self.phash_max_distance is not None and self.phash_max_distance >= 0
+
+    def _read_model_signature(self):
+        try:
+            st = os.stat(self.model_path)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def _check_model(self):
+        """إفراغ الذاكرة المؤقتة تلقائياً عند تغير ملف النموذج"""
+        now = time.monotonic()
+        if now - self._last_model_check < self.model_check_interval:
+            return
+        self._last_model_check = now
+        signature = self._read_model_signature()
+        if signature != self._model_signature:
+            if self._entries:
+                print(f"تغير ملف النموذج {self.model_path}، إفراغ ذاكرة التنبؤات المؤقتة")
+            self._clear_locked()
+            self._model_signature = signature
+            self.invalidations += 1
+
+    def _clear_locked(self):
+        self._entries.clear()
+        self._phash_index.clear()
+        self._bytes = 0
+
+    def _remove_locked(self, key):
+        _, _, size, _, _ = self._entries.pop(key)
+        self._phash_index.pop(key, None)
+        self._bytes -= size
+
+    def _hit_locked(self, key, kind):
+        value, _, _, created, inference_seconds = self._entries[key]
+        if self.ttl_seconds and time.time() - created > self.ttl_seconds:
+            self._remove_locked(key)
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        if kind == 'exact':
+            self.exact_hits += 1
+        else:
+            self.perceptual_hits += 1
+        self.saved_inference_seconds += inference_seconds
+        return value
+
+    def get(self, key):
+        """بحث بمفتاح المحتوى الدقيق (قبل فك ترميز الصورة)"""
+        with self._lock:
+            self._check_model()
+            if key in self._entries:
+                return self._hit_locked(key, 'exact')
+            return None
+
+    def get_similar(self, phash):
+        """بحث بالبصمة الإدراكية ضمن مسافة هامينغ المسموحة؛ يُحسب كإخفاق إذا لم يوجد"""
+        with self._lock:
+            if self.perceptual_enabled and phash is not None:
+                best_key, best_distance = None, self.phash_max_distance + 1
+                for key, other in self._phash_index.items():
+                    distance = hamming_distance(phash, other)
+                    if distance < best_distance:
+                        best_key, best_distance = key, distance
+                if best_key is not None:
+                    value = self._hit_locked(best_key, 'perceptual')
+                    if value is not None:
+                        return value
+            self.misses += 1
+            return None
+
+    def put(self, key, value, phash=None, inference_seconds=0.0):
+        size = len(json.dumps(value, ensure_ascii=False, default=str).encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove_locked(key)
+            self._entries[key] = (value, phash, size, time.time(), inference_seconds)
+            if phash is not None:
+                self._phash_index[key] = phash
+            self._bytes += size
+            # إزالة الأقل استخداماً عند تجاوز عدد العناصر أو الحجم
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                self._remove_locked(next(iter(self._entries)))
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            hits = self.exact_hits + self.perceptual_hits
+            lookups = hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl_seconds,
+                'phash_max_distance': self.phash_max_distance,
+                'exact_hits': self.exact_hits,
+                'perceptual_hits': self.perceptual_hits,
+                'misses': self.misses,
+                'hit_ratio': round(hits / lookups, 4) if lookups else 0.0,
+                'saved_inference_seconds': round(self.saved_inference_seconds, 3),
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
+
+
+def prediction_cache_from_env(model_path):
+    """إنشاء PredictionCache من متغيرات البيئة (CACHE_MAX_ENTRIES=0 يعطلها)"""
+    max_entries = int(os.environ.get('CACHE_MAX_ENTRIES', 1024))
+    if max_entries <= 0:
+        return None
+    distance = os.environ.get('CACHE_PHASH_DISTANCE', '4')
+    return PredictionCache(
+        model_path,
+        max_entries=max_entries,
+        max_bytes=int(float(os.environ.get('CACHE_MAX_MB', 16)) * 1024 * 1024),
+        ttl_seconds=float(os.environ.get('CACHE_TTL_S', 3600)),
+        phash_max_distance=int(distance) if distance else None,
+    )
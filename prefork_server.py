@@ -0,0 +1,247 @@
+import argparse
+import gc
+import importlib
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+# دوال التحميل والتسخين لكل خدمة، والمتغيرات التي تُفرغ لإعادة تحميل النموذج عند SIGHUP
+# preload=False: تحميل Keras يشغّل بيئة TensorFlow ومجمعات خيوطها، و TensorFlow لا يدعم fork بعد ذلك
+# (قد يتوقف model.predict في العمال)، لذلك يحمّل كل عامل نسخته الخاصة
+SERVICES = {
+    'plant_disease_api': {'load': 'load_model', 'warmup': 'warmup_model', 'reset': ('model',),
+                          'preload': True},
+    'plant_disease_cnn_api': {'load': 'load_model_and_classes', 'warmup': 'warmup_model',
+                              'reset': ('model', 'class_names', 'predictor'), 'preload': False},
+}
+
+# متغيرات البيئة التي تحدد عدد خيوط المعالج لمكتبات الحساب داخل كل عامل
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                   'TF_NUM_INTRAOP_THREADS', 'YOLO_ONNX_THREADS')
+
+
+def limit_cpu_threads(threads_per_worker):
+    """يجب استدعاؤها قبل استيراد torch أو tensorflow حتى تُطبق على مجمعات الخيوط"""
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(threads_per_worker)
+    os.environ['TF_NUM_INTEROP_THREADS'] = '1'
+
+
+def can_preload(module, service):
+    """هل يمكن تحميل النموذج في العملية الرئيسية قبل fork؟
+    لا لخدمة TensorFlow، ولا لجلسات ONNX Runtime التي تنشئ مجمع خيوطها عند الإنشاء"""
+    if not SERVICES[service]['preload']:
+        return False
+    return getattr(module, 'YOLO_BACKEND', 'torch') != 'onnx'
+
+
+class PreforkServer:
+    """عملية رئيسية تحمل النموذج مرة واحدة ثم تنشئ عمالاً بـ fork يتشاركون صفحات الأوزان (copy-on-write)"""
+
+    def __init__(self, module, service, host, port, workers, threads_per_worker,
+                 preload=True, graceful_timeout=30.0):
+        self.module = module
+        self.service = service
+        self.config = SERVICES[service]
+        self.host = host
+        self.port = port
+        self.num_workers = workers
+        self.threads_per_worker = threads_per_worker
+        self.preload = preload and can_preload(module, service)
+        self.graceful_timeout = graceful_timeout
+
+        self.workers = {}  # pid -> رقم العامل
+        self.socket = None
+        self._stopping = False
+        self._reload_requested = False
+
+    def _load_in_master(self):
+        """تحميل الأوزان في العملية الرئيسية ثم تجميد الكائنات حتى لا يلمس جامع القمامة صفحاتها في العمال"""
+        readiness = self.module.readiness
+        readiness.start(getattr(self.module, self.config['load']), None, background=False)
+        if readiness.state == 'failed':
+            raise SystemExit(f"تعذر تحميل النموذج: {readiness.error}")
+        gc.collect()
+        gc.freeze()
+
+    def _spawn(self, index):
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = index
+            return pid
+        # داخل العامل: رقمه ثابت عبر إعادة التشغيل (مجلد التصحيح الخاص به في debug_capture)
+        os.environ['PREFORK_WORKER_INDEX'] = str(index)
+        code = 0
+        try:
+            self._run_worker(index)
+        except BaseException as e:
+            print(f"[worker {index}] خطأ: {str(e)}")
+            code = 1
+        finally:
+            sys.stdout.flush()
+            os._exit(code)
+
+    def _run_worker(self, index):
+        from werkzeug.serving import make_server
+
+        # الإشارات الموروثة من العملية الرئيسية: Ctrl+C و SIGHUP تتعامل معهما الرئيسية
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        if 'torch' in sys.modules:
+            sys.modules['torch'].set_num_threads(self.threads_per_worker)
+
+        readiness = self.module.readiness
+        if self.preload:
+            readiness.warm(getattr(self.module, self.config['warmup']), background=False)
+        else:
+            readiness.start(getattr(self.module, self.config['load']),
+                            getattr(self.module, self.config['warmup']), background=False)
+        if readiness.state == 'failed':
+            raise RuntimeError(readiness.error)
+
+        server = make_server(self.host, self.port, self.module.app, threaded=True, fd=self.socket.fileno())
+        # انتظار الطلبات الجارية عند الإيقاف بدلاً من قطعها
+        server.daemon_threads = False
+
+        def stop(signum, frame):
+            threading.Thread(target=server.shutdown, daemon=True).start()
+
+        signal.signal(signal.SIGTERM, stop)
+        print(f"[worker {index}] pid={os.getpid()} يستقبل الطلبات على {self.host}:{self.port}")
+        server.serve_forever()
+        server.server_close()
+        print(f"[worker {index}] pid={os.getpid()} توقف")
+
+    def _stop_workers(self, pids):
+        """إرسال SIGTERM ثم SIGKILL لمن لم ينهِ طلباته خلال المهلة"""
+        for pid in pids:
+            self._signal(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.graceful_timeout
+        remaining = set(pids)
+        while remaining and time.monotonic() < deadline:
+            remaining = {pid for pid in remaining if not self._exited(pid)}
+            time.sleep(0.1)
+        for pid in remaining:
+            print(f"العامل {pid} لم يتوقف خلال {self.graceful_timeout} ثانية، إنهاء قسري")
+            self._signal(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+
+    @staticmethod
+    def _exited(pid):
+        try:
+            return os.waitpid(pid, os.WNOHANG)[0] != 0
+        except ChildProcessError:
+            return True
+
+    def _reap(self):
+        """جمع العمال المنتهين وإرجاع (رقم العامل، الحالة) لكل منهم"""
+        exited = []
+        for pid, index in list(self.workers.items()):
+            try:
+                done, status = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                done, status = pid, -1
+            if done:
+                del self.workers[pid]
+                exited.append((index, status))
+        return exited
+
+    @staticmethod
+    def _signal(pid, signum):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def _reload(self):
+        """إعادة تشغيل هادئة: إعادة تحميل النموذج في العملية الرئيسية ثم استبدال العمال واحداً تلو الآخر"""
+        print("SIGHUP: إعادة تحميل النموذج واستبدال العمال")
+        if self.preload:
+            gc.unfreeze()
+            for name in self.config['reset']:
+                setattr(self.module, name, None)
+            self._load_in_master()
+        for pid, index in list(self.workers.items()):
+            # عامل واحد في كل مرة حتى يستمر البقية في استقبال الطلبات
+            self.workers.pop(pid)
+            self._spawn(index)
+            self._stop_workers([pid])
+
+    def serve(self):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((self.host, self.port))
+        self.socket.listen(128)
+
+        if self.preload:
+            self._load_in_master()
+        else:
+            print("تحميل النموذج داخل كل عامل (بدون مشاركة الأوزان)")
+
+        def request_stop(signum, frame):
+            self._stopping = True
+
+        def request_reload(signum, frame):
+            self._reload_requested = True
+
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+        signal.signal(signal.SIGHUP, request_reload)
+
+        os.environ['PREFORK_WORKERS'] = str(self.num_workers)
+        for index in range(self.num_workers):
+            self._spawn(index)
+        print(f"الخدمة {self.service}: {self.num_workers} عمال، {self.threads_per_worker} خيط معالج لكل عامل، "
+              f"pid الرئيسية={os.getpid()}")
+
+        while not self._stopping:
+            if self._reload_requested:
+                self._reload_requested = False
+                self._reload()
+            for index, status in self._reap():
+                print(f"العامل {index} انتهى بشكل غير متوقع (status={status})، إعادة تشغيله")
+                time.sleep(1.0)  # تجنب حلقة إعادة تشغيل سريعة إذا كان العامل يفشل فوراً
+                self._spawn(index)
+            time.sleep(0.5)
+
+        print("إيقاف العمال...")
+        self._stop_workers(list(self.workers))
+        self.socket.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='تشغيل خدمة الكشف بعدة عمال (fork) يتشاركون أوزان النموذج')
+    parser.add_argument('service', choices=sorted(SERVICES))
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('WORKERS', 2)))
+    parser.add_argument('--threads-per-worker', type=int, default=int(os.environ.get('THREADS_PER_WORKER', 0)),
+                        help='خيوط المعالج لكل عامل (الافتراضي: عدد الأنوية مقسوماً على عدد العمال)')
+    parser.add_argument('--no-preload', action='store_true',
+                        help='تحميل النموذج داخل كل عامل بدلاً من العملية الرئيسية')
+    parser.add_argument('--graceful-timeout', type=float, default=30.0)
+    args = parser.parse_args()
+
+    workers = max(1, args.workers)
+    threads = args.threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+    limit_cpu_threads(threads)
+    module = importlib.import_module(args.service)
+
+    if not hasattr(os, 'fork'):
+        # Windows: لا يوجد fork، تشغيل عملية واحدة بدون وضع التصحيح
+        print("fork غير متاح على هذا النظام، تشغيل عملية واحدة")
+        module.readiness.start(getattr(module, SERVICES[args.service]['load']),
+                               getattr(module, SERVICES[args.service]['warmup']))
+        module.app.run(host=args.host, port=args.port, threaded=True)
+        return
+
+    PreforkServer(module, args.service, args.host, args.port, workers, threads,
+                  preload=not args.no_preload, graceful_timeout=args.graceful_timeout).serve()
+
+
+if __name__ == '__main__':
+    main()
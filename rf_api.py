@@ -2,6 +2,8 @@ from fastapi import FastAPI
 from pydantic import BaseModel
 import joblib
 from fastapi.middleware.cors import CORSMiddleware
+import time
+from service_metrics import ServiceMetrics, install_fastapi_metrics
 
 app = FastAPI()
 
@@ -14,7 +16,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# مقاييس زمن مراحل الطلب والطلبات الجارية بصيغة Prometheus على /metrics
+metrics = ServiceMetrics('rf-sensors')
+install_fastapi_metrics(app, metrics)
+
+load_started = time.perf_counter()
 model = joblib.load(r"D:\DatabasesANDModels\rf_model.pkl")
+metrics.model_load_seconds.set(time.perf_counter() - load_started, service=metrics.service)
 
 class SensorInput(BaseModel):
     temp: float
@@ -28,11 +36,13 @@ class SensorInput(BaseModel):
 
 @app.post("/predict")
 def predict(input: SensorInput):
-    X = [[
-        input.temp, input.humidity, input.soil_moisture,
-        input.ph, input.n, input.p, input.k, input.ec
-    ]]
-    pred = model.predict(X)[0]
+    with metrics.stage('preprocess'):
+        X = [[
+            input.temp, input.humidity, input.soil_moisture,
+            input.ph, input.n, input.p, input.k, input.ec
+        ]]
+    with metrics.stage('forward'):
+        pred = model.predict(X)[0]
     # تحويل التوصية إلى وصف عربي دقيق
     def arabic_description(label):
         mapping = {
@@ -46,4 +56,6 @@ def predict(input: SensorInput):
             'good': 'جميع المؤشرات البيئية في النطاق المثالي. استمر في المتابعة بنفس الطريقة!',
         }
         return mapping.get(str(label).strip().lower(), f'ملاحظة: {label}')
-    return {"recommendation": arabic_description(pred)}
+    with metrics.stage('postprocess'):
+        recommendation = arabic_description(pred)
+    return {"recommendation": recommendation}
@@ -0,0 +1,3 @@
+@echo off
+echo Starting unified inference gateway (yolo, mobilenet, cnn38)...
+python inference_gateway.py 
\ No newline at end of file
@@ -0,0 +1,263 @@
+import re
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+# حدود المدرج التكراري بالثواني (من 1ms إلى 10s)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def no_stage(name):
+    """بديل ServiceMetrics.stage عندما لا توجد مقاييس"""
+    return nullcontext()
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    parts = []
+    for key, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple((name, labels.get(name, '')) for name in self.labelnames)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            return [f'{self.name}{_format_labels(k)} {_format_value(v)}' for k, v in self._values.items()]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self._functions = {}
+
+    def set_function(self, fn, **labels):
+        """قراءة القيمة عند كل عرض للمقاييس (None يعني لا قيمة بعد)"""
+        self._functions[self._key(labels)] = fn
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _samples(self):
+        lines = super()._samples()
+        for key, fn in self._functions.items():
+            value = fn()
+            if value is not None:
+                lines.append(f'{self.name}{_format_labels(key)} {_format_value(value)}')
+        return lines
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # key -> [counts per bucket, sum, count]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self):
+        lines = []
+        with self._lock:
+            for key, (counts, total, count) in self._series.items():
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{_format_labels(key + (("le", _format_value(bound)),))} {bucket_count}')
+                lines.append(f'{self.name}_bucket{_format_labels(key + (("le", "+Inf"),))} {count}')
+                lines.append(f'{self.name}_sum{_format_labels(key)} {_format_value(total)}')
+                lines.append(f'{self.name}_count{_format_labels(key)} {count}')
+        return lines
+
+
+def _flatten_stats(prefix, stats, out):
+    """تحويل قاموس إحصائيات متداخل إلى أزواج (اسم، قيمة) رقمية"""
+    for key, value in stats.items():
+        name = re.sub(r'[^a-zA-Z0-9_]', '_', f'{prefix}_{key}')
+        if isinstance(value, dict):
+            _flatten_stats(name, value, out)
+        elif isinstance(value, bool):
+            out.append((name, int(value)))
+        elif isinstance(value, (int, float)):
+            out.append((name, value))
+
+
+class ServiceMetrics:
+    """سجل مقاييس خدمة استدلال واحدة بصيغة Prometheus النصية"""
+
+    def __init__(self, service):
+        self.service = service
+        self._metrics = []
+        self._stats_sources = []
+
+        self.stage_seconds = self.histogram(
+            'inference_stage_seconds', 'Time spent in each request stage', ('service', 'stage'))
+        self.request_seconds = self.histogram(
+            'http_request_duration_seconds', 'End-to-end HTTP request latency', ('service', 'endpoint'))
+        self.requests_total = self.counter(
+            'http_requests_total', 'HTTP requests by endpoint and status', ('service', 'endpoint', 'status'))
+        self.in_flight = self.gauge(
+            'http_requests_in_flight', 'Requests currently being handled', ('service',))
+        self.model_load_seconds = self.gauge(
+            'model_load_seconds', 'Time taken to load the model weights', ('service',))
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._add(Counter(name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._add(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help_text, labelnames, buckets))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def stage(self, name):
+        """قياس زمن مرحلة من مراحل الطلب: with metrics.stage('forward'): ..."""
+        return self.stage_seconds.time(service=self.service, stage=name)
+
+    def observe_stage(self, name, seconds):
+        """تسجيل زمن مرحلة مقاس مسبقاً (مثل أزمنة YOLOv5 AutoShape)"""
+        self.stage_seconds.observe(seconds, service=self.service, stage=name)
+
+    def register_stats(self, prefix, stats_fn):
+        """تصدير قاموس إحصائيات موجود (مثل batcher.stats) كمقاييس gauge"""
+        self._stats_sources.append((prefix, stats_fn))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for prefix, stats_fn in self._stats_sources:
+            try:
+                stats = stats_fn()
+            except Exception as e:
+                print(f"فشل في قراءة إحصائيات {prefix}: {str(e)}")
+                continue
+            values = []
+            _flatten_stats(prefix, stats or {}, values)
+            for name, value in values:
+                lines.append(f'# TYPE {name} gauge')
+                lines.append(f'{name}{_format_labels((("service", self.service),))} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def install_flask_metrics(app, metrics):
+    """عداد الطلبات الجارية وزمن كل طلب ومسار /metrics لتطبيق Flask"""
+    from flask import Response, g, request
+
+    @app.before_request
+    def _metrics_start():
+        g._metrics_started = time.perf_counter()
+        g._metrics_in_flight = True
+        metrics.in_flight.inc(service=metrics.service)
+
+    @app.after_request
+    def _metrics_record(response):
+        started = g.pop('_metrics_started', None)
+        if started is not None:
+            endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            metrics.request_seconds.observe(time.perf_counter() - started, service=metrics.service, endpoint=endpoint)
+            metrics.requests_total.inc(service=metrics.service, endpoint=endpoint, status=response.status_code)
+        return response
+
+    @app.teardown_request
+    def _metrics_done(exc):
+        if g.pop('_metrics_in_flight', False):
+            metrics.in_flight.dec(service=metrics.service)
+
+    @app.route('/metrics', methods=['GET'])
+    def prometheus_metrics():
+        """مقاييس الخدمة بصيغة Prometheus النصية"""
+        return Response(metrics.render(), mimetype=None, content_type=PROMETHEUS_CONTENT_TYPE)
+
+
+def install_fastapi_metrics(app, metrics):
+    """نفس مقاييس install_flask_metrics لتطبيقات FastAPI"""
+    from fastapi.responses import PlainTextResponse
+
+    @app.middleware('http')
+    async def _metrics_middleware(request, call_next):
+        started = time.perf_counter()
+        metrics.in_flight.inc(service=metrics.service)
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            metrics.in_flight.dec(service=metrics.service)
+            # قالب المسار بدلاً من العنوان الفعلي حتى لا تتضخم التسميات
+            route = request.scope.get('route')
+            endpoint = getattr(route, 'path', 'unmatched')
+            metrics.request_seconds.observe(time.perf_counter() - started, service=metrics.service, endpoint=endpoint)
+            metrics.requests_total.inc(service=metrics.service, endpoint=endpoint, status=status)
+
+    @app.get('/metrics')
+    def prometheus_metrics():
+        return PlainTextResponse(metrics.render(), media_type=PROMETHEUS_CONTENT_TYPE)
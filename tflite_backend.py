@@ -0,0 +1,128 @@
+import os
+import queue
+import threading
+
+import numpy as np
+
+
+def default_tflite_path(model_path, variant='int8'):
+    """plant_disease_model.h5 -> plant_disease_model_int8.tflite (أو _fp16)"""
+    return f"{os.path.splitext(model_path)[0]}_{variant}.tflite"
+
+
+def _interpreter_class():
+    """مفسر TFLite من أخف حزمة متاحة (tflite_runtime أو LiteRT أو TensorFlow الكامل)"""
+    try:
+        from tflite_runtime.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        pass
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        pass
+    import tensorflow as tf
+    return tf.lite.Interpreter
+
+
+class TFLitePredictor:
+    """استدلال نموذج TFLite (float16 أو INT8 مع XNNPACK) من مجمع ثابت من المفسرات
+    مفسر TFLite غير آمن للاستخدام من عدة خيوط، لذلك يستعير كل طلب مفسراً من المجمع ويعيده بعد الانتهاء
+    (خادم werkzeug ينشئ خيطاً لكل اتصال، فمفسر لكل خيط يعني إنشاء مفسر جديد لكل طلب تقريباً)"""
+
+    def __init__(self, model_path, num_threads=None, pool_size=2):
+        self.model_path = model_path
+        self.num_threads = num_threads
+        self.pool_size = max(1, int(pool_size))  # أقصى عدد طلبات تُنفذ بالتوازي
+        with open(model_path, 'rb') as f:
+            self._model_content = f.read()  # قراءة الملف مرة واحدة ومشاركتها بين المفسرات
+        self._interpreter_cls = _interpreter_class()
+        self._pool = queue.Queue()
+        for _ in range(self.pool_size):
+            self._pool.put(self._new_state())
+        self._lock = threading.Lock()
+        self.waits = 0  # طلبات انتظرت مفسراً متاحاً
+
+        state = self._pool.queue[0]
+        self.input_dtype = state['input']['dtype']
+        self.input_shape = tuple(state['input']['shape'][1:])
+        self.quantized = self.input_dtype in (np.int8, np.uint8)
+
+    def _new_state(self):
+        interpreter = self._interpreter_cls(model_content=self._model_content, num_threads=self.num_threads)
+        interpreter.allocate_tensors()
+        return {
+            'interpreter': interpreter,
+            'input': interpreter.get_input_details()[0],
+            'output': interpreter.get_output_details()[0],
+            'batch': int(interpreter.get_input_details()[0]['shape'][0]),
+        }
+
+    def _acquire(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                self.waits += 1
+            return self._pool.get()
+
+    def warmup(self):
+        """استدعاء كل مفسرات المجمع مرة (تهيئة XNNPACK) قبل أول طلب"""
+        states = [self._acquire() for _ in range(self.pool_size)]
+        try:
+            for state in states:
+                self._invoke(state, np.zeros((1,) + self.input_shape, dtype=np.uint8))
+        finally:
+            for state in states:
+                self._pool.put(state)
+
+    def _quantize_input(self, batch, details):
+        scale, zero_point = details['quantization']
+        if batch.dtype == np.uint8:
+            # بكسلات خام 0-255: نموذج INT8 من convert_cnn_tflite.py مكمم بمقياس 1/255 فتمر كما هي
+            if self.input_dtype == np.uint8 and np.isclose(scale, 1.0 / 255) and zero_point == 0:
+                return batch
+            batch = batch.astype(np.float32)
+            batch *= 1.0 / 255
+        if not self.quantized:
+            return np.asarray(batch, dtype=self.input_dtype)
+        if batch.dtype == self.input_dtype:
+            return batch  # بيانات مكممة مسبقاً
+        info = np.iinfo(self.input_dtype)
+        return np.clip(np.round(np.asarray(batch, dtype=np.float32) / scale + zero_point),
+                       info.min, info.max).astype(self.input_dtype)
+
+    @staticmethod
+    def _dequantize_output(output, details):
+        if output.dtype not in (np.int8, np.uint8):
+            return output
+        scale, zero_point = details['quantization']
+        return (output.astype(np.float32) - zero_point) * scale
+
+    def predict(self, batch):
+        """مثل model.predict: دفعة (N, 224, 224, 3) بقيم float بين 0 و 1 أو uint8 خام -> احتمالات (N, classes)"""
+        state = self._acquire()
+        try:
+            return self._invoke(state, batch)
+        finally:
+            self._pool.put(state)
+
+    def _invoke(self, state, batch):
+        interpreter = state['interpreter']
+        input_details, output_details = state['input'], state['output']
+        batch = np.asarray(batch)
+        n = len(batch)
+        if n != state['batch']:
+            # تغيير حجم الدفعة يعيد حجز الموترات، لذلك يُحفظ آخر حجم لكل مفسر
+            interpreter.resize_tensor_input(input_details['index'], (n,) + self.input_shape)
+            interpreter.allocate_tensors()
+            state['batch'] = n
+        interpreter.set_tensor(input_details['index'], self._quantize_input(batch, input_details))
+        interpreter.invoke()
+        output = interpreter.get_tensor(output_details['index'])  # نسخة، فتبقى صالحة بعد إعادة المفسر
+        return self._dequantize_output(output, output_details)
+
+    def stats(self):
+        return {'model_path': self.model_path, 'interpreters': self.pool_size, 'available': self._pool.qsize(),
+                'waits': self.waits, 'num_threads': self.num_threads, 'quantized': self.quantized}
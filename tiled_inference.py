@@ -0,0 +1,109 @@
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from yolo_postprocess import detections_to_numpy, non_max_suppression
+
+
+def tile_origins(length, tile, overlap):
+    """نقاط بداية المربعات على محور واحد بحيث تغطي الطول كاملاً مع تداخل"""
+    if length <= tile:
+        return [0]
+    stride = max(1, int(tile * (1 - overlap)))
+    origins = list(range(0, length - tile, stride))
+    origins.append(length - tile)  # آخر مربع ملاصق لحافة الصورة
+    return origins
+
+
+def make_tiles(img, tile=416, overlap=0.2):
+    """تقطيع الصورة إلى مربعات متداخلة (عروض على الصورة الأصلية دون نسخ) مع إزاحة كل مربع"""
+    h, w = img.shape[:2]
+    tiles, offsets = [], []
+    for y in tile_origins(h, tile, overlap):
+        for x in tile_origins(w, tile, overlap):
+            tiles.append(img[y:y + tile, x:x + tile])
+            offsets.append((x, y))
+    return tiles, offsets
+
+
+def is_background_tile(tile, min_std=6.0):
+    """اختبار رخيص لإحصاءات البكسلات: المربع شبه الموحد (سماء، تربة، جدار) لا يحتوي أوراقاً"""
+    sample = tile[::8, ::8]
+    return float(sample.std()) < min_std
+
+
+class TilingMetrics:
+    """إحصائيات وضع التقطيع: عدد المربعات والمتخطاة وزمن كل مربع"""
+
+    def __init__(self, window=1000):
+        self._lock = threading.Lock()
+        self._tile_latencies = deque(maxlen=window)
+        self.tiled_requests = 0
+        self.tiles_total = 0
+        self.tiles_skipped = 0
+
+    def record(self, tiles, skipped, per_tile_ms):
+        with self._lock:
+            self.tiled_requests += 1
+            self.tiles_total += tiles
+            self.tiles_skipped += skipped
+            if per_tile_ms is not None:
+                self._tile_latencies.append(per_tile_ms)
+
+    def stats(self):
+        with self._lock:
+            latencies = np.array(self._tile_latencies) if self._tile_latencies else None
+            snapshot = {
+                'tiled_requests': self.tiled_requests,
+                'tiles_total': self.tiles_total,
+                'tiles_skipped': self.tiles_skipped,
+                'mean_tiles_per_request': round(self.tiles_total / self.tiled_requests, 2) if self.tiled_requests else 0.0,
+            }
+        if latencies is not None:
+            snapshot['per_tile_ms'] = {
+                'p50': round(float(np.percentile(latencies, 50)), 2),
+                'p95': round(float(np.percentile(latencies, 95)), 2),
+            }
+        return snapshot
+
+
+def run_tiled(img, infer_fn, tile=416, overlap=0.2, batch_size=8, iou_thres=0.45, min_std=6.0, metrics=None,
+              full_image=True):
+    """كشف على صورة كبيرة عبر مربعات متداخلة ثم دمج الصناديق بإحداثيات الصورة مع NMS عبر المربعات
+    full_image: تمرير إضافي على الصورة كاملة (يصغرها النموذج إلى حجم إدخاله) كما في SAHI،
+    لالتقاط الأوراق والبقع الكبيرة التي تقسمها المربعات أو تظهر فيها بمقياس لم يتدرب عليه النموذج"""
+    tiles, offsets = make_tiles(img, tile, overlap)
+    keep = [i for i, t in enumerate(tiles) if not is_background_tile(t, min_std)]
+    skipped = len(tiles) - len(keep)
+    inputs = [tiles[i] for i in keep]
+    origins = [offsets[i] for i in keep]
+    if full_image:
+        # صناديق الصورة كاملة تعود بإحداثيات الصورة الأصلية فلا تحتاج إزاحة
+        inputs.insert(0, img)
+        origins.insert(0, (0, 0))
+    if not inputs:
+        # كل المربعات خلفية: لا شيء يستحق التشغيل
+        if metrics is not None:
+            metrics.record(len(tiles), skipped, None)
+        return np.zeros((0, 6), dtype=np.float32)
+
+    detections = []
+    started = time.perf_counter()
+    for start in range(0, len(inputs), batch_size):
+        outputs = infer_fn(inputs[start:start + batch_size])
+        for (x, y), det in zip(origins[start:start + batch_size], outputs):
+            det = detections_to_numpy(det).copy()
+            if len(det):
+                det[:, [0, 2]] += x
+                det[:, [1, 3]] += y
+                detections.append(det)
+    per_tile_ms = (time.perf_counter() - started) * 1000.0 / len(inputs)
+
+    if metrics is not None:
+        metrics.record(len(tiles), skipped, per_tile_ms)
+    if not detections:
+        return np.zeros((0, 6), dtype=np.float32)
+    # IoS بدلاً من IoU حتى تُدمج أجزاء البقعة المقسومة بين المربعات مع صندوقها في الصورة كاملة
+    return non_max_suppression(np.concatenate(detections), iou_thres=iou_thres, metric='ios')
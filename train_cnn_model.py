@@ -1,13 +1,40 @@
 import tensorflow as tf
 import os
+import json
+import time
 import numpy as np
-from tensorflow.keras.preprocessing.image import ImageDataGenerator
 from tensorflow.keras.applications import MobileNetV2
 
+from cnn_input_pipeline import build_dataset, build_shard_dataset, measure_pipeline, split_samples
+from dataset_shards import INDEX_FILE, DatasetShards
+from bottleneck_cache import FeatureCache, assemble_model, build_head, cache_key, feature_dataset, feature_extractor, unfreeze_top
+from training_telemetry import TrainingTelemetry
+
 # مسارات البيانات والنموذج
 DATA_PATH = "./PlantVillage"  # مسار قاعدة البيانات المحلي داخل المشروع
 MODEL_SAVE_PATH = "./model/plant_disease_model.h5"
 CLASS_NAMES_PATH = "./model/class_names.npy"
+PIPELINE_REPORT_PATH = "./model/input_pipeline_report.json"
+BOTTLENECK_REPORT_PATH = "./model/bottleneck_report.json"
+HISTORY_PATH = "./model/training_hist.json"  # يُرسم بـ 1cnn/plot_training_results.py
+IMG_SIZE = 224
+BATCH_SIZE = 32
+EPOCHS = 15
+
+# full: تدريب الرأس بتمرير كل صورة عبر MobileNetV2 في كل حقبة
+# bottleneck: تمرير كل صورة عبر العمود الفقري المجمد مرة واحدة وتدريب الرأس على الميزات المحفوظة
+TRAIN_MODE = os.environ.get('TRAIN_MODE', 'full').lower()
+FEATURE_CACHE_DIR = os.environ.get('FEATURE_CACHE_DIR', './model/bottleneck_features')
+FEATURE_VARIANTS = int(os.environ.get('FEATURE_VARIANTS', 0))  # نسخ زيادة بيانات إضافية لكل صورة تدريب
+FINE_TUNE_EPOCHS = int(os.environ.get('FINE_TUNE_EPOCHS', 0))  # مرحلة ثانية اختيارية بعد فك تجميد الكتل العليا
+FINE_TUNE_AT = os.environ.get('FINE_TUNE_AT', 'block_13_expand')  # أول طبقة تُفك من MobileNetV2
+
+# أجزاء الصور المفكوكة مسبقاً من build_dataset_shards.py (تُستخدم بدلاً من ملفات JPEG إذا وُجدت)
+TRAIN_SHARDS = os.environ.get('TRAIN_SHARDS', './shards/plantvillage_224')
+# تخزين الصور المفكوكة مؤقتاً: '' في الذاكرة، أو مسار ملف على القرص (للبيانات الأكبر من الذاكرة)، أو none
+TRAIN_CACHE = os.environ.get('TRAIN_CACHE', '')
+# قياس سرعة خط الإدخال وحده لعدد من الدفعات قبل التدريب (0 لتعطيله)
+PIPELINE_BENCHMARK_STEPS = int(os.environ.get('PIPELINE_BENCHMARK_STEPS', 50))
 
 # التأكد من وجود المجلدات
 os.makedirs(os.path.dirname(MODEL_SAVE_PATH), exist_ok=True)
@@ -15,39 +42,55 @@ os.makedirs(os.path.dirname(MODEL_SAVE_PATH), exist_ok=True)
 print(f"جاري تحميل البيانات من {DATA_PATH}")
 print(f"سيتم حفظ النموذج في {MODEL_SAVE_PATH}")
 
-# إعداد معالجة الصور
-train_datagen = ImageDataGenerator(
-    rescale=1./255,
-    rotation_range=20,
-    width_shift_range=0.2,
-    height_shift_range=0.2,
-    shear_range=0.2,
-    zoom_range=0.2,
-    horizontal_flip=True,
-    validation_split=0.2
-)
-
-# تحميل البيانات للتدريب والتحقق
-print("جاري تحميل بيانات التدريب...")
-train_generator = train_datagen.flow_from_directory(
-    DATA_PATH,
-    target_size=(224, 224),
-    batch_size=32,
-    class_mode='categorical',
-    subset='training'
-)
-
-print("جاري تحميل بيانات التحقق...")
-validation_generator = train_datagen.flow_from_directory(
-    DATA_PATH,
-    target_size=(224, 224),
-    batch_size=32,
-    class_mode='categorical',
-    subset='validation'
-)
+# تقسيم 80/20 نفسه الذي كان يستخدمه ImageDataGenerator(validation_split=0.2)
+if os.path.exists(os.path.join(TRAIN_SHARDS, INDEX_FILE)):
+    # قراءة الصور من الأجزاء (memory-mapped) دون فك ترميز JPEG في كل حقبة
+    print(f"جاري تحميل الأجزاء من {TRAIN_SHARDS}...")
+    shards = DatasetShards(TRAIN_SHARDS)
+    class_names = shards.class_names
+    train_positions, validation_positions = shards.split(validation_split=0.2)
+    print(f"صور التدريب: {len(train_positions)} - صور التحقق: {len(validation_positions)}")
+    train_dataset = build_shard_dataset(shards, train_positions, BATCH_SIZE, training=True)
+    validation_dataset = build_shard_dataset(shards, validation_positions, BATCH_SIZE)
+    benchmark_dataset = train_dataset
+
+    def extraction_dataset(augment):
+        return build_shard_dataset(shards, train_positions, BATCH_SIZE, augment=augment)
+
+    def sample_ids():
+        entries = shards.index['entries']
+        return [entries[p] for p in train_positions] + [entries[p] for p in validation_positions]
+else:
+    print("جاري تحميل قائمة الصور...")
+    class_names, train_samples, validation_samples = split_samples(DATA_PATH, validation_split=0.2)
+    print(f"صور التدريب: {len(train_samples)} - صور التحقق: {len(validation_samples)}")
+
+    # خط إدخال tf.data بدلاً من flow_from_directory: فك ترميز وزيادة بيانات متوازية مع تخزين مؤقت و prefetch
+    # (زيادة البيانات على التدريب فقط، والتحقق بالصور الأصلية)
+    if TRAIN_CACHE.lower() == 'none':
+        train_cache = validation_cache = None
+    elif TRAIN_CACHE:
+        train_cache, validation_cache = f"{TRAIN_CACHE}_train", f"{TRAIN_CACHE}_validation"
+    else:
+        train_cache = validation_cache = ''
+    train_dataset = build_dataset(train_samples, len(class_names), IMG_SIZE, BATCH_SIZE, training=True, cache=train_cache)
+    validation_dataset = build_dataset(validation_samples, len(class_names), IMG_SIZE, BATCH_SIZE, cache=validation_cache)
+    # على نسخة بدون تخزين مؤقت حتى لا تُترك ذاكرة التخزين المؤقت غير مكتملة
+    benchmark_dataset = build_dataset(train_samples, len(class_names), IMG_SIZE, BATCH_SIZE, training=True, cache=None)
+
+    def extraction_dataset(augment):
+        return build_dataset(train_samples, len(class_names), IMG_SIZE, BATCH_SIZE, cache=None, augment=augment)
+
+    def sample_ids():
+        return [(path, label, os.path.getmtime(path)) for path, label in train_samples + validation_samples]
+
+if PIPELINE_BENCHMARK_STEPS:
+    pipeline_rate = measure_pipeline(benchmark_dataset, PIPELINE_BENCHMARK_STEPS)
+    print(f"سرعة خط الإدخال وحده: {pipeline_rate:.1f} صورة/ثانية")
+else:
+    pipeline_rate = None
 
 # حفظ أسماء الفئات للتنبؤ لاحقاً
-class_names = list(train_generator.class_indices.keys())
 np.save(CLASS_NAMES_PATH, class_names)
 print(f"تم حفظ أسماء الفئات: {class_names}")
 
@@ -56,38 +99,125 @@ print("جاري بناء النموذج...")
 base_model = MobileNetV2(weights='imagenet', include_top=False, input_shape=(224, 224, 3))
 base_model.trainable = False  # تجميد الطبقات الأساسية
 
-model = tf.keras.Sequential([
-    base_model,
-    tf.keras.layers.GlobalAveragePooling2D(),
-    tf.keras.layers.Dense(128, activation='relu'),
-    tf.keras.layers.Dropout(0.5),
-    tf.keras.layers.Dense(len(class_names), activation='softmax')
-])
-
-# تجميع النموذج
-model.compile(
-    optimizer=tf.keras.optimizers.Adam(learning_rate=0.001),
-    loss='categorical_crossentropy',
-    metrics=['accuracy']
-)
-
-# إظهار ملخص النموذج
-model.summary()
-
-# تدريب النموذج
-print("جاري تدريب النموذج...")
-history = model.fit(
-    train_generator,
-    steps_per_epoch=train_generator.samples // train_generator.batch_size,
-    validation_data=validation_generator,
-    validation_steps=validation_generator.samples // validation_generator.batch_size,
-    epochs=15,
-    callbacks=[
-        tf.keras.callbacks.ReduceLROnPlateau(factor=0.2, patience=2)
-    ]
-)
+def compile_model(target, learning_rate=0.001):
+    target.compile(
+        optimizer=tf.keras.optimizers.Adam(learning_rate=learning_rate),
+        loss='categorical_crossentropy',
+        metrics=['accuracy']
+    )
+
+# زمن الخطوة وانتظار خط الإدخال والصور/ثانية والذاكرة والمعالج لكل حقبة (تُضاف إلى history)
+telemetry = TrainingTelemetry(batch_size=BATCH_SIZE)
+train_started = time.perf_counter()
+
+if TRAIN_MODE == 'bottleneck':
+    # 1. ميزات العمود الفقري المجمد (1280 float16 لكل صورة) مرة واحدة، وتُعاد من القرص في التشغيلات التالية
+    report = {'mode': TRAIN_MODE, 'feature_variants': FEATURE_VARIANTS}
+    extractor = feature_extractor(base_model)
+    cache = FeatureCache(FEATURE_CACHE_DIR, cache_key(sample_ids(), IMG_SIZE))
+    started = time.perf_counter()
+    parts = [cache.extract('train', extractor, extraction_dataset(augment=False))]
+    for variant in range(FEATURE_VARIANTS):
+        parts.append(cache.extract(f"train_aug{variant + 1}", extractor, extraction_dataset(augment=True)))
+    validation_features = cache.extract('validation', extractor, validation_dataset)
+    report['extract_s'] = round(time.perf_counter() - started, 3)
+
+    # 2. تدريب الرأس على الميزات المحفوظة (ثوانٍ بدلاً من تمرير الصور عبر MobileNetV2 في كل حقبة)
+    print("جاري تدريب رأس التصنيف على الميزات المحفوظة...")
+    head = build_head(len(class_names))
+    compile_model(head)
+    head.summary()
+    started = time.perf_counter()
+    head_telemetry = TrainingTelemetry(batch_size=BATCH_SIZE, verbose=False)
+    history = head.fit(
+        head_telemetry.attach(feature_dataset(parts, len(class_names), BATCH_SIZE, shuffle=True)),
+        validation_data=feature_dataset([validation_features], len(class_names), BATCH_SIZE),
+        epochs=EPOCHS,
+        callbacks=[
+            tf.keras.callbacks.ReduceLROnPlateau(factor=0.2, patience=2),
+            head_telemetry
+        ]
+    )
+    report['head_train_s'] = round(time.perf_counter() - started, 3)
+    report['head_telemetry'] = head_telemetry.summary()
+    report['head_val_accuracy'] = history.history['val_accuracy'][-1]
+    model = assemble_model(base_model, head)
+    compile_model(model)
+
+    # 3. ضبط دقيق اختياري: فك تجميد الكتل العليا والتدريب على الصور بمعدل تعلم صغير
+    if FINE_TUNE_EPOCHS:
+        trainable = unfreeze_top(base_model, FINE_TUNE_AT)
+        print(f"ضبط دقيق لآخر {trainable} طبقة من MobileNetV2 لمدة {FINE_TUNE_EPOCHS} حقبة...")
+        compile_model(model, learning_rate=1e-5)
+        started = time.perf_counter()
+        fine_tune_history = model.fit(
+            telemetry.attach(train_dataset),
+            validation_data=validation_dataset,
+            epochs=FINE_TUNE_EPOCHS,
+            callbacks=[telemetry]
+        )
+        report['fine_tune_s'] = round(time.perf_counter() - started, 3)
+        report['input_pipeline'] = telemetry.summary()
+        report['fine_tune_val_accuracy'] = fine_tune_history.history['val_accuracy'][-1]
+        # المحفوظ هو النموذج بعد الضبط الدقيق: training_hist.json يجمع المرحلتين (الرأس ثم الضبط) بالترتيب
+        history.history = {key: history.history.get(key, []) + fine_tune_history.history.get(key, [])
+                           for key in {**history.history, **fine_tune_history.history}}
+
+    report['total_s'] = round(time.perf_counter() - train_started, 3)
+    # الوضع الكامل يمرر كل صورة تدريب عبر العمود الفقري في كل حقبة على الأقل (حد أدنى للمقارنة)
+    backbone_rate = cache.meta['parts']['train'].get('images_per_second')
+    if backbone_rate:
+        report['full_mode_forward_only_estimate_s'] = round(len(parts[0][1]) / backbone_rate * EPOCHS, 1)
+    report['val_accuracy'] = report.get('fine_tune_val_accuracy', report['head_val_accuracy'])
+    with open(BOTTLENECK_REPORT_PATH, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"زمن التدريب: {report['total_s']:.1f} ثانية (استخراج {report['extract_s']:.1f} + رأس {report['head_train_s']:.1f})")
+    if 'fine_tune_val_accuracy' in report:
+        print(f"دقة التحقق: الرأس {report['head_val_accuracy']:.4f} -> بعد الضبط الدقيق {report['fine_tune_val_accuracy']:.4f}")
+    if 'full_mode_forward_only_estimate_s' in report:
+        print(f"الوضع الكامل يحتاج {report['full_mode_forward_only_estimate_s']:.1f} ثانية على الأقل للتمرير الأمامي وحده")
+    print(f"تم حفظ تقرير الزمن في {BOTTLENECK_REPORT_PATH}")
+else:
+    model = tf.keras.Sequential([
+        base_model,
+        tf.keras.layers.GlobalAveragePooling2D(),
+        tf.keras.layers.Dense(128, activation='relu'),
+        tf.keras.layers.Dropout(0.5),
+        tf.keras.layers.Dense(len(class_names), activation='softmax')
+    ])
+
+    # تجميع النموذج
+    compile_model(model)
+
+    # إظهار ملخص النموذج
+    model.summary()
+
+    # تدريب النموذج
+    print("جاري تدريب النموذج...")
+    history = model.fit(
+        telemetry.attach(train_dataset),
+        validation_data=validation_dataset,
+        epochs=EPOCHS,
+        callbacks=[
+            tf.keras.callbacks.ReduceLROnPlateau(factor=0.2, patience=2),
+            telemetry
+        ]
+    )
+
+    # تقرير زمن انتظار خط الإدخال (نسبة قريبة من الصفر تعني أن النموذج وليس المعالج هو عنق الزجاجة)
+    report = telemetry.summary()
+    report['pipeline_images_per_second'] = pipeline_rate
+    report['total_s'] = round(time.perf_counter() - train_started, 3)
+    with open(PIPELINE_REPORT_PATH, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"انتظار خط الإدخال: {report['stall_s']:.1f} ثانية من {report['train_s']:.1f} ({report['stall_share'] * 100:.1f}%)")
+    print(f"تم حفظ تقرير خط الإدخال في {PIPELINE_REPORT_PATH}")
+
+# منحنيات التدريب مع قياسات الأداء لكل حقبة (رأس التصنيف في وضع bottleneck)
+with open(HISTORY_PATH, 'w', encoding='utf-8') as f:
+    json.dump({k: [float(v) for v in values] for k, values in history.history.items()}, f)
 
 # حفظ النموذج
 print(f"حفظ النموذج في {MODEL_SAVE_PATH}...")
 model.save(MODEL_SAVE_PATH)
-print(f"تم الانتهاء! النموذج جاهز للاستخدام.") 
\ No newline at end of file
+print(f"تم الانتهاء! النموذج جاهز للاستخدام.")
\ No newline at end of file
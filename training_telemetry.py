@@ -0,0 +1,112 @@
+import json
+import os
+import time
+
+import numpy as np
+
+from cnn_input_pipeline import InputStallMonitor
+
+try:
+    import psutil
+except ImportError:  # psutil اختياري: بدونه تُقرأ الذاكرة من /proc (لينكس فقط)
+    psutil = None
+
+
+def current_rss_bytes():
+    """الذاكرة المقيمة الحالية للعملية؛ None إذا لم تتوفر"""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def process_cpu_seconds():
+    """زمن المعالج (مستخدم + نظام) لكل خيوط العملية منذ بدايتها"""
+    times = os.times()
+    return times.user + times.system
+
+
+class TrainingTelemetry(InputStallMonitor):
+    """قياسات أداء التدريب لكل حقبة تُكتب في سجل Keras (وبالتالي في history و training_hist.json):
+    - step_ms و step_ms_p95: زمن خطوة التدريب (من طلب الدفعة حتى انتهاء التحديث)
+    - input_stall_share (من InputStallMonitor) و compute_share: نسبة زمن حلقة التدريب (دون التحقق) في انتظار خط الإدخال مقابل الحساب
+    - images_per_second: صور التدريب في الثانية (دون التحقق)
+    - peak_rss_mb: أعلى ذاكرة مقيمة خلال الحقبة
+    - cpu_percent: استخدام المعالج للعملية كنسبة من كل الأنوية
+    انتظار الإدخال يحتاج تمرير مجموعة التدريب عبر attach() كما في InputStallMonitor.
+    مع path يُكتب summary() مع details في ملف JSON بعد كل حقبة (مثل training_throughput.json)"""
+
+    def __init__(self, batch_size=None, rss_every=10, verbose=True, path=None, details=None):
+        super().__init__(verbose=verbose)
+        self.path = path
+        self.details = details or {}
+        self.batch_size = batch_size  # لحساب الصور/ثانية إذا لم تمر البيانات عبر attach()
+        self.rss_every = max(1, rss_every)  # قراءة الذاكرة كل N خطوات
+        self.cpu_count = os.cpu_count() or 1
+        self._step_times = []
+        self._cpu_begin = None
+        self._peak_rss = None
+
+    def _sample_rss(self):
+        rss = current_rss_bytes()
+        if rss is not None and (self._peak_rss is None or rss > self._peak_rss):
+            self._peak_rss = rss
+
+    def on_epoch_begin(self, epoch, logs=None):
+        super().on_epoch_begin(epoch, logs)
+        self._step_times = []
+        self._peak_rss = None
+        self._sample_rss()
+        self._cpu_begin = process_cpu_seconds()
+
+    def on_train_batch_end(self, batch, logs=None):
+        super().on_train_batch_end(batch, logs)
+        self._step_times.append(self._loop_end - self._batch_begin)
+        if len(self._step_times) % self.rss_every == 0:
+            self._sample_rss()
+
+    def on_epoch_end(self, epoch, logs=None):
+        # القياس قبل super() حتى لا يدخل زمن الطباعة في الحساب
+        self._sample_rss()
+        wall = time.perf_counter() - self._epoch_begin
+        cpu = process_cpu_seconds() - self._cpu_begin
+        loop_s = self.loop_seconds()
+        images = self._images or self._steps * (self.batch_size or 0)
+        step_ms = np.array(self._step_times) * 1000.0
+        telemetry = {
+            'step_ms': float(step_ms.mean()) if len(step_ms) else 0.0,
+            'step_ms_p95': float(np.percentile(step_ms, 95)) if len(step_ms) else 0.0,
+            'compute_share': max(0.0, (step_ms.sum() / 1000.0 - self._stall) / loop_s) if loop_s > 0 else 0.0,
+            'images_per_second': images / loop_s if loop_s > 0 else 0.0,
+            'peak_rss_mb': self._peak_rss / (1024 * 1024) if self._peak_rss is not None else None,
+            'cpu_percent': 100.0 * cpu / (wall * self.cpu_count) if wall > 0 else 0.0,
+        }
+        super().on_epoch_end(epoch, logs)
+        self.epochs[-1].update({k: round(v, 3) if v is not None else None for k, v in telemetry.items()})
+        if logs is not None:
+            logs.update({k: v for k, v in telemetry.items() if v is not None})
+        if self.verbose:
+            rss = f"{telemetry['peak_rss_mb']:.0f}MB" if telemetry['peak_rss_mb'] is not None else '-'
+            print(f"خطوة {telemetry['step_ms']:.1f}ms (p95 {telemetry['step_ms_p95']:.1f}ms) - "
+                  f"{telemetry['images_per_second']:.1f} صورة/ثانية - حساب {telemetry['compute_share'] * 100:.1f}% - "
+                  f"ذاكرة {rss} - معالج {telemetry['cpu_percent']:.0f}%")
+        if self.path:
+            self.save()
+
+    def summary(self):
+        summary = super().summary()
+        rates = [e['images_per_second'] for e in self.epochs if e.get('images_per_second')]
+        peaks = [e['peak_rss_mb'] for e in self.epochs if e.get('peak_rss_mb') is not None]
+        summary['images_per_second'] = round(sum(rates) / len(rates), 1) if rates else None
+        summary['peak_rss_mb'] = round(max(peaks), 1) if peaks else None
+        return summary
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump(dict(self.details, **self.summary()), f, ensure_ascii=False, indent=2)
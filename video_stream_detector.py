@@ -0,0 +1,374 @@
+import argparse
+import json
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from yolo_postprocess import detections_to_numpy, filter_by_confidence, class_name
+
+# علامتا بداية ونهاية صورة JPEG في تدفق MJPEG (multipart/x-mixed-replace أو صور JPEG متتالية)
+JPEG_SOI = b'\xff\xd8'
+JPEG_EOI = b'\xff\xd9'
+
+_END = object()  # علامة انتهاء المصدر في طابور الإطارات
+
+
+def iter_mjpeg_frames(chunks, max_frame_bytes=16 * 1024 * 1024):
+    """استخراج بايتات كل إطار JPEG من تدفق مقطع (chunked) دون الاعتماد على حدود multipart
+    ملاحظة: تفترض أن الإطارات لا تحمل صورة مصغرة EXIF مضمنة (كاميرات MJPEG لا تضيفها عادة)"""
+    buffer = bytearray()
+    for chunk in chunks:
+        if not chunk:
+            continue
+        buffer.extend(chunk)
+        while True:
+            start = buffer.find(JPEG_SOI)
+            if start < 0:
+                # إبقاء آخر بايت فقط في حال انقسمت العلامة بين قطعتين
+                del buffer[:-1]
+                break
+            end = buffer.find(JPEG_EOI, start + 2)
+            if end < 0:
+                del buffer[:start]
+                if len(buffer) > max_frame_bytes:
+                    print(f"إطار MJPEG تجاوز {max_frame_bytes} بايت، تجاهله")
+                    buffer.clear()
+                break
+            yield bytes(buffer[start:end + 2])
+            del buffer[:end + 2]
+
+
+def mjpeg_frames(chunks, decode_fn=None):
+    """فك ترميز إطارات تدفق MJPEG (decode_fn تستقبل مصفوفة بايتات وتعيد صورة BGR أو None)"""
+    for data in iter_mjpeg_frames(chunks):
+        buffer = np.frombuffer(data, dtype=np.uint8)
+        frame = decode_fn(buffer) if decode_fn is not None else cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+        if frame is not None:
+            yield frame
+
+
+def video_file_frames(source):
+    """قراءة إطارات ملف فيديو أو كاميرا (رقم الجهاز) أو رابط تدفق يدعمه OpenCV
+    يُفتح المصدر فوراً حتى يظهر خطأ الفتح للمستدعي وليس داخل خيط القارئ"""
+    capture = cv2.VideoCapture(int(source) if str(source).isdigit() else source)
+    if not capture.isOpened():
+        capture.release()
+        raise ValueError(f"تعذر فتح مصدر الفيديو: {source}")
+    return _capture_frames(capture)
+
+
+def _capture_frames(capture):
+    try:
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            yield frame
+    finally:
+        capture.release()
+
+
+def resize_frame(frame, max_side):
+    """تصغير الإطار إذا تجاوز ضلعه الأطول max_side (الكاشف يعمل على YOLO_IMG_SIZE على أي حال)"""
+    if not max_side:
+        return frame
+    h, w = frame.shape[:2]
+    scale = max_side / float(max(h, w))
+    if scale >= 1.0:
+        return frame
+    return cv2.resize(frame, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+
+
+class FrameReader:
+    """فك ترميز الإطارات في خيط منفصل وتمريرها عبر طابور محدود
+    drop_when_full=True للتدفقات الحية: يُهمل أقدم إطار عند تأخر الكاشف بدلاً من تراكم التأخير
+    drop_when_full=False لملفات الفيديو: القارئ ينتظر الكاشف فلا يضيع أي إطار"""
+
+    def __init__(self, frames, queue_size=32, drop_when_full=True, max_side=None):
+        self.frames = frames
+        self.drop_when_full = drop_when_full
+        self.max_side = max_side
+        self._queue = queue.Queue(maxsize=max(1, queue_size))
+        self._stop = threading.Event()
+        self._thread = None
+        self.error = None
+
+        self.frames_read = 0
+        self.frames_dropped = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='frame-reader', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=5.0):
+        """إيقاف القارئ وانتظار خيطه حتى يُغلق المصدر (لحذف الملف المؤقت بعده بأمان)"""
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def _put(self, entry):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(entry, timeout=0.1)
+                return
+            except queue.Full:
+                if self.drop_when_full and entry is not _END:
+                    try:
+                        self._queue.get_nowait()
+                        self.frames_dropped += 1
+                    except queue.Empty:
+                        pass
+
+    def _run(self):
+        try:
+            for frame in self.frames:
+                if self._stop.is_set():
+                    break
+                index = self.frames_read
+                self.frames_read += 1
+                self._put((index, time.perf_counter(), resize_frame(frame, self.max_side)))
+        except Exception as e:
+            print(f"خطأ في قراءة الإطارات: {str(e)}")
+            self.error = str(e)
+        finally:
+            close = getattr(self.frames, 'close', None)
+            if close is not None:
+                close()
+            self._put(_END)
+
+    def get(self, timeout=None):
+        """الإطار التالي (index, وقت القراءة, صورة) أو None عند انتهاء المصدر"""
+        entry = self._queue.get(timeout=timeout)
+        return None if entry is _END else entry
+
+    def get_nowait(self):
+        """إطار جاهز بالفعل دون انتظار، أو False إذا كان الطابور فارغاً"""
+        try:
+            entry = self._queue.get_nowait()
+        except queue.Empty:
+            return False
+        return None if entry is _END else entry
+
+
+class FrameDiffer:
+    """اختبار رخيص للإطارات شبه المكررة: متوسط الفرق المطلق بين صورتين رماديتين مصغرتين 64x64"""
+
+    def __init__(self, threshold=4.0, size=64, max_skip=30):
+        self.threshold = threshold  # على مقياس 0-255
+        self.size = size
+        self.max_skip = max_skip  # معالجة إطار واحد على الأقل كل max_skip إطاراً حتى مع ثبات المشهد
+        self._reference = None
+        self._skipped = 0
+
+    def thumbnail(self, frame):
+        gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return cv2.resize(gray, (self.size, self.size), interpolation=cv2.INTER_AREA).astype(np.int16)
+
+    def is_duplicate(self, frame):
+        """True إذا كان الإطار قريباً من آخر إطار مُعالج (المرجع لا يتحرك مع الإطارات المتخطاة)"""
+        thumb = self.thumbnail(frame)
+        if self._reference is not None and self._skipped < self.max_skip:
+            if float(np.abs(thumb - self._reference).mean()) < self.threshold:
+                self._skipped += 1
+                return True
+        self._reference = thumb
+        self._skipped = 0
+        return False
+
+
+class TemporalSmoother:
+    """تنعيم الكشف عبر الزمن: متوسط أسي متحرك لثقة كل فئة، والتنبيه فقط بعد K إطارات متتالية فوق العتبة
+    مع عتبة إطفاء أدنى (hysteresis) حتى لا يتذبذب التنبيه حول الحد"""
+
+    def __init__(self, alpha=0.3, on_threshold=0.5, off_threshold=0.3, min_frames=3, ignore_classes=()):
+        self.alpha = alpha
+        self.on_threshold = on_threshold
+        self.off_threshold = off_threshold
+        self.min_frames = max(1, int(min_frames))
+        self.ignore_classes = set(ignore_classes)
+
+        self.ema = {}  # اسم الفئة -> الثقة المنعمة
+        self._streak = {}  # عدد الإطارات المتتالية فوق العتبة
+        self.active = {}  # الفئات ذات التنبيه النشط -> رقم إطار البداية
+
+    def update(self, frame_index, det, class_names, conf_thres=0.0):
+        """تحديث الحالة بكشف إطار واحد وإرجاع أحداث alert_start / alert_end"""
+        det = filter_by_confidence(detections_to_numpy(det), conf_thres)
+        frame_conf = {}
+        for row in det:
+            name = class_name(int(row[5]), class_names)
+            if name not in self.ignore_classes:
+                frame_conf[name] = max(frame_conf.get(name, 0.0), float(row[4]))
+
+        events = []
+        for name in set(self.ema) | set(frame_conf):
+            value = self.alpha * frame_conf.get(name, 0.0) + (1 - self.alpha) * self.ema.get(name, 0.0)
+            self.ema[name] = value
+            if value >= self.on_threshold:
+                self._streak[name] = self._streak.get(name, 0) + 1
+            else:
+                self._streak[name] = 0
+
+            if name not in self.active and self._streak[name] >= self.min_frames:
+                self.active[name] = frame_index
+                events.append({'event': 'alert_start', 'class': name, 'frame': frame_index,
+                               'confidence': round(value, 3)})
+            elif name in self.active and value < self.off_threshold:
+                started = self.active.pop(name)
+                events.append({'event': 'alert_end', 'class': name, 'frame': frame_index,
+                               'start_frame': started, 'confidence': round(value, 3)})
+        return events
+
+    def snapshot(self):
+        return {name: round(value, 3) for name, value in sorted(self.ema.items(), key=lambda kv: -kv[1])
+                if value >= 0.01}
+
+
+class StreamDetector:
+    """حلقة الكشف على تدفق إطارات: تخطي المكرر، ثم تجميع الإطارات الباقية في دفعات للكاشف، ثم التنعيم"""
+
+    def __init__(self, infer_fn, class_names, batch_size=8, conf_thres=0.25, differ=None, smoother=None,
+                 max_seconds=None, max_frames=None):
+        # infer_fn تستقبل قائمة صور BGR وتعيد مصفوفة كشف (n, 6) لكل صورة
+        self.infer_fn = infer_fn
+        self.class_names = class_names
+        self.batch_size = max(1, int(batch_size))
+        self.conf_thres = conf_thres
+        self.differ = differ if differ is not None else FrameDiffer()
+        self.smoother = smoother if smoother is not None else TemporalSmoother()
+        self.max_seconds = max_seconds
+        self.max_frames = max_frames
+
+        self.frames_skipped = 0
+        self.frames_processed = 0
+        self.batches = 0
+        self.inference_seconds = 0.0
+        self.elapsed_seconds = 0.0
+        self.last_frame_index = -1
+        self._reader = None
+
+    def _next_batch(self, reader):
+        """أول إطار غير مكرر بالانتظار، ثم ما هو جاهز فعلاً حتى batch_size دون انتظار إضافي"""
+        batch = []
+        finished = False
+        while len(batch) < self.batch_size:
+            if batch:
+                entry = reader.get_nowait()
+            else:
+                # انتظار محدود حتى تُفحص مهلة التدفق الحي حتى لو توقفت الكاميرا عن الإرسال
+                try:
+                    entry = reader.get(timeout=0.5)
+                except queue.Empty:
+                    entry = False
+            if entry is False:
+                break
+            if entry is None:
+                finished = True
+                break
+            index, _, frame = entry
+            self.last_frame_index = index
+            if self.differ.is_duplicate(frame):
+                self.frames_skipped += 1
+                continue
+            batch.append((index, frame))
+        return batch, finished
+
+    def run(self, reader):
+        """تشغيل الكشف حتى نهاية المصدر مع إرجاع أحداث التنبيه تباعاً"""
+        self._reader = reader
+        started = time.perf_counter()
+        try:
+            while True:
+                batch, finished = self._next_batch(reader)
+                if batch:
+                    inference_started = time.perf_counter()
+                    detections = self.infer_fn([frame for _, frame in batch])
+                    self.inference_seconds += time.perf_counter() - inference_started
+                    self.batches += 1
+                    self.frames_processed += len(batch)
+                    for (index, _), det in zip(batch, detections):
+                        for event in self.smoother.update(index, det, self.class_names, self.conf_thres):
+                            yield event
+                self.elapsed_seconds = time.perf_counter() - started
+                if finished:
+                    break
+                if self.max_seconds is not None and self.elapsed_seconds >= self.max_seconds:
+                    print(f"إيقاف التدفق بعد {self.max_seconds} ثانية")
+                    break
+                if self.max_frames is not None and self.last_frame_index + 1 >= self.max_frames:
+                    break
+        finally:
+            reader.stop()
+            self.elapsed_seconds = time.perf_counter() - started
+
+    def stats(self):
+        """الإطارات المقروءة والمهملة والمتخطاة والمعالجة، والإطارات في الثانية"""
+        reader = self._reader
+        elapsed = self.elapsed_seconds
+        frames_read = reader.frames_read if reader is not None else 0
+        return {
+            'frames_read': frames_read,
+            'frames_dropped': reader.frames_dropped if reader is not None else 0,
+            'frames_skipped': self.frames_skipped,
+            'frames_processed': self.frames_processed,
+            'batches': self.batches,
+            'mean_batch_size': round(self.frames_processed / self.batches, 2) if self.batches else 0.0,
+            'elapsed_s': round(elapsed, 3),
+            'input_fps': round(frames_read / elapsed, 2) if elapsed > 0 else 0.0,
+            'processed_fps': round(self.frames_processed / elapsed, 2) if elapsed > 0 else 0.0,
+            'inference_ms_per_frame': round(1000.0 * self.inference_seconds / self.frames_processed, 2)
+            if self.frames_processed else None,
+            'source_error': reader.error if reader is not None else None,
+        }
+
+
+def detect_stream(frames, infer_fn, class_names, live=True, queue_size=32, max_side=None, **detector_options):
+    """تشغيل مسار التدفق كاملاً وإرجاع (الأحداث، الإحصائيات، الثقة المنعمة الأخيرة)"""
+    reader = FrameReader(frames, queue_size=queue_size, drop_when_full=live, max_side=max_side).start()
+    detector = StreamDetector(infer_fn, class_names, **detector_options)
+    events = list(detector.run(reader))
+    return events, detector.stats(), detector.smoother.snapshot()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='الكشف عن أمراض النباتات في ملف فيديو أو تدفق كاميرا')
+    parser.add_argument('source', help='مسار ملف فيديو أو رقم كاميرا أو رابط تدفق (http/rtsp)')
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--diff-threshold', type=float, default=4.0, help='أقل فرق (0-255) لاعتبار الإطار جديداً')
+    parser.add_argument('--max-skip', type=int, default=30)
+    parser.add_argument('--alpha', type=float, default=0.3)
+    parser.add_argument('--alert-threshold', type=float, default=0.5)
+    parser.add_argument('--alert-frames', type=int, default=3, help='عدد الإطارات المتتالية قبل التنبيه')
+    parser.add_argument('--live', action='store_true', help='إهمال الإطارات عند تأخر الكاشف (للكاميرات الحية)')
+    parser.add_argument('--max-side', type=int, default=1280)
+    args = parser.parse_args()
+
+    import plant_disease_api as api
+
+    if api.load_model() is None:
+        raise SystemExit("النموذج غير متاح")
+
+    def on_event(event):
+        print(json.dumps(dict(event, disease=api.translate_disease_name(event['class'])), ensure_ascii=False))
+
+    reader = FrameReader(video_file_frames(args.source), drop_when_full=args.live, max_side=args.max_side).start()
+    detector = StreamDetector(api.run_batch_inference, api.get_class_names(), batch_size=args.batch_size,
+                              conf_thres=api.CONF_THRESHOLD,
+                              differ=FrameDiffer(args.diff_threshold, max_skip=args.max_skip),
+                              smoother=TemporalSmoother(args.alpha, args.alert_threshold,
+                                                        min_frames=args.alert_frames,
+                                                        ignore_classes=('plants',)))
+    try:
+        for event in detector.run(reader):
+            on_event(event)
+    except KeyboardInterrupt:
+        pass
+    print(json.dumps(detector.stats(), ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
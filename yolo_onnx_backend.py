@@ -0,0 +1,123 @@
+import ast
+import os
+
+import cv2
+import numpy as np
+
+from service_metrics import no_stage
+from yolo_postprocess import non_max_suppression
+
+
+def letterbox(img, new_size=416, color=(114, 114, 114)):
+    """تصغير الصورة مع الحفاظ على نسبة الأبعاد وإكمالها بحواف حتى new_size x new_size (كما في YOLOv5)"""
+    h, w = img.shape[:2]
+    ratio = min(new_size / h, new_size / w)
+    new_w, new_h = int(round(w * ratio)), int(round(h * ratio))
+    pad_w, pad_h = (new_size - new_w) / 2, (new_size - new_h) / 2
+    if (w, h) != (new_w, new_h):
+        img = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    top, bottom = int(round(pad_h - 0.1)), int(round(pad_h + 0.1))
+    left, right = int(round(pad_w - 0.1)), int(round(pad_w + 0.1))
+    img = cv2.copyMakeBorder(img, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color)
+    return img, ratio, (left, top)
+
+
+def preprocess_batch(images, img_size=416, bgr=True):
+    """تحويل قائمة صور OpenCV إلى مصفوفة NCHW من نوع float32 في المجال [0, 1]"""
+    batch = np.empty((len(images), 3, img_size, img_size), dtype=np.float32)
+    meta = []
+    for i, img in enumerate(images):
+        padded, ratio, pad = letterbox(img, img_size)
+        if bgr:
+            padded = cv2.cvtColor(padded, cv2.COLOR_BGR2RGB)
+        np.multiply(padded.transpose(2, 0, 1), 1 / 255.0, out=batch[i], casting='unsafe')
+        meta.append((ratio, pad, img.shape[:2]))
+    return batch, meta
+
+
+def decode_predictions(pred, conf_thres=0.25, iou_thres=0.45, max_det=300):
+    """تحويل مخرج YOLOv5 الخام (N, 5 + nc) إلى صناديق (n, 6) بعد التصفية و NMS"""
+    pred = pred[pred[:, 4] > conf_thres]
+    if len(pred) == 0:
+        return np.zeros((0, 6), dtype=np.float32)
+    scores = pred[:, 5:] * pred[:, 4:5]
+    cls = scores.argmax(axis=1)
+    conf = scores[np.arange(len(scores)), cls]
+    keep = conf > conf_thres
+    pred, cls, conf = pred[keep], cls[keep], conf[keep]
+
+    # من (cx, cy, w, h) إلى (x1, y1, x2, y2)
+    det = np.empty((len(pred), 6), dtype=np.float32)
+    det[:, 0] = pred[:, 0] - pred[:, 2] / 2
+    det[:, 1] = pred[:, 1] - pred[:, 3] / 2
+    det[:, 2] = pred[:, 0] + pred[:, 2] / 2
+    det[:, 3] = pred[:, 1] + pred[:, 3] / 2
+    det[:, 4] = conf
+    det[:, 5] = cls
+    return non_max_suppression(det, iou_thres=iou_thres, max_det=max_det)
+
+
+def scale_boxes(det, ratio, pad, orig_shape):
+    """إرجاع إحداثيات الصناديق من الصورة المعدلة إلى أبعاد الصورة الأصلية"""
+    det[:, [0, 2]] = (det[:, [0, 2]] - pad[0]) / ratio
+    det[:, [1, 3]] = (det[:, [1, 3]] - pad[1]) / ratio
+    det[:, [0, 2]] = det[:, [0, 2]].clip(0, orig_shape[1])
+    det[:, [1, 3]] = det[:, [1, 3]].clip(0, orig_shape[0])
+    return det
+
+
+class OnnxYoloDetector:
+    """تشغيل نموذج YOLOv5 المصدّر إلى ONNX عبر ONNX Runtime على المعالج مع letterbox و NMS خاصين بنا"""
+
+    def __init__(self, onnx_path, img_size=416, conf_thres=0.25, iou_thres=0.45, num_threads=None, stage=no_stage):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(onnx_path, sess_options=options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        # عند التصدير بدون --dynamic يكون حجم الدفعة ثابتاً (1)
+        batch_dim = self.session.get_inputs()[0].shape[0]
+        self.static_batch = batch_dim if isinstance(batch_dim, int) else None
+
+        self.onnx_path = onnx_path
+        self.img_size = img_size
+        self.conf = conf_thres
+        self.iou = iou_thres
+        self.stage = stage  # مقياس زمن المراحل (ServiceMetrics.stage)
+        self.names = self._read_names()
+
+    def _read_names(self):
+        """أسماء الفئات التي يخزنها export.py في بيانات النموذج الوصفية"""
+        try:
+            names = self.session.get_modelmeta().custom_metadata_map.get('names')
+            return ast.literal_eval(names) if names else []
+        except Exception:
+            return []
+
+    def _forward(self, batch):
+        if self.static_batch and len(batch) != self.static_batch:
+            return np.concatenate([self.session.run(None, {self.input_name: batch[i:i + 1]})[0]
+                                   for i in range(len(batch))])
+        return self.session.run(None, {self.input_name: batch})[0]
+
+    def __call__(self, images):
+        """كشف على قائمة صور BGR وإرجاع مصفوفة (n, 6) لكل صورة بإحداثيات الصورة الأصلية"""
+        with self.stage('preprocess'):
+            batch, meta = preprocess_batch(images, self.img_size)
+        with self.stage('forward'):
+            preds = self._forward(batch)
+        outputs = []
+        with self.stage('nms'):
+            for pred, (ratio, pad, shape) in zip(preds, meta):
+                det = decode_predictions(pred, self.conf, self.iou)
+                outputs.append(scale_boxes(det, ratio, pad, shape))
+        return outputs
+
+
+def default_onnx_path(weights_path, int8=False):
+    """مسار ملف ONNX بجانب best.pt (best.onnx أو best-int8.onnx)"""
+    base = os.path.splitext(weights_path)[0]
+    return base + ('-int8.onnx' if int8 else '.onnx')
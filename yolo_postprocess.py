@@ -0,0 +1,112 @@
+import numpy as np
+
+# أعمدة مصفوفة الكشف الخام لـ YOLOv5: x1, y1, x2, y2, confidence, class
+BOX_COLUMNS = ['x1', 'y1', 'x2', 'y2', 'confidence', 'class']
+
+
+def detections_to_numpy(det):
+    """تحويل مصفوفة الكشف (torch.Tensor أو numpy) إلى numpy بشكل (n, 6) دون المرور بـ pandas"""
+    if det is None:
+        return np.zeros((0, 6), dtype=np.float32)
+    if hasattr(det, 'detach'):
+        det = det.detach().cpu().numpy()
+    det = np.asarray(det, dtype=np.float32)
+    return det.reshape(-1, 6)
+
+
+def filter_by_confidence(det, conf_thres):
+    """إبقاء الصناديق التي تتجاوز عتبة الثقة فقط"""
+    if conf_thres <= 0 or len(det) == 0:
+        return det
+    return det[det[:, 4] >= conf_thres]
+
+
+def class_name(class_index, class_names, default='plants'):
+    """تحويل مؤشر الفئة إلى اسمها (قائمة data.yaml أو قاموس names في YOLOv5)"""
+    if isinstance(class_names, dict):
+        return class_names.get(class_index, default)
+    if 0 <= class_index < len(class_names):
+        return class_names[class_index]
+    return default
+
+
+def aggregate_by_class(det):
+    """تجميع الصناديق حسب الفئة: أعلى ثقة ومتوسطها وعدد الصناديق لكل فئة"""
+    if len(det) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0), np.zeros(0, dtype=np.int64)
+    classes = det[:, 5].astype(np.int64)
+    unique, inverse, counts = np.unique(classes, return_inverse=True, return_counts=True)
+    max_conf = np.zeros(len(unique), dtype=np.float32)
+    np.maximum.at(max_conf, inverse, det[:, 4])
+    mean_conf = np.bincount(inverse, weights=det[:, 4]) / counts
+    return unique, max_conf, mean_conf, counts
+
+
+def summarize_detections(det, class_names, conf_thres=0.0, top_k=3, return_boxes=False):
+    """تلخيص نتائج الكشف: تصفية بالثقة، تجميع لكل فئة، واختيار أعلى k أمراض"""
+    det = filter_by_confidence(detections_to_numpy(det), conf_thres)
+    unique, max_conf, mean_conf, counts = aggregate_by_class(det)
+
+    # ترتيب الفئات تنازلياً حسب أعلى ثقة
+    order = np.argsort(-max_conf)[:top_k] if top_k else np.argsort(-max_conf)
+    classes = [{
+        'class_index': int(unique[i]),
+        'name': class_name(int(unique[i]), class_names),
+        'confidence': float(max_conf[i]),
+        'mean_confidence': float(mean_conf[i]),
+        'count': int(counts[i]),
+    } for i in order]
+
+    summary = {'classes': classes, 'num_boxes': int(len(det))}
+    if return_boxes:
+        summary['boxes'] = boxes_to_compact(det)
+    return summary
+
+
+def boxes_to_compact(det):
+    """تمثيل مضغوط للصناديق: [x1, y1, x2, y2, confidence, class] لكل صندوق"""
+    return [[int(round(x1)), int(round(y1)), int(round(x2)), int(round(y2)), round(float(conf), 4), int(cls)]
+            for x1, y1, x2, y2, conf, cls in det.tolist()]
+
+
+def _box_overlap(box, boxes):
+    x1 = np.maximum(box[0], boxes[:, 0])
+    y1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[2], boxes[:, 2])
+    y2 = np.minimum(box[3], boxes[:, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return inter, area, areas
+
+
+def box_iou(box, boxes):
+    """تقاطع على اتحاد (IoU) بين صندوق واحد ومجموعة صناديق بصيغة x1, y1, x2, y2"""
+    inter, area, areas = _box_overlap(box, boxes)
+    return inter / np.maximum(area + areas - inter, 1e-9)
+
+
+def box_ios(box, boxes):
+    """تقاطع على مساحة الصندوق الأصغر (IoS): 1 عندما يقع أحدهما داخل الآخر"""
+    inter, area, areas = _box_overlap(box, boxes)
+    return inter / np.maximum(np.minimum(area, areas), 1e-9)
+
+
+def non_max_suppression(det, iou_thres=0.45, max_det=300, agnostic=False, metric='iou'):
+    """حذف الصناديق المتداخلة لكل فئة على حدة (n, 6) -> (m, 6) مرتبة تنازلياً بالثقة
+    metric='ios' يحذف أيضاً الأجزاء الواقعة داخل صندوق أكبر (دمج نتائج المربعات مع الصورة كاملة)"""
+    if len(det) == 0:
+        return det
+    # إزاحة الصناديق حسب الفئة حتى لا تتداخل صناديق فئات مختلفة (نفس أسلوب YOLOv5)
+    offsets = 0 if agnostic else det[:, 5:6] * 7680.0
+    boxes = det[:, :4] + offsets
+    order = np.argsort(-det[:, 4])
+    keep = []
+    while order.size and len(keep) < max_det:
+        i = order[0]
+        keep.append(i)
+        if order.size == 1:
+            break
+        ious = (box_ios if metric == 'ios' else box_iou)(boxes[i], boxes[order[1:]])
+        order = order[1:][ious <= iou_thres]
+    return det[keep]